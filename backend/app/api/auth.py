@@ -3,13 +3,14 @@ from firebase_admin import auth
 
 from ..models.user import UserCreate, UserLogin, Token, UserInDB
 from ..services.auth_service import AuthService
-from ..services.firebase_service import FirebaseService
+from ..services.storage import StorageService
 from ..core.dependencies import get_firebase_service
+from ..core.security import get_current_user, invalidate_user
 
 router = APIRouter()
 
 @router.post("/register", response_model=UserInDB, status_code=status.HTTP_201_CREATED)
-def register(user_create: UserCreate, firebase_service: FirebaseService = Depends(get_firebase_service)):
+def register(user_create: UserCreate, firebase_service: StorageService = Depends(get_firebase_service)):
     """
     Register a new user. Creates an account in Firebase Auth and a user profile in Firestore.
     """
@@ -27,4 +28,13 @@ def register(user_create: UserCreate, firebase_service: FirebaseService = Depend
 # 1. Client uses Firebase SDK to sign in with email/password.
 # 2. Firebase SDK on the client receives the JWT (ID token).
 # 3. Client sends this JWT in the Authorization header for all subsequent API requests.
-# This backend is built to expect that JWT. No separate /login endpoint is needed on the backend.
\ No newline at end of file
+# This backend is built to expect that JWT. No separate /login endpoint is needed on the backend.
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout(current_user: UserInDB = Depends(get_current_user)):
+    """
+    Signs the user out on every device: revokes their Firebase refresh tokens, so ID
+    tokens already issued stop being accepted, and drops the cached ones.
+    """
+    auth.revoke_refresh_tokens(current_user.uid)
+    invalidate_user(current_user.uid)
@@ -1,11 +1,15 @@
 # File: chatbot/backend/api/chat.py (Updated)
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from typing import List, Optional
+import datetime
 
-from ..models.chat import Chat, ChatCreate
-from ..models.message import Message
+from ..config import settings
+
+from ..models.chat import Chat, ChatCreate, SearchHit, chat_list_adapter, search_hit_list_adapter
+from ..models.message import Message, message_list_adapter
 from ..models.user import UserInDB
+from ..core.responses import cache_headers, etag_matches, json_list_response, json_response, make_etag, not_modified
 from ..core.security import get_current_user
 from ..core.dependencies import get_chat_service
 from ..services.chat_service import ChatService
@@ -22,14 +26,76 @@ def create_new_chat(
     chat = chat_service.create_chat(user=current_user, chat_create=chat_create)
     return chat
 
-@router.get("/", response_model=List[Chat])
+# Listing endpoints are cursor-paginated. The body stays a plain JSON array; when
+# more items exist, the opaque cursor for the next page is returned in this header.
+# They also answer conditional requests: each page has an ETag, and a request whose
+# If-None-Match still matches gets a 304 without the list being read.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+NOT_MODIFIED_RESPONSE = {status.HTTP_304_NOT_MODIFIED: {"description": "The page is unchanged since the ETag in If-None-Match"}}
+
+def _list_headers(etag: Optional[str], next_cursor: Optional[str]) -> dict[str, str]:
+    headers = cache_headers(etag)
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    return headers
+
+@router.get("/", response_model=List[Chat], responses=NOT_MODIFIED_RESPONSE)
 def get_user_chats(
+    limit: int = Query(settings.DEFAULT_PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="Cursor from a previous page's X-Next-Cursor header"),
+    sort: str = Query("createdAt", description="Newest first by `createdAt` or by `lastMessageAt`"),
+    active_since: Optional[datetime.datetime] = Query(
+        None, description="Only chats with a message at or after this time; needs sort=lastMessageAt"
+    ),
+    if_none_match: Optional[str] = Header(None, description="ETag of a previously fetched copy of this page"),
     current_user: UserInDB = Depends(get_current_user),
     chat_service: ChatService = Depends(get_chat_service)
 ):
-    """Retrieves all chat sessions for the authenticated user."""
-    chats = chat_service.get_chats_for_user(user=current_user)
-    return chats
+    """
+    Retrieves the authenticated user's chat sessions, newest first, one page at a time.
+    Each chat carries its latest message's time, role and a preview, so a chat list
+    (ordered by recent activity with sort=lastMessageAt) needs no message reads.
+    """
+    # The user's chatsVersion moves with every new chat and message, so it versions every page.
+    version = chat_service.get_chats_version(user=current_user)
+    etag = make_etag("chats", current_user.uid, version, limit, after, sort, active_since) if version is not None else None
+    if etag and etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    try:
+        chats, next_cursor = chat_service.get_chats_page(
+            user=current_user, limit=limit, after=after, sort=sort, active_since=active_since
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return json_list_response(chat_list_adapter, chats, headers=_list_headers(etag, next_cursor))
+
+@router.get("/search", response_model=List[SearchHit], responses=NOT_MODIFIED_RESPONSE)
+def search_chats(
+    q: str = Query(..., min_length=1, max_length=500, description="Words to look for in the user's messages"),
+    limit: int = Query(settings.SEARCH_PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="Cursor from a previous page's X-Next-Cursor header"),
+    if_none_match: Optional[str] = Header(None, description="ETag of a previously fetched copy of this page"),
+    current_user: UserInDB = Depends(get_current_user),
+    chat_service: ChatService = Depends(get_chat_service)
+):
+    """
+    Full-text search across all of the authenticated user's chats. Returns the
+    matching messages, best match first, each with its chat and a snippet.
+    """
+    # searchVersion moves only once new postings are written, so results are never
+    # cached under a version that is newer than the index they were read from.
+    version = chat_service.get_search_version(user=current_user)
+    etag = make_etag("search", current_user.uid, version, q, limit, after) if version is not None else None
+    if etag and etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    try:
+        hits, next_cursor = chat_service.search_messages(
+            user=current_user, query=q, limit=limit, after=after, version=version
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return json_list_response(search_hit_list_adapter, hits, headers=_list_headers(etag, next_cursor))
 
 @router.get("/{chat_id}", response_model=Chat)
 def get_single_chat(
@@ -41,18 +107,34 @@ def get_single_chat(
     chat = chat_service.get_chat_if_user_has_access(chat_id=chat_id, user=current_user)
     if not chat:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found or access denied")
-    return chat
+    return json_response(chat)
 
-@router.get("/{chat_id}/messages", response_model=List[Message])
+@router.get("/{chat_id}/messages", response_model=List[Message], responses=NOT_MODIFIED_RESPONSE)
 def get_chat_messages(
     chat_id: str,
+    limit: int = Query(settings.DEFAULT_PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    before: Optional[str] = Query(None, description="Cursor to page towards older messages"),
+    after: Optional[str] = Query(None, description="Cursor to page towards newer messages"),
+    if_none_match: Optional[str] = Header(None, description="ETag of a previously fetched copy of this page"),
     current_user: UserInDB = Depends(get_current_user),
     chat_service: ChatService = Depends(get_chat_service)
 ):
-    """Retrieves all messages for a specific chat, validating user access first."""
-    chat = chat_service.get_chat_if_user_has_access(chat_id=chat_id, user=current_user)
+    """
+    Retrieves a page of messages for a specific chat, validating user access first.
+    Without a cursor the newest `limit` messages are returned (in chronological order);
+    X-Next-Cursor then pages further back via `before`, or forward when paging with `after`.
+    """
+    # Read past the chat cache: the ETag must reflect messages other workers have added.
+    chat = chat_service.get_chat_if_user_has_access(chat_id=chat_id, user=current_user, fresh=True)
     if not chat:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found or access denied")
-    
-    messages = chat_service.get_messages(chat_id=chat_id, user_id=current_user.uid)
-    return messages
\ No newline at end of file
+
+    # Messages are append-only, so the chat's messageCount versions every page of them.
+    etag = make_etag("messages", chat_id, chat.messageCount, limit, before, after)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    try:
+        messages, next_cursor = chat_service.get_messages_page(chat_id=chat_id, limit=limit, before=before, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return json_list_response(message_list_adapter, messages, headers=_list_headers(etag, next_cursor))
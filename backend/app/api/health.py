@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from ..core.startup import startup_report
+
+router = APIRouter()
+
+@router.get("/ready")
+def get_ready(request: Request):
+    """
+    Readiness probe: 503 until startup (including the warm-up, when enabled) has
+    finished, 200 afterwards. Both carry the startup timing breakdown.
+    """
+    ready = getattr(request.app.state, "ready", False)
+    return JSONResponse(
+        {"status": "ready" if ready else "starting", "startup": startup_report.as_dict()},
+        status_code=200 if ready else 503,
+    )
@@ -99,37 +99,32 @@
 
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query, status
-from firebase_admin import auth
-import json
-from ..models.message import WebsocketMessage
-from ..core.dependencies import get_chat_service, get_firebase_service
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import datetime
+import logging
+import time
+from ..config import settings
+from ..models.message import AckFrame, ResumeFrame, SendFrame, StopFrame, StreamDelta, StreamFinal
+from ..core import tracing
+from ..core.dependencies import get_chat_service, get_connection_manager, get_firebase_service
+from ..core.metrics import registry
+from ..core.security import verify_token
 from ..services.chat_service import ChatService
-from ..services.firebase_service import FirebaseService
+from ..services.connection_manager import ConnectionManager
+from ..services.protocol import negotiate
+from ..services.storage import StorageService
 
 router = APIRouter()
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, list[WebSocket]] = {}
+logger = logging.getLogger(__name__)
 
-    async def connect(self, websocket: WebSocket, chat_id: str):
-        await websocket.accept()
-        if chat_id not in self.active_connections:
-            self.active_connections[chat_id] = []
-        self.active_connections[chat_id].append(websocket)
-
-    def disconnect(self, websocket: WebSocket, chat_id: str):
-        if chat_id in self.active_connections:
-            self.active_connections[chat_id].remove(websocket)
-            if not self.active_connections[chat_id]:
-                del self.active_connections[chat_id]
-
-    async def broadcast(self, message: str, chat_id: str):
-        if chat_id in self.active_connections:
-            for connection in self.active_connections[chat_id]:
-                await connection.send_text(message)
-
-manager = ConnectionManager()
+WS_TURN_SECONDS = registry.histogram(
+    "ws_turn_seconds", "WebSocket turns from prompt to final frame, by outcome (completed, stopped, error).", ["outcome"]
+)
+WS_RESUMES = registry.counter(
+    "ws_resumes_total", "Sockets caught up on missed messages, by where they came from (buffer, storage).", ["source"]
+)
 
 async def get_token_from_query(
     websocket: WebSocket,
@@ -141,21 +136,67 @@ async def get_token_from_query(
         return None
     return token
 
+async def receive_frame(websocket: WebSocket) -> str | bytes:
+    """Receives the next text or binary frame."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+    return message["text"] if message.get("text") is not None else message["bytes"]
+
+async def send_missed(
+    websocket: WebSocket,
+    chat_id: str,
+    after: datetime.datetime,
+    after_id: str | None,
+    manager: ConnectionManager,
+    firebase_service: StorageService
+):
+    """
+    Sends one socket the chat messages newer than its last seen one: from this
+    worker's resume buffer when it reaches back that far, else from storage, a page
+    at a time; each page is sized to half the socket's send queue and sent once the
+    previous one is out, so a long gap doesn't trip the slow-consumer policy.
+    Storage lacks the user message of a turn still in progress (a turn is saved in
+    one batch when the reply is done); the turn sends it again at the end to sockets
+    that connected after it. Anything broadcast meanwhile may arrive twice, or ahead
+    of older missed messages; clients skip ids they already have.
+    """
+    if manager.replay(websocket, chat_id, after, after_id):
+        WS_RESUMES.inc(source="buffer")
+        return
+    WS_RESUMES.inc(source="storage")
+    page_size = max(1, min(settings.MAX_PAGE_SIZE, manager.max_queue // 2))
+    while True:
+        messages, has_more = await firebase_service.alist_messages(
+            chat_id, page_size, after=after, after_id=after_id
+        )
+        for saved in messages:
+            manager.send(websocket, chat_id, saved.model_dump_json())
+        if not has_more or not messages:
+            return
+        after, after_id = messages[-1].timestamp, messages[-1].id
+        if not await manager.drain(websocket, chat_id):
+            return
+
 @router.websocket("/ws/{chat_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     chat_id: str,
+    stream: bool = Query(False),
+    after: datetime.datetime | None = Query(None, description="Timestamp of the last message the client has; newer ones are sent on connect"),
+    after_id: str | None = Query(None, description="Id of that message"),
     token: str = Depends(get_token_from_query),
     chat_service: ChatService = Depends(get_chat_service),
-    firebase_service: FirebaseService = Depends(get_firebase_service)
+    firebase_service: StorageService = Depends(get_firebase_service),
+    manager: ConnectionManager = Depends(get_connection_manager)
 ):
     if not token:
         return
 
     try:
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = await run_in_threadpool(verify_token, token)
         user_id = decoded_token['uid']
-        chat = firebase_service.get_chat(chat_id=chat_id, user_id=user_id)
+        chat = await firebase_service.aget_chat(chat_id=chat_id, user_id=user_id)
         if not chat:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Access denied or chat not found")
             return
@@ -163,37 +204,92 @@ async def websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=f"Authentication failed: {e}")
         return
 
-    await manager.connect(websocket, chat_id)
-    print(f"✅ [1/7] User '{user_id}' connected successfully to chat '{chat_id}'.")
-    
+    codec, subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+    await manager.connect(websocket, chat_id, streaming=stream, codec=codec, subprotocol=subprotocol)
+    if after is not None:
+        # A reconnect: catch up on what was broadcast while the client was away.
+        await send_missed(websocket, chat_id, after, after_id, manager, firebase_service)
+    await chat_service.warm_history(chat_id, user_id)
+    logger.debug("User %s connected to chat %s (streaming=%s).", user_id, chat_id, stream)
+
+    # Turns run one at a time in a worker task, so the socket keeps being read while a
+    # reply is generated: a stop frame or a disconnect ends the turn in progress, and
+    # its partial reply is saved as truncated instead of paying for the full generation.
+    prompts: asyncio.Queue[SendFrame | None] = asyncio.Queue()
+    stop = asyncio.Event()
+
+    async def run_turns():
+        try:
+            while True:
+                message = await prompts.get()
+                if message is None:
+                    return
+                stop.clear()
+                # --- START OF MESSAGE PROCESSING ---
+                start = time.perf_counter()
+                outcome = "error"
+                user_message = None
+                try:
+                    with tracing.start_trace("chat.turn", chat_id=chat_id, streaming=stream) as span:
+                        async for event in chat_service.stream_user_message(
+                            chat_id=chat_id,
+                            user_id=user_id,
+                            user_message_content=message.content,
+                            stop=stop
+                        ):
+                            if isinstance(event, StreamDelta):
+                                await manager.broadcast(event.model_dump_json(), chat_id, streaming=True, transient=True)
+                            elif isinstance(event, StreamFinal):
+                                span.set_attribute("chunks", event.seq)
+                                # The user message is saved only now, with the reply; sockets that
+                                # joined since it was broadcast may have caught up from storage without it.
+                                await manager.broadcast(user_message.model_dump_json(), chat_id, missed_only=True)
+                                await manager.broadcast(event.model_dump_json(), chat_id, streaming=True)
+                                # Plain clients never saw the deltas; they get the whole message at once.
+                                await manager.broadcast(event.message.model_dump_json(), chat_id, streaming=False, replay=True)
+                            else:
+                                user_message = event
+                                await manager.broadcast(event.model_dump_json(), chat_id, replay=True)
+                                if message.ref is not None:
+                                    ack = AckFrame(ref=message.ref, messageId=event.id)
+                                    manager.send(websocket, chat_id, ack.model_dump_json())
+                    outcome = "stopped" if stop.is_set() else "completed"
+                finally:
+                    WS_TURN_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+                # --- END OF MESSAGE PROCESSING ---
+        except Exception:
+            logger.exception("An error occurred in websocket for chat %s", chat_id)
+            try:
+                await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+            except Exception:
+                pass
+
+    worker = asyncio.create_task(run_turns())
     try:
         while True:
-            # --- START OF MESSAGE PROCESSING ---
-            data = await websocket.receive_text()
-            print(f"✅ [2/7] Received text from client: '{data}'")
-
-            message = WebsocketMessage(content=data)
-            
-            print(f"✅ [3/7] Calling ChatService to process the message.")
-            user_msg, ai_msg = chat_service.process_user_message(
-                chat_id=chat_id,
-                user_id=user_id,
-                user_message_content=message.content
-            )
-            print(f"✅ [4/7] ChatService returned. User Msg ID: {user_msg.id}, AI Msg ID: {ai_msg.id}")
-            
-            print(f"✅ [5/7] Broadcasting USER message back to client. Content: '{user_msg.content}'")
-            await manager.broadcast(user_msg.model_dump_json(), chat_id)
-            
-            print(f"✅ [6/7] Broadcasting AI message back to client. Content: '{ai_msg.content[:50]}...'") # Log first 50 chars
-            await manager.broadcast(ai_msg.model_dump_json(), chat_id)
-            
-            print(f"✅ [7/7] Broadcast complete. Waiting for next message.")
-            # --- END OF MESSAGE PROCESSING ---
+            frame = codec.decode(await receive_frame(websocket))
+            if isinstance(frame, SendFrame):
+                await prompts.put(frame)
+            elif isinstance(frame, StopFrame):
+                stop.set()
+            elif isinstance(frame, ResumeFrame):
+                # Only this socket missed the messages; the others get nothing.
+                await send_missed(websocket, chat_id, frame.after, frame.afterId, manager, firebase_service)
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket, chat_id)
-        print(f"🔌 User {user_id} disconnected from chat {chat_id}")
-    except Exception as e:
-        print(f"❌ An error occurred in websocket for chat {chat_id}: {e}")
-        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
\ No newline at end of file
+        logger.debug("User %s disconnected from chat %s.", user_id, chat_id)
+    except Exception:
+        logger.exception("An error occurred in websocket for chat %s", chat_id)
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+    finally:
+        # Drop turns that haven't started and stop the one in progress; it still
+        # saves (and broadcasts to the chat's other sockets) what was generated. The
+        # shield keeps it doing so when this handler is cancelled rather than disconnected.
+        while not prompts.empty():
+            prompts.get_nowait()
+        prompts.put_nowait(None)
+        stop.set()
+        try:
+            await asyncio.shield(worker)
+        finally:
+            await manager.disconnect(websocket, chat_id)
@@ -11,6 +11,131 @@ class Settings(BaseSettings):
     GOOGLE_API_KEY: str = os.getenv("GOOGLE_API_KEY")
     FIREBASE_SERVICE_ACCOUNT_PATH: str = os.getenv("FIREBASE_SERVICE_ACCOUNT_PATH", "firebase-service-account.json")
 
+    # Auth caches used by get_current_user. Token entries never outlive the token's own `exp`.
+    TOKEN_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_TTL_SECONDS: float = 300
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: float = 60
+
+    # Where users, chats and messages are stored: "firestore", or "sqlite" for a local
+    # database file at SQLITE_PATH (":memory:" for a throwaway one) served from a pool
+    # of SQLITE_POOL_SIZE connections. Firebase Auth still verifies tokens either way.
+    STORAGE_BACKEND: str = "firestore"
+    SQLITE_PATH: str = "data/chatbot.db"
+    SQLITE_POOL_SIZE: int = 8
+
+    # Chat documents (owner, title, counters) cached by the storage service for access checks.
+    CHAT_CACHE_SIZE: int = 10000
+    CHAT_CACHE_TTL_SECONDS: float = 60
+
+    # Per-chat message history kept in memory for the WebSocket turn path. Summaries keep
+    # it under half of HISTORY_CACHE_MAX_MESSAGES; the oldest beyond the cap are dropped.
+    HISTORY_CACHE_MAX_CHATS: int = 1000
+    HISTORY_CACHE_MAX_MESSAGES: int = 200
+    HISTORY_CACHE_TTL_SECONDS: float = 1800
+
+    # LLM context window. History beyond CONTEXT_TOKEN_BUDGET is folded into a rolling
+    # summary until CONTEXT_RECENT_TOKENS of recent turns remain verbatim.
+    CONTEXT_TOKEN_BUDGET: int = 6000
+    CONTEXT_RECENT_TOKENS: int = 3000
+    CONTEXT_CHARS_PER_TOKEN: float = 4.0
+
+    # Optional cache of assistant replies for repeated prompts with little or no history.
+    # The semantic layer embeds prompts (one embedding call per cache miss) and needs numpy.
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_SEMANTIC: bool = False
+    RESPONSE_CACHE_SIZE: int = 5000
+    RESPONSE_CACHE_TTL_SECONDS: float = 3600
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+    RESPONSE_CACHE_MAX_CONTEXT_TOKENS: int = 256
+    RESPONSE_CACHE_EMBEDDING_MODEL: str = "models/embedding-001"
+
+    # Pub/sub used to fan WebSocket frames out across workers and nodes:
+    # "memory://" (single process) or a Redis URL such as "redis://localhost:6379/0".
+    BROADCAST_URL: str = "memory://"
+
+    # Outbound frames queued per WebSocket, and what to do with a client that falls
+    # that far behind: "drop" new frames, "coalesce" (discard queued stream deltas,
+    # which the final frame supersedes) or "disconnect" it.
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SLOW_CONSUMER_POLICY: str = "coalesce"
+
+    # Binary (chat.msgpack.v1) WebSocket frames of at least this many bytes are sent
+    # zlib-compressed; 0 turns that off. JSON stays the default protocol.
+    WS_COMPRESS_MIN_BYTES: int = 1024
+
+    # Reconnecting sockets are caught up from the last WS_RESUME_BUFFER_SIZE messages
+    # of each chat kept in memory, falling back to the database. A chat's buffer (and
+    # its broadcast subscription) outlives its last socket by WS_RESUME_LINGER_SECONDS,
+    # so a client that drops and comes back within that window is served from memory.
+    WS_RESUME_BUFFER_SIZE: int = 100
+    WS_RESUME_LINGER_SECONDS: float = 60.0
+
+    # Model routing: prompts (history included) estimated at LLM_FAST_MODEL_MAX_TOKENS
+    # or less go to LLM_FAST_MODEL when it is set. A request with no output by the
+    # model's LLM_HEDGE_PERCENTILE latency (LLM_HEDGE_DEFAULT_DELAY_SECONDS until
+    # LLM_HEDGE_MIN_SAMPLES requests have been seen) is hedged with a second one to
+    # LLM_HEDGE_MODEL (empty = the same model); the slower of the two is cancelled.
+    LLM_MODEL: str = "gemini-1.5-flash-latest"
+    LLM_FAST_MODEL: str = ""
+    LLM_FAST_MODEL_MAX_TOKENS: int = 500
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_MODEL: str = ""
+    LLM_HEDGE_PERCENTILE: float = 95.0
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_HEDGE_DEFAULT_DELAY_SECONDS: float = 3.0
+
+    # Admission control for Gemini calls: concurrent calls, token budget per minute
+    # (0 = unlimited) and retries with jittered backoff on rate-limit errors.
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_TOKENS_PER_MINUTE: int = 0
+    LLM_MAX_RETRIES: int = 3
+    LLM_RETRY_BASE_DELAY_SECONDS: float = 0.5
+    LLM_RETRY_MAX_DELAY_SECONDS: float = 8.0
+
+    # Cursor pagination for the chat and message listing endpoints.
+    DEFAULT_PAGE_SIZE: int = 100
+    MAX_PAGE_SIZE: int = 500
+    # List responses of at least this many items are streamed as a JSON array,
+    # RESPONSE_STREAM_CHUNK_ITEMS items per chunk.
+    RESPONSE_STREAM_MIN_ITEMS: int = 200
+    RESPONSE_STREAM_CHUNK_ITEMS: int = 50
+    # Characters of the latest message kept on each chat as its lastMessagePreview.
+    CHAT_PREVIEW_CHARS: int = 120
+
+    # Full-text search over a user's messages (GET /api/chats/search), ranked with
+    # BM25 (SEARCH_BM25_K1, SEARCH_BM25_B).
+    SEARCH_PAGE_SIZE: int = 20
+    SEARCH_MAX_QUERY_TERMS: int = 10
+    SEARCH_SNIPPET_CHARS: int = 160
+    SEARCH_BM25_K1: float = 1.2
+    SEARCH_BM25_B: float = 0.75
+    # Ranked results are cached per (user, searchVersion, query terms), so paging
+    # through them reads no postings after the first page.
+    SEARCH_RESULTS_CACHE_SIZE: int = 1000
+    SEARCH_RESULTS_CACHE_TTL_SECONDS: float = 300
+    # Firestore: messages are indexed in the background, each user's written at most
+    # every SEARCH_INDEX_DELAY_SECONDS (up to SEARCH_INDEX_MAX_PENDING queued, beyond
+    # which they are left for the next rebuild). A term's postings are sealed into
+    # chunks of SEARCH_INDEX_CHUNK_POSTINGS, and a search reads at most the newest
+    # SEARCH_MAX_CHUNKS_PER_TERM chunks of each term.
+    SEARCH_INDEX_DELAY_SECONDS: float = 5.0
+    SEARCH_INDEX_MAX_PENDING: int = 10000
+    SEARCH_INDEX_CHUNK_POSTINGS: int = 1000
+    SEARCH_MAX_CHUNKS_PER_TERM: int = 4
+
+    # Cold start: with STARTUP_WARMUP the clients are created and connected in the
+    # background right after startup, and GET /ready answers 503 until that is done
+    # (each step bounded by STARTUP_WARMUP_TIMEOUT_SECONDS). Without it they are
+    # created by the first request.
+    STARTUP_WARMUP: bool = True
+    STARTUP_WARMUP_TIMEOUT_SECONDS: float = 10.0
+
+    # Observability: log level for the app's loggers, and the fraction of WebSocket
+    # turns traced through OpenTelemetry (exported only when an SDK is configured).
+    LOG_LEVEL: str = "INFO"
+    TRACE_SAMPLE_RATE: float = 0.0
+
     class Config:
         case_sensitive = True
         env_file = ".env"
@@ -1,8 +1,11 @@
 import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from firebase_admin import credentials, auth
 from ..config import settings
 import os
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 def initialize_firebase():
     """
@@ -12,25 +15,27 @@ def initialize_firebase():
         # Check if the app is already initialized to prevent re-initialization error
         firebase_creds_json = os.getenv("FIREBASE_CREDENTIALS_JSON")
         if firebase_creds_json:
-            print("Found FIREBASE_CREDENTIALS_JSON. Initializing Firebase from environment variable.")
+            logger.info("Found FIREBASE_CREDENTIALS_JSON. Initializing Firebase from environment variable.")
             creds_dict = json.loads(firebase_creds_json)
             cred = credentials.Certificate(creds_dict)
             firebase_admin.initialize_app(cred)
-            print("Firebase Admin SDK initialized successfully.")
+            logger.info("Firebase Admin SDK initialized successfully.")
         else:
-            print("Firebase Admin SDK already initialized.")
+            logger.info("Firebase Admin SDK already initialized.")
     except Exception as e:
-        print(f"Error initializing Firebase Admin SDK: {e}")
+        logger.error("Error initializing Firebase Admin SDK: %s", e)
         raise
 
 def get_db():
     """
     FastAPI dependency to get a Firestore client instance.
     """
+    # Deferred: the Firestore SDK is heavy and SQLite deployments never need it.
+    from firebase_admin import firestore
     try:
         return firestore.client()
     except Exception as e:
-        print(f"Error getting Firestore client: {e}")
+        logger.warning("Error getting Firestore client: %s", e)
         # Attempt to re-initialize if not available
         initialize_firebase()
         return firestore.client()
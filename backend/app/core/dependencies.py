@@ -1,22 +1,178 @@
 # File: chatbot/backend/core/dependencies.py (Updated)
 
-from fastapi import Depends
-from google.cloud.firestore_v1.client import Client
+import asyncio
+import logging
+import threading
 
+from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import HTTPConnection
+
+from ..config import settings
 from ..core.database import get_db
-from ..services.firebase_service import FirebaseService
+from ..core.startup import startup_report
+from ..services.storage import StorageService
 from ..services.langchain_service import LangChainService
-from ..services.chat_service import ChatService # <-- Add this import
+from ..services.llm_scheduler import LLMScheduler
+from ..services.chat_service import ChatService
+from ..services.history_cache import HistoryCache
+from ..services.response_cache import ResponseCache
+from ..services.broadcast import create_broadcast
+from ..services.connection_manager import ConnectionManager
+
+# --- Process-wide lifecycle ---
+# The storage client, the Gemini client and the services wrapping them are
+# created once per process and kept on `app.state`. Both clients hold pooled
+# gRPC channels, so every request reuses the same connections instead of paying
+# for a new client (and a new TLS handshake) each time.
+#
+# The storage engine and the Gemini SDK are only imported when the services are
+# created: by the startup warm-up (STARTUP_WARMUP), or else by the first request.
+
+logger = logging.getLogger(__name__)
+
+_init_lock = threading.Lock()
+
+def create_storage() -> tuple[object | None, StorageService]:
+    """The storage service named by STORAGE_BACKEND, with its Firestore client (None for SQLite)."""
+    if settings.STORAGE_BACKEND == "sqlite":
+        from ..services.sqlite_service import SQLiteService
+        return None, SQLiteService(settings.SQLITE_PATH, pool_size=settings.SQLITE_POOL_SIZE)
+    from ..services.firebase_service import FirebaseService
+    db = get_db()
+    return db, FirebaseService(db)
+
+def init_services(app: FastAPI) -> None:
+    """Creates the shared clients and services. Called once, by the warm-up or the first request."""
+    with startup_report.phase("storage_client"):
+        db, firebase_service = create_storage()
+    with startup_report.phase("llm_client"):
+        langchain_service = LangChainService(scheduler=LLMScheduler(
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+            max_retries=settings.LLM_MAX_RETRIES,
+            retry_base_delay=settings.LLM_RETRY_BASE_DELAY_SECONDS,
+            retry_max_delay=settings.LLM_RETRY_MAX_DELAY_SECONDS,
+        ))
+    app.state.db = db
+    app.state.firebase_service = firebase_service
+    app.state.langchain_service = langchain_service
+    app.state.history_cache = HistoryCache(
+        max_chats=settings.HISTORY_CACHE_MAX_CHATS,
+        max_messages=settings.HISTORY_CACHE_MAX_MESSAGES,
+        ttl=settings.HISTORY_CACHE_TTL_SECONDS,
+    )
+    app.state.response_cache = None
+    if settings.RESPONSE_CACHE_ENABLED:
+        app.state.response_cache = ResponseCache(
+            maxsize=settings.RESPONSE_CACHE_SIZE,
+            ttl=settings.RESPONSE_CACHE_TTL_SECONDS,
+            similarity_threshold=settings.RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+            max_context_tokens=settings.RESPONSE_CACHE_MAX_CONTEXT_TOKENS,
+            embeddings=langchain_service.create_embeddings() if settings.RESPONSE_CACHE_SEMANTIC else None,
+        )
+    app.state.chat_service = ChatService(
+        firebase_service,
+        langchain_service,
+        history_cache=app.state.history_cache,
+        response_cache=app.state.response_cache,
+    )
+
+def ensure_services(app: FastAPI) -> None:
+    """Runs `init_services` unless it already has; safe to call from several threads at once."""
+    if hasattr(app.state, "chat_service"):
+        return
+    with _init_lock:
+        if not hasattr(app.state, "chat_service"):
+            init_services(app)
+
+async def warm_up(app: FastAPI) -> None:
+    """
+    Creates the services and opens their connections (a Firestore read and a Gemini
+    token count) so the first user request doesn't pay for them. Each step is bounded
+    by STARTUP_WARMUP_TIMEOUT_SECONDS; a failed step is logged and left to the first request.
+    """
+    await run_in_threadpool(ensure_services, app)
+    steps = {
+        "storage_warmup": app.state.firebase_service.awarm_up,
+        "llm_warmup": app.state.langchain_service.awarm_up,
+    }
+
+    async def run(phase, step):
+        try:
+            with startup_report.phase(phase):
+                await asyncio.wait_for(step(), timeout=settings.STARTUP_WARMUP_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %r", phase, e)
 
-def get_firebase_service(db: Client = Depends(get_db)) -> FirebaseService:
-    return FirebaseService(db)
+    await asyncio.gather(*(run(phase, step) for phase, step in steps.items()))
 
-def get_langchain_service() -> LangChainService:
-    return LangChainService()
+def shutdown_services(app: FastAPI) -> None:
+    """Closes the shared clients. Called once on application shutdown."""
+    langchain_service = getattr(app.state, "langchain_service", None)
+    if langchain_service is not None:
+        langchain_service.close()
+    firebase_service = getattr(app.state, "firebase_service", None)
+    if firebase_service is not None:
+        firebase_service.close()
+    db = getattr(app.state, "db", None)
+    if db is not None:
+        db.close()
+    for name in ("db", "firebase_service", "langchain_service", "history_cache", "response_cache", "chat_service"):
+        if hasattr(app.state, name):
+            delattr(app.state, name)
 
-def get_chat_service( # <-- Add this new dependency provider
-    firebase_service: FirebaseService = Depends(get_firebase_service),
-    langchain_service: LangChainService = Depends(get_langchain_service)
-) -> ChatService:
+def init_broadcast(app: FastAPI) -> None:
+    """
+    Creates the pub/sub backend named by BROADCAST_URL and the WebSocket connection
+    manager on top of it. Kept apart from `init_services` because it needs no
+    Firestore or Gemini client. The backend still has to be `connect()`-ed.
+    """
+    app.state.broadcast = create_broadcast(settings.BROADCAST_URL)
+    app.state.connection_manager = ConnectionManager(
+        app.state.broadcast,
+        max_queue=settings.WS_SEND_QUEUE_SIZE,
+        slow_consumer_policy=settings.WS_SLOW_CONSUMER_POLICY,
+        resume_buffer_size=settings.WS_RESUME_BUFFER_SIZE,
+        resume_linger=settings.WS_RESUME_LINGER_SECONDS
+    )
+
+async def shutdown_broadcast(app: FastAPI) -> None:
+    manager = getattr(app.state, "connection_manager", None)
+    if manager is not None:
+        await manager.close()
+    broadcast = getattr(app.state, "broadcast", None)
+    if broadcast is not None:
+        await broadcast.disconnect()
+    for name in ("connection_manager", "broadcast"):
+        if hasattr(app.state, name):
+            delattr(app.state, name)
+
+def _get_state(connection: HTTPConnection, name: str):
+    # Created on first use when the warm-up is off or hasn't finished (or in a bare TestClient).
+    if not hasattr(connection.app.state, name):
+        ensure_services(connection.app)
+    return getattr(connection.app.state, name)
+
+# --- FastAPI dependencies ---
+# `HTTPConnection` resolves for both HTTP requests and WebSockets. Tests can swap
+# any of these out through `app.dependency_overrides`.
+
+def get_firestore_client(connection: HTTPConnection):
+    return _get_state(connection, "db")
+
+def get_firebase_service(connection: HTTPConnection) -> StorageService:
+    """The configured storage service (Firestore or SQLite; see STORAGE_BACKEND)."""
+    return _get_state(connection, "firebase_service")
+
+def get_langchain_service(connection: HTTPConnection) -> LangChainService:
+    return _get_state(connection, "langchain_service")
+
+def get_chat_service(connection: HTTPConnection) -> ChatService:
     """Dependency provider for the ChatService."""
-    return ChatService(firebase_service, langchain_service)
\ No newline at end of file
+    return _get_state(connection, "chat_service")
+
+def get_connection_manager(connection: HTTPConnection) -> ConnectionManager:
+    if not hasattr(connection.app.state, "connection_manager"):
+        init_broadcast(connection.app)
+    return connection.app.state.connection_manager
@@ -0,0 +1,37 @@
+import base64
+import datetime
+import json
+
+# Cursors are opaque to clients: URL-safe base64 of the sort key of the last item
+# on a page. Clients only ever echo back the value they were given.
+
+def _encode(payload: dict) -> str:
+    data = json.dumps(payload, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode(cursor: str) -> dict:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+
+def encode_cursor(timestamp: datetime.datetime, item_id: str) -> str:
+    return _encode({"t": timestamp.isoformat(), "id": item_id})
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, str]:
+    """Returns `(timestamp, item_id)`. Raises ValueError for anything that isn't a cursor we issued."""
+    try:
+        payload = _decode(cursor)
+        return datetime.datetime.fromisoformat(payload["t"]), payload["id"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def encode_rank_cursor(score: float, item_id: str) -> str:
+    """Cursor for results ordered by descending score (search hits)."""
+    return _encode({"s": score, "id": item_id})
+
+def decode_rank_cursor(cursor: str) -> tuple[float, str]:
+    """Returns `(score, item_id)`. Raises ValueError for anything that isn't a rank cursor we issued."""
+    try:
+        payload = _decode(cursor)
+        return float(payload["s"]), payload["id"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
@@ -0,0 +1,68 @@
+import hashlib
+from typing import Iterator, Sequence
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, TypeAdapter
+
+from ..config import settings
+
+# Routes keep their `response_model` for the OpenAPI schema but return these
+# responses directly, so FastAPI skips its response-model pass: the items were
+# validated when storage read them, and pydantic-core dumps them straight to
+# JSON bytes (the same bytes FastAPI itself would produce).
+
+JSON_MEDIA_TYPE = "application/json"
+
+# Conditional GETs: list responses carry a strong ETag computed from version
+# counters that storage keeps (a chat's messageCount, the owner's chatsVersion)
+# plus the query, so a matching If-None-Match is answered 304 before the list is
+# read. "no-cache" lets the browser keep the body but revalidate before each use;
+# "private" keeps shared caches from storing per-user responses.
+CACHE_CONTROL = "private, no-cache"
+
+def make_etag(*parts) -> str:
+    key = "\x1f".join("" if part is None else str(part) for part in parts)
+    return '"' + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match uses the weak comparison, so a W/ prefix on a listed tag is ignored."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def cache_headers(etag: str | None) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL} if etag else {}
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+def json_response(model: BaseModel, headers: dict[str, str] | None = None) -> Response:
+    return Response(model.model_dump_json(), media_type=JSON_MEDIA_TYPE, headers=headers)
+
+def _array_chunks(adapter: TypeAdapter, items: Sequence[BaseModel], chunk_items: int) -> Iterator[bytes]:
+    yield b"["
+    for start in range(0, len(items), chunk_items):
+        # Each chunk is dumped as an array; its brackets are swapped for separators.
+        body = adapter.dump_json(items[start:start + chunk_items])[1:-1]
+        yield body if start == 0 else b"," + body
+    yield b"]"
+
+def json_list_response(
+    adapter: TypeAdapter,
+    items: Sequence[BaseModel],
+    headers: dict[str, str] | None = None
+) -> Response:
+    """
+    A JSON array of `items`. Long lists (RESPONSE_STREAM_MIN_ITEMS or more) are
+    streamed in chunks, so their first bytes go out before the rest is encoded.
+    """
+    if len(items) < settings.RESPONSE_STREAM_MIN_ITEMS:
+        return Response(adapter.dump_json(items), media_type=JSON_MEDIA_TYPE, headers=headers)
+    return StreamingResponse(
+        _array_chunks(adapter, items, settings.RESPONSE_STREAM_CHUNK_ITEMS),
+        media_type=JSON_MEDIA_TYPE,
+        headers=headers
+    )
@@ -1,19 +1,98 @@
+import hashlib
+import logging
+import time
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from firebase_admin import auth
 from jose import JWTError
 from pydantic import ValidationError
 
-from ..core.database import get_db
-from ..services.firebase_service import FirebaseService
+from ..config import settings
+from ..core import tracing
+from ..core.cache import TTLCache
+from ..core.metrics import registry
+from ..core.dependencies import get_firebase_service
+from ..services.storage import StorageService
 from ..models.user import UserInDB
 
+logger = logging.getLogger(__name__)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(get_db)) -> UserInDB:
+AUTH_VERIFY_SECONDS = registry.histogram(
+    "auth_token_verify_seconds", "ID-token verification, by source (cache or firebase) and outcome.", ["source", "outcome"]
+)
+
+# Decoded ID-token claims keyed by a SHA-256 digest of the token (raw tokens are never kept),
+# and resolved user profiles keyed by uid.
+token_cache = TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL_SECONDS)
+user_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
+
+def auth_cache_stats() -> dict:
+    return {"tokens": token_cache.stats(), "users": user_cache.stats()}
+
+AUTH_CACHE_ENTRIES = registry.gauge(
+    "auth_cache_entries",
+    "Entries held by the auth caches (tokens, users).",
+    ["cache"],
+    callback=lambda: {(cache,): stats["size"] for cache, stats in auth_cache_stats().items()},
+)
+AUTH_CACHE_LOOKUPS = registry.gauge(
+    "auth_cache_lookups",
+    "Auth cache lookups since the worker started, by cache and result (hit, miss).",
+    ["cache", "result"],
+    callback=lambda: {
+        (cache, result): stats[key]
+        for cache, stats in auth_cache_stats().items()
+        for result, key in (("hit", "hits"), ("miss", "misses"))
+    },
+)
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def verify_token(token: str) -> dict:
+    """
+    Verifies a Firebase ID token, serving repeats from `token_cache`.
+    A cached entry expires at the token's own `exp` at the latest.
+    """
+    start = time.perf_counter()
+    key = _token_key(token)
+    decoded_token = token_cache.get(key)
+    if decoded_token is not None:
+        AUTH_VERIFY_SECONDS.observe(time.perf_counter() - start, source="cache", outcome="ok")
+        return decoded_token
+    outcome = "error"
+    try:
+        with tracing.span("auth.verify_token"):
+            # Revoked tokens (see /api/auth/logout) are rejected, at one more lookup per cache miss.
+            decoded_token = auth.verify_id_token(token, check_revoked=True)
+        outcome = "ok"
+    finally:
+        AUTH_VERIFY_SECONDS.observe(time.perf_counter() - start, source="firebase", outcome=outcome)
+    ttl = settings.TOKEN_CACHE_TTL_SECONDS
+    if "exp" in decoded_token:
+        ttl = min(ttl, decoded_token["exp"] - time.time())
+    token_cache.set(key, decoded_token, ttl=ttl)
+    return decoded_token
+
+def invalidate_user(uid: str) -> None:
+    """
+    Drops a user's cached profile and every cached token issued to them on this
+    worker. Other workers drop theirs within TOKEN_CACHE_TTL_SECONDS.
+    """
+    user_cache.invalidate(uid)
+    token_cache.invalidate_where(lambda _, claims: claims.get("uid") == uid)
+
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    firebase_service: StorageService = Depends(get_firebase_service)
+) -> UserInDB:
     """
     Dependency to get the current authenticated user from a JWT token.
     It verifies the token using Firebase Admin SDK and fetches the user profile from Firestore.
+    Both lookups are cached (see `token_cache` / `user_cache`), so repeat calls skip them.
     
     *** SELF-HEALING ***
     If a user exists in Firebase Auth but not in our Firestore `users` collection,
@@ -25,11 +104,14 @@ def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(get_db))
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        # Verify the token using Firebase Admin SDK
-        decoded_token = auth.verify_id_token(token)
+        # Verify the token using Firebase Admin SDK (or the token cache)
+        decoded_token = verify_token(token)
         uid = decoded_token['uid']
         
-        firebase_service = FirebaseService(db)
+        user = user_cache.get(uid)
+        if user is not None:
+            return user
+
         user = firebase_service.get_user(user_id=uid)
         
         # --- THIS IS THE CRITICAL FIX ---
@@ -37,7 +119,7 @@ def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(get_db))
             # The user is authenticated with Firebase, but doesn't have a profile in our DB.
             # This can happen if the /register call failed or for users created manually.
             # We will create the user profile now to self-heal the system.
-            print(f"User with UID {uid} not found in Firestore. Creating profile now.")
+            logger.info("User %s has no stored profile; creating it now.", uid)
             
             # Fetch the full user record from Firebase Auth to get all details
             auth_user_record = auth.get_user(uid)
@@ -53,11 +135,12 @@ def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(get_db))
                 # If creation still fails, something is wrong with the DB connection.
                 raise credentials_exception
 
+        user_cache.set(uid, user)
         return user
     except (auth.InvalidIdTokenError, auth.ExpiredIdTokenError, ValueError, KeyError) as e:
-        print(f"Token validation error: {e}")
+        logger.info("Token validation error: %s", e)
         raise credentials_exception
-    except Exception as e:
+    except Exception:
         # Catch any other potential errors during the process
-        print(f"An unexpected error occurred in get_current_user: {e}")
+        logger.exception("An unexpected error occurred in get_current_user")
         raise credentials_exception
\ No newline at end of file
@@ -0,0 +1,48 @@
+import contextlib
+import logging
+import threading
+import time
+from typing import Iterator
+
+from ..core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PHASE_SECONDS = registry.gauge(
+    "startup_phase_seconds", "Time spent in each startup phase (imports, client creation, warm-up).", ["phase"]
+)
+
+class StartupReport:
+    """
+    Wall-clock time of each cold-start phase, in the order they ran. Phases are
+    also exported as `startup_phase_seconds`, and `log()` prints the breakdown.
+    Lazily created clients report their phase whenever first use happens.
+    """
+    def __init__(self):
+        self.phases: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+            total = self.phases[phase]
+        STARTUP_PHASE_SECONDS.set(total, phase=phase)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def as_dict(self) -> dict[str, float]:
+        with self._lock:
+            return {phase: round(seconds, 4) for phase, seconds in self.phases.items()}
+
+    def log(self) -> None:
+        phases = self.as_dict()
+        breakdown = ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in phases.items())
+        logger.info("Startup took %.0fms: %s", sum(phases.values()) * 1000, breakdown)
+
+startup_report = StartupReport()
@@ -0,0 +1,63 @@
+import contextlib
+import random
+from contextvars import ContextVar
+from typing import Iterator
+
+from ..config import settings
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # Tracing is optional; without the API every span is a no-op.
+    otel_trace = None
+
+# Spans go through the OpenTelemetry API, so they are exported only when the process
+# runs with an SDK and exporter configured (e.g. under `opentelemetry-instrument`).
+# Sampling is decided once per turn by `start_trace`, at TRACE_SAMPLE_RATE; the
+# stages inside a turn open child spans only when their turn was sampled, so an
+# unsampled turn costs one random() call.
+
+_sampled: ContextVar[bool] = ContextVar("trace_sampled", default=False)
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def end(self, end_time: int | None = None) -> None:
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def _tracer():
+    return otel_trace.get_tracer("chatbot")
+
+@contextlib.contextmanager
+def start_trace(name: str, **attributes) -> Iterator:
+    """Opens the root span of a turn if the turn is sampled; its stages then trace as children."""
+    if otel_trace is None or settings.TRACE_SAMPLE_RATE <= 0 or random.random() >= settings.TRACE_SAMPLE_RATE:
+        yield _NOOP_SPAN
+        return
+    token = _sampled.set(True)
+    try:
+        with _tracer().start_as_current_span(name, attributes=attributes) as span:
+            yield span
+    finally:
+        _sampled.reset(token)
+
+@contextlib.contextmanager
+def span(name: str, **attributes) -> Iterator:
+    """A child span of the current turn; a no-op outside a sampled one."""
+    if not _sampled.get():
+        yield _NOOP_SPAN
+        return
+    with _tracer().start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+def start_span(name: str, **attributes):
+    """
+    Like `span`, but the span is not made current and the caller must `end()` it.
+    For stages that yield while they run (streams), where a current span would leak
+    into the consumer's context between items.
+    """
+    if not _sampled.get():
+        return _NOOP_SPAN
+    return _tracer().start_span(name, attributes=attributes)
@@ -1,10 +1,28 @@
+import time
+
+_import_start = time.perf_counter()
+
+import asyncio
+import logging
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
 # IMPORTANT: The imports must be relative to the 'backend' directory now.
-from app.api import auth, chat, websocket
+from app.api import auth, chat, health, metrics, websocket
+from app.config import settings
 from app.core.database import initialize_firebase
+from app.core.dependencies import warm_up, shutdown_services, init_broadcast, shutdown_broadcast
+from app.core.startup import startup_report
+
+startup_report.record("imports", time.perf_counter() - _import_start)
+
+# --- Logging ---
+# Library loggers stay at WARNING; the app's own follow LOG_LEVEL.
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger("app").setLevel(settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
 
 # --- Application Setup ---
 app = FastAPI(
@@ -20,13 +38,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # --- Event Handlers ---
 @app.on_event("startup")
-def on_startup():
-    """Initialize Firebase connection when the application starts."""
-    initialize_firebase()
+async def on_startup():
+    """
+    Initialize Firebase and the broadcast backend when the application starts, then
+    warm up the shared clients/services in the background (see STARTUP_WARMUP).
+    """
+    app.state.ready = False
+    with startup_report.phase("firebase_init"):
+        initialize_firebase()
+    with startup_report.phase("broadcast"):
+        init_broadcast(app)
+        await app.state.broadcast.connect()
+    if settings.STARTUP_WARMUP:
+        app.state.warmup = asyncio.create_task(_warm_up())
+    else:
+        _mark_ready()
+
+async def _warm_up():
+    try:
+        await warm_up(app)
+    except Exception as e:
+        # The services will be created by the first request instead.
+        logger.warning("Warm-up failed: %r", e)
+    _mark_ready()
+
+def _mark_ready():
+    app.state.ready = True
+    startup_report.log()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Close the shared clients so their connection pools are released cleanly."""
+    app.state.ready = False
+    warmup = getattr(app.state, "warmup", None)
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
+    await shutdown_broadcast(app)
+    shutdown_services(app)
 
 # --- API Routers ---
 # This is the definitive fix for the trailing slash redirect issue.
@@ -36,6 +89,8 @@ def on_startup():
 app.include_router(chat.router, prefix="/api/chats", tags=["Chat Management"])
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(websocket.router, tags=["Real-Time Chat"])
+app.include_router(metrics.router, tags=["Monitoring"])
+app.include_router(health.router, tags=["Monitoring"])
 
 @app.get("/", tags=["Root"])
 def read_root():
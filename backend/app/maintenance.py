@@ -0,0 +1,47 @@
+"""
+One-off data maintenance, run against the configured storage backend:
+
+    python -m app.maintenance backfill-chat-activity
+    python -m app.maintenance rebuild-search-index
+"""
+import argparse
+import logging
+
+from .config import settings
+from .core.database import initialize_firebase
+from .core.dependencies import create_storage
+
+logger = logging.getLogger(__name__)
+
+def backfill_chat_activity(storage) -> None:
+    """Fills the latest-message fields on chats written before they were maintained."""
+    updated = storage.backfill_chat_activity()
+    logger.info("Backfilled the latest message of %d chats.", updated)
+
+def rebuild_search_index(storage) -> None:
+    """Rebuilds every user's message search index from the stored messages."""
+    indexed = storage.rebuild_search_index()
+    logger.info("Indexed %d messages for search.", indexed)
+
+COMMANDS = {
+    "backfill-chat-activity": backfill_chat_activity,
+    "rebuild-search-index": rebuild_search_index,
+}
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    if settings.STORAGE_BACKEND != "sqlite":
+        initialize_firebase()
+    db, storage = create_storage()
+    try:
+        COMMANDS[args.command](storage)
+    finally:
+        storage.close()
+        if db is not None:
+            db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,12 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import List, Literal, Optional
 import datetime
 
 class ChatBase(BaseModel):
     title: str = Field(..., max_length=100)
 
 class ChatCreate(ChatBase):
-    pass
+    cacheResponses: bool = True # set to False to opt this chat out of the response cache
 
 class ChatUpdate(BaseModel):
     title: Optional[str] = Field(None, max_length=100)
@@ -17,6 +17,32 @@ class Chat(ChatBase):
     createdAt: datetime.datetime
     messageCount: int = 0
     isActive: bool = True
+    cacheResponses: bool = True
+    # The latest message, denormalized onto the chat when messages are written so the
+    # chat list can show and sort by activity without reading messages. A chat without
+    # messages has lastMessageAt = createdAt, so new chats sort among the recently active.
+    lastMessageAt: Optional[datetime.datetime] = None
+    lastMessagePreview: Optional[str] = None
+    lastMessageRole: Optional[Literal["user", "assistant"]] = None
+    # Rolling summary of the turns that no longer fit in the LLM context window.
+    # Internal to the backend, so it is left out of API responses.
+    summary: Optional[str] = Field(None, exclude=True)
+    summarizedThrough: Optional[datetime.datetime] = Field(None, exclude=True)
 
     class Config:
-        orm_mode = True # For older Pydantic versions, use from_attributes = True
\ No newline at end of file
+        orm_mode = True # For older Pydantic versions, use from_attributes = True
+
+# Validates a page of stored chats in one call and dumps one straight to JSON bytes.
+chat_list_adapter = TypeAdapter(List[Chat])
+
+class SearchHit(BaseModel):
+    """A message matching a chat search, with the chat it belongs to."""
+    chatId: str
+    chatTitle: str
+    messageId: str
+    role: Literal["user", "assistant"]
+    timestamp: datetime.datetime
+    score: float
+    snippet: str # the text around the first match (see SEARCH_SNIPPET_CHARS)
+
+search_hit_list_adapter = TypeAdapter(List[SearchHit])
@@ -1,10 +1,14 @@
-from pydantic import BaseModel, Field
-from typing import Literal, Dict, Any, Optional
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import Annotated, Literal, Dict, Any, List, Optional, Union
 import datetime
 
 class MessageMetadata(BaseModel):
     model: Optional[str] = None
     responseTime: Optional[float] = None # in seconds
+    # Estimated prompt tokens, cached for context budgeting. Internal: stored, never sent to clients.
+    tokenCount: Optional[int] = Field(default=None, exclude=True)
+    cacheHit: Optional[Literal["exact", "semantic"]] = None # set when served from the response cache
+    truncated: Optional[bool] = None # set when generation was stopped before the reply was complete
 
 class MessageBase(BaseModel):
     content: str
@@ -20,5 +24,59 @@ class Message(MessageBase):
     timestamp: datetime.datetime
     metadata: Optional[MessageMetadata] = None
 
+# Validates a whole page of stored documents in one pydantic-core call, and dumps one
+# straight to JSON bytes.
+message_list_adapter = TypeAdapter(List[Message])
+
 class WebsocketMessage(BaseModel):
-    content: str
\ No newline at end of file
+    content: str
+
+# Typed client frames, sent as JSON on the chat.json.v1 subprotocol. Clients that
+# negotiate no subprotocol send bare text, which is always the content of a chat message.
+
+class SendFrame(BaseModel):
+    """Sends a chat message. A `ref` is echoed back in an `AckFrame` with the saved message's id."""
+    type: Literal["send"] = "send"
+    content: str
+    ref: Optional[str] = None
+
+class StopFrame(BaseModel):
+    """Stops the reply being generated; what was produced so far is kept."""
+    type: Literal["stop"] = "stop"
+
+class ResumeFrame(BaseModel):
+    """
+    Asks for the chat's messages newer than `after`, sent to the requesting socket only.
+    `afterId`, the id of the last message the client has, pins its position when
+    several messages share a timestamp.
+    """
+    type: Literal["resume"] = "resume"
+    after: datetime.datetime
+    afterId: Optional[str] = None
+
+ControlFrame = Annotated[Union[SendFrame, StopFrame, ResumeFrame], Field(discriminator="type")]
+
+class AckFrame(BaseModel):
+    """
+    Confirms a `SendFrame` that carried a `ref`: the message was accepted with id
+    `messageId`. Sent to the sending socket only, possibly ahead of the message's broadcast.
+    """
+    type: Literal["ack"] = "ack"
+    ref: str
+    messageId: str
+
+class StreamDelta(BaseModel):
+    """An incremental chunk of an assistant message that is still being generated."""
+    type: Literal["delta"] = "delta"
+    chatId: str
+    messageId: str
+    seq: int
+    delta: str
+
+class StreamFinal(BaseModel):
+    """Terminates a stream; carries the persisted assistant message."""
+    type: Literal["final"] = "final"
+    chatId: str
+    messageId: str
+    seq: int
+    message: Message
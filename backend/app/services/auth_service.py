@@ -1,9 +1,9 @@
 from firebase_admin import auth
-from ..services.firebase_service import FirebaseService
+from ..services.storage import StorageService
 from ..models.user import UserCreate, UserLogin, UserInDB
 
 class AuthService:
-    def __init__(self, firebase_service: FirebaseService):
+    def __init__(self, firebase_service: StorageService):
         self.firebase_service = firebase_service
 
     def register_user(self, user_create: UserCreate) -> UserInDB:
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from typing import AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+class Subscription:
+    """
+    Messages published to one channel, delivered in order.
+    Iterate it to receive; `close()` unsubscribes.
+    """
+    def __init__(self, backend: "BroadcastBackend", channel: str):
+        self.backend = backend
+        self.channel = channel
+        self.queue: asyncio.Queue[str] = asyncio.Queue()
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        while True:
+            yield await self.queue.get()
+
+    async def close(self) -> None:
+        await self.backend._unsubscribe(self)
+
+class BroadcastBackend:
+    """
+    Publish/subscribe transport used to fan chat frames out to every worker.
+    Subclasses decide how a published message reaches the subscribers; local
+    delivery to this process's subscriptions is shared here.
+    """
+    def __init__(self):
+        self._subscriptions: dict[str, set[Subscription]] = {}
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def publish(self, channel: str, message: str) -> None:
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str) -> Subscription:
+        """Returns once the subscription is live, so nothing published afterwards is missed."""
+        subscription = Subscription(self, channel)
+        subscribers = self._subscriptions.setdefault(channel, set())
+        first = not subscribers
+        subscribers.add(subscription)
+        if first:
+            await self._on_first_subscriber(channel)
+        return subscription
+
+    async def _unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscriptions.get(subscription.channel)
+        if not subscribers or subscription not in subscribers:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscriptions[subscription.channel]
+            await self._on_last_subscriber(subscription.channel)
+
+    async def _on_first_subscriber(self, channel: str) -> None:
+        pass
+
+    async def _on_last_subscriber(self, channel: str) -> None:
+        pass
+
+    def _deliver(self, channel: str, message: str) -> None:
+        for subscription in self._subscriptions.get(channel, ()):
+            subscription.queue.put_nowait(message)
+
+class MemoryBroadcast(BroadcastBackend):
+    """
+    In-process backend: reaches only the subscribers of this worker. The default
+    for a single worker, and a stand-in for a networked backend in tests (share
+    one instance between several ConnectionManagers to simulate several workers).
+    """
+    async def publish(self, channel: str, message: str) -> None:
+        self._deliver(channel, message)
+
+class RedisBroadcast(BroadcastBackend):
+    """
+    Redis pub/sub backend for running several workers or pods. Each process keeps
+    a single pub/sub connection, subscribes it to a chat's channel while at least
+    one local socket is in that chat, and dispatches incoming messages locally.
+    """
+    def __init__(self, url: str, channel_prefix: str = "chat:"):
+        super().__init__()
+        self.url = url
+        self.channel_prefix = channel_prefix
+        self._redis = None
+        self._pubsub = None
+        self._reader: asyncio.Task | None = None
+
+    async def connect(self) -> None:
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("The 'redis' package is required for a redis:// BROADCAST_URL")
+        self._redis = redis.from_url(self.url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._reader = asyncio.create_task(self._read())
+
+    async def disconnect(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self._redis.publish(self.channel_prefix + channel, message)
+
+    async def _on_first_subscriber(self, channel: str) -> None:
+        await self._pubsub.subscribe(self.channel_prefix + channel)
+
+    async def _on_last_subscriber(self, channel: str) -> None:
+        await self._pubsub.unsubscribe(self.channel_prefix + channel)
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(0.05)
+                    continue
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Error reading from Redis pub/sub: %s", e)
+                await asyncio.sleep(1.0)
+                continue
+            if message is None or message.get("type") != "message":
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode("utf-8")
+            data = message["data"]
+            if isinstance(data, bytes):
+                data = data.decode("utf-8")
+            self._deliver(channel[len(self.channel_prefix):], data)
+
+def create_broadcast(url: str) -> BroadcastBackend:
+    """Builds the backend named by `url`: `memory://` or `redis://...` / `rediss://...`."""
+    if url.startswith("memory://"):
+        return MemoryBroadcast()
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBroadcast(url)
+    raise ValueError(f"Unsupported BROADCAST_URL: {url}")
@@ -1,64 +1,404 @@
 # File: chatbot/backend/services/chat_service.py
 
-from typing import List, Tuple
+import asyncio
+import bisect
+import datetime
+import logging
+import time
+from typing import AsyncIterator, List, Tuple, Union
 
-from ..services.firebase_service import FirebaseService
+from ..config import settings
+from ..core import tracing
+from ..core.cache import TTLCache
+from ..core.metrics import registry
+from ..core.pagination import decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor
+from ..services import search
+from ..services.storage import CHAT_SORT_FIELDS, StorageService
+from ..services.context_manager import ContextManager
+from ..services.history_cache import ChatHistory, HistoryCache
 from ..services.langchain_service import LangChainService
-from ..models.chat import Chat, ChatCreate
-from ..models.message import Message
+from ..services.response_cache import ResponseCache
+from ..models.chat import Chat, ChatCreate, SearchHit
+from ..models.message import Message, StreamDelta, StreamFinal
 from ..models.user import UserInDB
 
+logger = logging.getLogger(__name__)
+
+CHAT_STAGE_SECONDS = registry.histogram(
+    "chat_turn_stage_seconds", "WebSocket turn stages around the model call: history read and persistence.", ["stage"]
+)
+
 class ChatService:
     """
     Service layer for handling chat-related business logic.
     """
-    def __init__(self, firebase_service: FirebaseService, langchain_service: LangChainService):
+    def __init__(
+        self,
+        firebase_service: StorageService,
+        langchain_service: LangChainService,
+        history_cache: HistoryCache | None = None,
+        context_manager: ContextManager | None = None,
+        response_cache: ResponseCache | None = None
+    ):
         self.firebase = firebase_service
         self.langchain = langchain_service
+        self.history = history_cache or HistoryCache(
+            max_chats=settings.HISTORY_CACHE_MAX_CHATS,
+            max_messages=settings.HISTORY_CACHE_MAX_MESSAGES,
+            ttl=settings.HISTORY_CACHE_TTL_SECONDS,
+        )
+        self.context = context_manager or ContextManager(
+            token_budget=settings.CONTEXT_TOKEN_BUDGET,
+            recent_tokens=settings.CONTEXT_RECENT_TOKENS,
+            chars_per_token=settings.CONTEXT_CHARS_PER_TOKEN,
+        )
+        self.response_cache = response_cache
+        # Background summaries in flight; at most one per chat (see `ChatHistory.summarizing`).
+        self._summaries: set[asyncio.Task] = set()
+        # (user id, searchVersion, query terms) -> every hit as (-score, message id), best first.
+        self.search_results = TTLCache(
+            maxsize=settings.SEARCH_RESULTS_CACHE_SIZE, ttl=settings.SEARCH_RESULTS_CACHE_TTL_SECONDS
+        )
 
     def create_chat(self, user: UserInDB, chat_create: ChatCreate) -> Chat:
         """Creates a new chat for a user."""
-        return self.firebase.create_chat(user_id=user.uid, title=chat_create.title)
+        return self.firebase.create_chat(user_id=user.uid, title=chat_create.title, cache_responses=chat_create.cacheResponses)
 
     def get_chats_for_user(self, user: UserInDB) -> List[Chat]:
         """Retrieves all chats for a specific user."""
         return self.firebase.get_chats_for_user(user_id=user.uid)
 
-    def get_chat_if_user_has_access(self, chat_id: str, user: UserInDB) -> Chat | None:
+    def get_chat_if_user_has_access(self, chat_id: str, user: UserInDB, fresh: bool = False) -> Chat | None:
         """
         Retrieves a single chat only if the requesting user is the owner.
+        With `fresh` the chat is read from the database rather than the chat cache.
         """
-        return self.firebase.get_chat(chat_id=chat_id, user_id=user.uid)
+        return self.firebase.get_chat(chat_id=chat_id, user_id=user.uid, fresh=fresh)
         
     def get_messages(self, chat_id: str, user_id: str) -> List[Message]:
         """Gets all messages for a given chat."""
         return self.firebase.get_messages_for_chat(chat_id, user_id)
 
-    def process_user_message(self, chat_id: str, user_id: str, user_message_content: str) -> Tuple[Message, Message]:
+    def get_chats_version(self, user: UserInDB) -> int | None:
+        """Version counter of the user's chat list; None if it isn't tracked for this user."""
+        return self.firebase.get_chats_version(user_id=user.uid)
+
+    def get_chats_page(
+        self,
+        user: UserInDB,
+        limit: int,
+        after: str | None = None,
+        sort: str = "createdAt",
+        active_since: datetime.datetime | None = None
+    ) -> Tuple[List[Chat], str | None]:
+        """
+        Returns one page of the user's chats, newest first by `sort` (createdAt or
+        lastMessageAt), and the cursor for the next page, or None on the last page.
+        `active_since` keeps chats with a message at or after it and needs
+        sort="lastMessageAt". Raises ValueError for a bad cursor or combination.
+        """
+        if sort not in CHAT_SORT_FIELDS:
+            raise ValueError(f"'sort' must be one of: {', '.join(CHAT_SORT_FIELDS)}")
+        if active_since is not None and sort != "lastMessageAt":
+            raise ValueError("'active_since' requires sort=lastMessageAt")
+        after_ts, after_id = decode_cursor(after) if after else (None, None)
+        chats, has_more = self.firebase.list_chats(
+            user_id=user.uid, limit=limit, after=after_ts, sort=sort, active_since=active_since, after_id=after_id
+        )
+        next_cursor = encode_cursor(getattr(chats[-1], sort), chats[-1].id) if has_more and chats else None
+        return chats, next_cursor
+
+    def get_search_version(self, user: UserInDB) -> int | None:
+        """Version counter of the user's search index; None if it isn't tracked for this user."""
+        return self.firebase.get_search_version(user_id=user.uid)
+
+    def search_messages(
+        self, user: UserInDB, query: str, limit: int, after: str | None = None, version: int | None = None
+    ) -> Tuple[List[SearchHit], str | None]:
+        """
+        Searches all of the user's messages, best BM25 match first, and returns one
+        page of hits with snippets and the cursor for the next page, or None on the
+        last page. The ranking is computed once per query and search version (pass
+        `version` when the caller has already read it) and cached, so later pages
+        read no postings: only their messages and chats, a page's worth at a time
+        until the page is full (hits whose chat is gone are skipped). Raises
+        ValueError for a bad cursor.
+        """
+        after_key = decode_rank_cursor(after) if after else None
+        terms = search.query_terms(query)
+        if not terms:
+            return [], None
+        if version is None:
+            version = self.firebase.get_search_version(user.uid)
+        ranked = self._ranked_hits(user.uid, terms, version)
+        position = 0
+        if after_key is not None:
+            score, message_id = after_key
+            position = bisect.bisect_right(ranked, (-score, message_id))
+        hits: list[SearchHit] = []
+        last = None
+        while position < len(ranked) and len(hits) < limit:
+            batch = ranked[position:position + limit - len(hits)]
+            position += len(batch)
+            messages = {m.id: m for m in self.firebase.get_messages_by_ids([message_id for _, message_id in batch])}
+            chats = self.firebase.get_chats([m.chatId for m in messages.values()], user.uid)
+            for key in batch:
+                last = key
+                message = messages.get(key[1])
+                chat = chats.get(message.chatId) if message else None
+                if chat is None:
+                    continue
+                hits.append(SearchHit(
+                    chatId=chat.id,
+                    chatTitle=chat.title,
+                    messageId=message.id,
+                    role=message.role,
+                    timestamp=message.timestamp,
+                    score=-key[0],
+                    snippet=search.snippet(message.content, terms),
+                ))
+        next_cursor = encode_rank_cursor(-last[0], last[1]) if position < len(ranked) and last is not None else None
+        return hits, next_cursor
+
+    def _ranked_hits(self, user_id: str, terms: list[str], version: int | None) -> list[tuple[float, str]]:
+        key = (user_id, version, tuple(terms))
+        ranked = self.search_results.get(key) if version is not None else None
+        if ranked is None:
+            postings, frequencies, documents, total_length = self.firebase.get_search_postings(user_id, terms)
+            scores = search.bm25(postings, frequencies, documents, total_length)
+            ranked = sorted((-score, message_id) for message_id, score in scores.items())
+            if version is not None:
+                self.search_results.set(key, ranked)
+        return ranked
+
+    def get_messages_page(
+        self, chat_id: str, limit: int, before: str | None = None, after: str | None = None
+    ) -> Tuple[List[Message], str | None]:
+        """
+        Returns one page of a chat's messages in chronological order and the cursor
+        that continues in the same direction: older messages by default or with
+        `before`, newer ones with `after`. Raises ValueError for a bad cursor.
+        Callers must have already checked access to the chat.
+        """
+        if before and after:
+            raise ValueError("Use either 'before' or 'after', not both")
+        before_ts, before_id = decode_cursor(before) if before else (None, None)
+        after_ts, after_id = decode_cursor(after) if after else (None, None)
+        messages, has_more = self.firebase.list_messages(
+            chat_id, limit, before=before_ts, after=after_ts, before_id=before_id, after_id=after_id
+        )
+        next_cursor = None
+        if has_more and messages:
+            edge = messages[-1] if after else messages[0]
+            next_cursor = encode_cursor(edge.timestamp, edge.id)
+        return messages, next_cursor
+
+    def _build_message(self, chat_id: str, user_id: str, message_data: dict, message_id: str | None = None) -> dict:
+        """Builds an unsaved message document with its token count cached in `metadata`."""
+        metadata = dict(message_data.get("metadata") or {})
+        metadata["tokenCount"] = self.context.message_tokens(message_data["content"])
+        return self.firebase.build_message(chat_id, user_id, {**message_data, "metadata": metadata}, message_id)
+
+    # --- Async API (used from the event loop, e.g. the WebSocket endpoint) ---
+
+    async def warm_history(self, chat_id: str, user_id: str) -> None:
+        """Loads a chat's history into the history cache unless it is already there."""
+        if self.history.get(chat_id) is None:
+            await self._aload_history(chat_id, user_id)
+
+    async def _aload_history(self, chat_id: str, user_id: str) -> ChatHistory:
+        """
+        Reads the chat's rolling summary plus every message after it into the history
+        cache. A chat with more unsummarized history than the context holds (one written
+        before summaries existed) has the overflow summarized in the background; until
+        then the model sees the newest messages the cache keeps.
+        """
+        chat = await self.firebase.aget_chat(chat_id, user_id)
+        if chat is None:
+            return self.history.put(chat_id, [])
+        if chat.summarizedThrough is not None:
+            messages = await self.firebase.aget_messages_after(chat_id, chat.summarizedThrough)
+        else:
+            messages = await self.firebase.aget_messages_for_chat(chat_id, user_id)
+        history = self.history.put(chat_id, messages, chat.summary, chat.summarizedThrough)
+        self._summarize_later(chat_id, user_id, messages)
+        return history
+
+    async def _aget_history(self, chat_id: str, user_id: str) -> ChatHistory:
+        """
+        Returns the cached history of a chat, reading only messages newer than the
+        last sync point (e.g. written by another worker). Falls back to a full load.
+        """
+        history = self.history.get(chat_id)
+        if history is None or history.synced_at is None:
+            return await self._aload_history(chat_id, user_id)
+        newer = await self.firebase.aget_messages_after(chat_id, history.synced_at)
+        self.history.merge(chat_id, newer)
+        return history
+
+    async def _asave_messages(self, chat_id: str, user_id: str, messages: list[dict]) -> list[Message]:
+        """Saves a turn's messages in one batch and appends them to the history cache."""
+        saved = await self.firebase.aadd_messages(chat_id, user_id, messages)
+        self.history.append(chat_id, saved)
+        return saved
+
+    def _summarize_later(self, chat_id: str, user_id: str, messages: list[Message] | None = None) -> None:
         """
-        Handles the full logic of processing a user's message.
-        1. Saves the user message to the database.
-        2. Fetches the conversation history for context.
-        3. Generates a response from the AI model via LangChain.
-        4. Saves the AI's response to the database.
-        Returns a tuple containing the saved user message and the saved AI message.
+        Starts folding the oldest turns into the chat's rolling summary once the history
+        (`messages`, or what the cache holds) no longer fits the token budget, or holds
+        more than half the history cache's `max_messages`. Runs as a background task,
+        one per chat: neither loading history nor a turn waits for it.
         """
-        # 1. Save user's message
-        user_message_data = {"content": user_message_content, "role": "user"}
-        saved_user_message = self.firebase.add_message_to_chat(chat_id, user_id, user_message_data)
+        history = self.history.get(chat_id)
+        if history is None or history.summarizing:
+            return
+        messages = history.messages if messages is None else messages
+        folded = self.context.overflow(messages)
+        excess = len(messages) - self.history.max_messages // 2
+        if excess > len(folded):
+            folded = messages[:excess]
+        if not folded:
+            return
+        history.summarizing = True
+        task = asyncio.create_task(self._asummarize(chat_id, user_id, history, folded))
+        self._summaries.add(task)
+        task.add_done_callback(self._summaries.discard)
 
-        # 2. Get chat history for context
-        chat_history = self.firebase.get_messages_for_chat(chat_id, user_id)
+    async def _asummarize(self, chat_id: str, user_id: str, history: ChatHistory, folded: list[Message]) -> None:
+        """
+        Summarizes `folded` a budget's worth at a time; if a call fails, the rest stays
+        verbatim (as far as the cache keeps it) and the next turn tries again.
+        """
+        summary = history.summary
+        try:
+            for batch in self.context.batches(folded):
+                summary = await self.langchain.asummarize(summary, batch, user_id=user_id)
+                if summary is None:
+                    return
+                await self.firebase.aupdate_chat_summary(chat_id, summary, batch[-1].timestamp)
+                self.history.fold(chat_id, batch, summary)
+        except Exception:
+            logger.exception("Summarizing chat %s failed.", chat_id)
+        finally:
+            history.summarizing = False
+
+    async def _astream_reply(
+        self, chat_id: str, user_id: str, chat_history: List[Message], prompt: str, summary: str | None
+    ) -> AsyncIterator[dict]:
+        """
+        Produces the assistant reply as `astream_response` events. When the response
+        cache is enabled, the chat hasn't opted out and the context is small enough,
+        a cached reply is served instead of calling the model; fresh replies are cached.
+        """
+        lookup = None
+        cache = self.response_cache
+        if cache is not None:
+            chat = await self.firebase.aget_chat(chat_id, user_id)
+            context_tokens = sum(self.context.count(m) for m in chat_history) + (self.context.estimate(summary) if summary else 0)
+            if chat is not None and chat.cacheResponses and context_tokens <= cache.max_context_tokens:
+                start_time = time.time()
+                lookup = await cache.alookup(cache.context_key(summary, chat_history), prompt)
+                if lookup.hit is not None:
+                    yield {"delta": lookup.hit["content"]}
+                    yield {
+                        "content": lookup.hit["content"],
+                        "metadata": {
+                            **lookup.hit["metadata"],
+                            "responseTime": round(time.time() - start_time, 2),
+                            "cacheHit": lookup.kind
+                        }
+                    }
+                    return
 
-        # 3. Generate AI response
-        ai_response_data = self.langchain.generate_response(chat_history, user_message_content)
+        async for event in self.langchain.astream_response(chat_history, prompt, summary, user_id=user_id):
+            if lookup is not None and "content" in event and "error" not in event["metadata"]:
+                await cache.astore(lookup, event["content"], event["metadata"])
+            yield event
+
+    async def _auntil_stopped(self, events: AsyncIterator[dict], stop: asyncio.Event | None) -> AsyncIterator[dict]:
+        """
+        Passes `events` through until `stop` is set. The pending read is then cancelled
+        and the stream closed, which aborts the model request underneath it.
+        """
+        if stop is None:
+            async for event in events:
+                yield event
+            return
+        stopped = asyncio.create_task(stop.wait())
+        pending = None
+        try:
+            while True:
+                pending = asyncio.create_task(anext(events, None))
+                done, _ = await asyncio.wait({pending, stopped}, return_when=asyncio.FIRST_COMPLETED)
+                if pending not in done:
+                    return
+                event = pending.result()
+                if event is None:
+                    return
+                yield event
+        finally:
+            stopped.cancel()
+            if pending is not None and not pending.done():
+                # Also reached when the caller itself is cancelled mid-read.
+                pending.cancel()
+                await asyncio.wait({pending})
+            await events.aclose()
+
+    async def stream_user_message(
+        self, chat_id: str, user_id: str, user_message_content: str, stop: asyncio.Event | None = None
+    ) -> AsyncIterator[Union[Message, StreamDelta, StreamFinal]]:
+        """
+        Handles a user's message and streams the reply.
+        Yields the user message first, then a `StreamDelta` for every chunk the model
+        produces, and finally a `StreamFinal` carrying the saved AI message.
+        The AI message id is allocated up front so deltas and the final frame share it,
+        and both messages are persisted together in one batch once the reply is complete;
+        until then the user message is broadcast but not in storage (see `send_missed`).
+        The model sees the chat's rolling summary plus as many recent turns as fit the
+        token budget; after the reply is out, overflowing turns are summarized in the
+        background.
+        Setting `stop` aborts generation; the output so far is saved and sent as the
+        final message, marked `truncated`.
+        """
+        user_message = self._build_message(chat_id, user_id, {"content": user_message_content, "role": "user"})
+        yield Message(**user_message)
+
+        stage_start = time.perf_counter()
+        with tracing.span("chat.history"):
+            history = await self._aget_history(chat_id, user_id)
+        CHAT_STAGE_SECONDS.observe(time.perf_counter() - stage_start, stage="history")
+        summary = history.summary
+        chat_history = self.context.fit(list(history.messages), user_message_content, summary)
+
+        ai_message_id = self.firebase.new_message_id()
+        seq = 0
+        parts: list[str] = []
+        ai_response_data: dict = {}
+        start_time = time.time()
+        reply = self._astream_reply(chat_id, user_id, chat_history, user_message_content, summary)
+        async for event in self._auntil_stopped(reply, stop):
+            if "delta" in event:
+                parts.append(event["delta"])
+                yield StreamDelta(chatId=chat_id, messageId=ai_message_id, seq=seq, delta=event["delta"])
+                seq += 1
+            else:
+                ai_response_data = event
+        if not ai_response_data and stop is not None and stop.is_set():
+            logger.info("Generation stopped for chat %s after %d chunks.", chat_id, seq)
+            ai_response_data = {
+                "content": "".join(parts),
+                "metadata": {"responseTime": round(time.time() - start_time, 2), "truncated": True}
+            }
 
-        # 4. Save AI's message
         ai_message_data = {
             "content": ai_response_data.get("content", "Sorry, an error occurred."),
             "role": "assistant",
             "metadata": ai_response_data.get("metadata")
         }
-        saved_ai_message = self.firebase.add_message_to_chat(chat_id, user_id, ai_message_data)
-        
-        return saved_user_message, saved_ai_message
\ No newline at end of file
+        ai_message = self._build_message(chat_id, user_id, ai_message_data, message_id=ai_message_id)
+        stage_start = time.perf_counter()
+        with tracing.span("chat.persist"):
+            _, saved_ai_message = await self._asave_messages(chat_id, user_id, [user_message, ai_message])
+        CHAT_STAGE_SECONDS.observe(time.perf_counter() - stage_start, stage="persist")
+        self._summarize_later(chat_id, user_id)
+        yield StreamFinal(chatId=chat_id, messageId=ai_message_id, seq=seq, message=saved_ai_message)
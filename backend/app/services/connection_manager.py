@@ -0,0 +1,353 @@
+import asyncio
+import datetime
+import json
+import logging
+import time
+from collections import deque
+from typing import Callable
+
+from fastapi import WebSocket, status
+
+from ..core.metrics import registry
+from ..services.broadcast import BroadcastBackend, MemoryBroadcast, Subscription
+from ..services.protocol import LEGACY_CODEC, JsonCodec, MsgpackCodec
+
+logger = logging.getLogger(__name__)
+
+WS_CONNECTIONS = registry.gauge("ws_active_connections", "WebSockets connected to this worker.")
+WS_BROADCAST_SECONDS = registry.histogram(
+    "ws_broadcast_seconds",
+    "Broadcast time: publishing a frame, and fanning a received frame out to this worker's sockets.",
+    ["stage"],
+)
+WS_FRAMES_DROPPED = registry.counter("ws_frames_dropped_total", "Outbound frames discarded for slow consumers.")
+WS_SLOW_CONSUMERS = registry.counter("ws_slow_consumer_disconnects_total", "WebSockets closed for falling behind.")
+
+# Published payloads start with two flag characters: who the frame is for, and
+# whether it is transient (a delta that a later frame supersedes), must be delivered,
+# or is a chat message (delivered, and kept in the chat's resume buffer). "Late"
+# frames are chat messages for the sockets that connected after the message's timestamp.
+_TARGET_ALL, _TARGET_STREAMING, _TARGET_PLAIN, _TARGET_LATE = "*", "s", "p", "l"
+_TRANSIENT, _DURABLE, _MESSAGE = "~", "!", "#"
+
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+
+class ClientConnection:
+    """
+    One WebSocket with a bounded outbound queue drained by its own writer task,
+    so a slow or stalled client never holds up delivery to anyone else. Frames
+    are queued already encoded for the socket's `codec` (text or binary).
+    When the queue is full, `policy` decides what happens to the slow consumer:
+      - "drop": the new frame is discarded;
+      - "coalesce": queued transient frames (stream deltas, which the final frame
+        supersedes) are discarded to make room; if none are left, a transient
+        new frame is discarded and a durable one disconnects the client;
+      - "disconnect": the client is disconnected.
+    """
+    def __init__(
+        self,
+        websocket: WebSocket,
+        streaming: bool,
+        max_queue: int,
+        policy: str,
+        on_dead: Callable[["ClientConnection"], None],
+        codec: JsonCodec | MsgpackCodec = LEGACY_CODEC
+    ):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.websocket = websocket
+        self.streaming = streaming
+        self.max_queue = max_queue
+        self.policy = policy
+        self.codec = codec
+        self.dropped = 0
+        self.connected_at = datetime.datetime.now(datetime.timezone.utc)
+        self._on_dead = on_dead
+        self._queue: deque[tuple[str | bytes, bool]] = deque()
+        self._ready = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._closed = False
+        self._writer = asyncio.create_task(self._write())
+
+    def offer(self, message: str | bytes, transient: bool = False) -> None:
+        """Queues a frame without waiting; applies the slow-consumer policy when full."""
+        if self._closed:
+            return
+        if len(self._queue) >= self.max_queue:
+            if self.policy == "coalesce":
+                kept = deque(item for item in self._queue if not item[1])
+                self._drop(len(self._queue) - len(kept))
+                self._queue = kept
+            if len(self._queue) >= self.max_queue:
+                if self.policy == "disconnect" or (self.policy == "coalesce" and not transient):
+                    WS_SLOW_CONSUMERS.inc()
+                    self._fail()
+                    return
+                self._drop(1)
+                return
+        self._queue.append((message, transient))
+        self._drained.clear()
+        self._ready.set()
+
+    async def drained(self) -> bool:
+        """Waits until everything queued has been sent; False if the socket is gone."""
+        await self._drained.wait()
+        return not self._closed
+
+    def _drop(self, count: int):
+        self.dropped += count
+        WS_FRAMES_DROPPED.inc(count)
+
+    async def _write(self):
+        try:
+            while True:
+                while not self._queue:
+                    self._drained.set()
+                    self._ready.clear()
+                    await self._ready.wait()
+                message, _ = self._queue.popleft()
+                if isinstance(message, bytes):
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info("Error sending to a WebSocket, dropping it: %s", e)
+            self._fail(close=False)
+
+    def _fail(self, close: bool = True):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.clear()
+        self._drained.set()
+        if close:
+            asyncio.create_task(self._close_socket())
+        self._on_dead(self)
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Client too slow")
+        except Exception:
+            pass
+
+    def close(self):
+        """Stops the writer; frames still queued are discarded."""
+        self._closed = True
+        self._drained.set()
+        self._writer.cancel()
+
+class RecentMessages:
+    """
+    The last `maxlen` chat messages (JSON) published in one chat, in publish order.
+    Filled by the chat's relay, so it holds every message published since `since`:
+    the moment the subscription went live, moved forward as old entries are evicted.
+    Message timestamps are fixed before they are published, so a message newer than
+    `since` can't have been missed. Older ones are in storage, except the user message
+    of a turn still in progress, which is sent again when the turn ends (see
+    `ConnectionManager.broadcast`'s `missed_only`).
+    """
+    def __init__(self, maxlen: int):
+        self.since = datetime.datetime.now(datetime.timezone.utc)
+        self._entries: deque[tuple[datetime.datetime, str, str]] = deque(maxlen=maxlen)
+
+    def append(self, message: str) -> None:
+        data = json.loads(message)
+        if len(self._entries) == self._entries.maxlen:
+            self.since = max(self.since, self._entries[0][0])
+        self._entries.append((datetime.datetime.fromisoformat(data["timestamp"]), data["id"], message))
+
+    def after(self, after: datetime.datetime, after_id: str | None = None) -> list[str] | None:
+        """
+        The messages published after the client's last seen one: the one with id
+        `after_id` if still buffered, else anything newer than `after`. None when the
+        buffer doesn't reach back that far.
+        """
+        if after.tzinfo is None:
+            after = after.replace(tzinfo=datetime.timezone.utc)
+        if after_id is not None:
+            for index, (_, message_id, _) in enumerate(self._entries):
+                if message_id == after_id:
+                    return [message for _, _, message in list(self._entries)[index + 1:]]
+        if after < self.since:
+            return None
+        return [message for timestamp, _, message in self._entries if timestamp > after]
+
+class ConnectionManager:
+    """
+    Tracks this worker's WebSockets per chat and fans frames out through a
+    `BroadcastBackend`, so sockets connected to other workers receive them too.
+    While a chat has local sockets, the manager holds a subscription to the
+    chat's channel and relays everything published on it into each socket's
+    send queue. Payloads are serialized once by the caller, as JSON, and
+    re-encoded at most once per wire protocol on each worker; sockets whose
+    sends fail are pruned automatically.
+    The relay also keeps the chat's recent messages (see `RecentMessages`) for
+    sockets that reconnect; the subscription is held `resume_linger` seconds past
+    the chat's last socket, so a client that comes back within that is caught up
+    from memory.
+    """
+    def __init__(
+        self,
+        backend: BroadcastBackend | None = None,
+        max_queue: int = 256,
+        slow_consumer_policy: str = "coalesce",
+        resume_buffer_size: int = 100,
+        resume_linger: float = 0.0
+    ):
+        self.backend = backend or MemoryBroadcast()
+        self.max_queue = max_queue
+        self.slow_consumer_policy = slow_consumer_policy
+        self.resume_buffer_size = resume_buffer_size
+        self.resume_linger = resume_linger
+        self.active_connections: dict[str, dict[WebSocket, ClientConnection]] = {}
+        self._subscriptions: dict[str, Subscription] = {}
+        self._relays: dict[str, asyncio.Task] = {}
+        self._recent: dict[str, RecentMessages] = {}
+        self._lingering: dict[str, asyncio.Task] = {}
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        chat_id: str,
+        streaming: bool = False,
+        codec: JsonCodec | MsgpackCodec = LEGACY_CODEC,
+        subprotocol: str | None = None
+    ):
+        await websocket.accept(subprotocol=subprotocol)
+        if chat_id not in self.active_connections:
+            self.active_connections[chat_id] = {}
+            lingering = self._lingering.pop(chat_id, None)
+            if lingering is not None:
+                lingering.cancel()
+            else:
+                subscription = await self.backend.subscribe(chat_id)
+                self._subscriptions[chat_id] = subscription
+                self._recent[chat_id] = RecentMessages(self.resume_buffer_size)
+                self._relays[chat_id] = asyncio.create_task(self._relay(chat_id, subscription))
+        WS_CONNECTIONS.inc()
+        self.active_connections[chat_id][websocket] = ClientConnection(
+            websocket,
+            streaming,
+            self.max_queue,
+            self.slow_consumer_policy,
+            on_dead=lambda conn: asyncio.create_task(self.disconnect(conn.websocket, chat_id)),
+            codec=codec,
+        )
+
+    async def disconnect(self, websocket: WebSocket, chat_id: str):
+        connections = self.active_connections.get(chat_id)
+        if connections is None or websocket not in connections:
+            return
+        connections.pop(websocket).close()
+        WS_CONNECTIONS.dec()
+        if not connections:
+            del self.active_connections[chat_id]
+            if self.resume_linger > 0:
+                self._lingering[chat_id] = asyncio.create_task(self._unsubscribe_later(chat_id))
+            else:
+                await self._unsubscribe(chat_id)
+
+    async def _unsubscribe_later(self, chat_id: str):
+        await asyncio.sleep(self.resume_linger)
+        del self._lingering[chat_id]
+        await self._unsubscribe(chat_id)
+
+    async def _unsubscribe(self, chat_id: str):
+        self._relays.pop(chat_id).cancel()
+        del self._recent[chat_id]
+        await self._subscriptions.pop(chat_id).close()
+
+    async def broadcast(
+        self,
+        message: str,
+        chat_id: str,
+        streaming: bool | None = None,
+        transient: bool = False,
+        replay: bool = False,
+        missed_only: bool = False
+    ):
+        """
+        Publishes `message` to every socket in a chat, on any worker.
+        `streaming=True` targets only streaming sockets, `False` only the plain ones, `None` all of them.
+        `transient` marks frames a slow consumer may lose (see `ClientConnection`).
+        `replay` marks a chat message (a `Message` as JSON), kept for reconnecting sockets.
+        `missed_only` sends a chat message again, to just the sockets that connected
+        after its timestamp and so may have missed it.
+        """
+        start = time.perf_counter()
+        if missed_only:
+            target = _TARGET_LATE
+        else:
+            target = _TARGET_ALL if streaming is None else _TARGET_STREAMING if streaming else _TARGET_PLAIN
+        kind = _TRANSIENT if transient else _MESSAGE if replay else _DURABLE
+        await self.backend.publish(chat_id, target + kind + message)
+        WS_BROADCAST_SECONDS.observe(time.perf_counter() - start, stage="publish")
+
+    def send(self, websocket: WebSocket, chat_id: str, message: str):
+        """Queues a frame (JSON) for one local socket only, in order with its broadcasts."""
+        connection = self.active_connections.get(chat_id, {}).get(websocket)
+        if connection is not None:
+            connection.offer(connection.codec.encode(message))
+
+    async def drain(self, websocket: WebSocket, chat_id: str) -> bool:
+        """Waits until one local socket has sent everything queued for it; False if it is gone."""
+        connection = self.active_connections.get(chat_id, {}).get(websocket)
+        return connection is not None and await connection.drained()
+
+    def replay(
+        self, websocket: WebSocket, chat_id: str, after: datetime.datetime, after_id: str | None = None
+    ) -> bool:
+        """
+        Queues for one local socket the chat messages it missed since its last seen
+        one (see `RecentMessages.after`), ahead of anything broadcast later. Returns
+        False, sending nothing, when this worker's buffer doesn't reach back that far.
+        """
+        recent = self._recent.get(chat_id)
+        messages = recent.after(after, after_id) if recent is not None else None
+        if messages is None:
+            return False
+        for message in messages:
+            self.send(websocket, chat_id, message)
+        return True
+
+    async def _relay(self, chat_id: str, subscription: Subscription):
+        async for payload in subscription:
+            start = time.perf_counter()
+            target, kind, message = payload[0], payload[1], payload[2:]
+            transient = kind == _TRANSIENT
+            if kind == _MESSAGE:
+                self._recent[chat_id].append(message)
+            joined_after = None
+            if target == _TARGET_LATE:
+                # Compared with this worker's clock; workers are assumed to keep theirs in sync.
+                joined_after = datetime.datetime.fromisoformat(json.loads(message)["timestamp"])
+            encoded: dict[str, str | bytes] = {}
+            for connection in list(self.active_connections.get(chat_id, {}).values()):
+                if joined_after is not None:
+                    wanted = connection.connected_at > joined_after
+                else:
+                    wanted = target == _TARGET_ALL or connection.streaming == (target == _TARGET_STREAMING)
+                if wanted:
+                    protocol = connection.codec.subprotocol
+                    if protocol not in encoded:
+                        encoded[protocol] = connection.codec.encode(message)
+                    connection.offer(encoded[protocol], transient)
+            WS_BROADCAST_SECONDS.observe(time.perf_counter() - start, stage="fanout")
+
+    async def close(self):
+        """Drops every connection and subscription; used on shutdown."""
+        for task in [*self._relays.values(), *self._lingering.values()]:
+            task.cancel()
+        for subscription in self._subscriptions.values():
+            await subscription.close()
+        for connections in self.active_connections.values():
+            for connection in connections.values():
+                connection.close()
+                WS_CONNECTIONS.dec()
+        self._relays.clear()
+        self._lingering.clear()
+        self._recent.clear()
+        self._subscriptions.clear()
+        self.active_connections.clear()
@@ -0,0 +1,79 @@
+from ..models.message import Message, MessageMetadata
+
+# Fixed per-message cost for role markers and separators in the prompt.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+class ContextManager:
+    """
+    Fits a chat's history into a token budget.
+    Counts are a cheap local estimate (characters per token) rather than a call to
+    the model's tokenizer endpoint, and each message's count is cached in its
+    `metadata.tokenCount` so it is computed at most once.
+
+    The verbatim history is allowed to grow up to `token_budget`; once it does, the
+    oldest messages are folded into the chat's rolling summary until only
+    `recent_tokens` worth of recent turns remain. The gap between the two keeps
+    summarization to once every few turns instead of on every message.
+    """
+    def __init__(self, token_budget: int, recent_tokens: int, chars_per_token: float = 4.0):
+        self.token_budget = token_budget
+        self.recent_tokens = min(recent_tokens, token_budget)
+        self.chars_per_token = chars_per_token
+
+    def estimate(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token) + 1
+
+    def message_tokens(self, content: str) -> int:
+        return self.estimate(content) + MESSAGE_OVERHEAD_TOKENS
+
+    def count(self, message: Message) -> int:
+        if message.metadata is not None and message.metadata.tokenCount is not None:
+            return message.metadata.tokenCount
+        tokens = self.message_tokens(message.content)
+        if message.metadata is None:
+            message.metadata = MessageMetadata(tokenCount=tokens)
+        else:
+            message.metadata.tokenCount = tokens
+        return tokens
+
+    def fit(self, history: list[Message], prompt: str, summary: str | None = None) -> list[Message]:
+        """Returns the newest messages of `history` that fit in the budget next to the summary and prompt."""
+        remaining = self.token_budget - self.estimate(prompt) - (self.estimate(summary) if summary else 0)
+        start = len(history)
+        while start > 0:
+            tokens = self.count(history[start - 1])
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            start -= 1
+        return history[start:]
+
+    def overflow(self, history: list[Message]) -> list[Message]:
+        """
+        Returns the oldest messages that should be folded into the summary, or an
+        empty list while the verbatim history still fits in the budget.
+        """
+        total = sum(self.count(m) for m in history)
+        if total <= self.token_budget:
+            return []
+        end = 0
+        while end < len(history) and total > self.recent_tokens:
+            total -= self.count(history[end])
+            end += 1
+        return history[:end]
+
+    def batches(self, messages: list[Message]) -> list[list[Message]]:
+        """
+        Splits `messages` into consecutive runs of at most `token_budget` tokens (a
+        longer message gets a run of its own), so each can be summarized in one call.
+        """
+        runs: list[list[Message]] = []
+        tokens = 0
+        for message in messages:
+            count = self.count(message)
+            if not runs or tokens + count > self.token_budget:
+                runs.append([])
+                tokens = 0
+            runs[-1].append(message)
+            tokens += count
+        return runs
@@ -1,14 +1,63 @@
 from google.cloud.firestore_v1.client import Client
 from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.transaction import transactional
 from google.cloud.firestore_v1.transforms import Increment
 import datetime
+import logging
+import threading
+from ..config import settings
+from ..core.cache import TTLCache
+from ..core.metrics import registry
 from ..models.user import UserInDB
-from ..models.chat import Chat
-from ..models.message import Message
+from ..models.chat import Chat, chat_list_adapter
+from ..models.message import Message, message_list_adapter
+from ..services import search
+from ..services.storage import StorageService, last_message_fields
 
-class FirebaseService:
-    def __init__(self, db: Client):
+logger = logging.getLogger(__name__)
+
+# Firestore caps a batch at 500 writes.
+BATCH_WRITE_LIMIT = 400
+
+SEARCH_MESSAGES_UNINDEXED = registry.counter(
+    "search_messages_unindexed_total", "Saved messages left out of the search index, by reason."
+)
+
+def _cursor(field: str, value: datetime.datetime, item_id: str | None) -> dict:
+    """Query cursor on `field`, then the document id (documents are stored under their `id`)."""
+    if item_id is None:
+        return {field: value}
+    return {field: value, "__name__": item_id}
+
+class FirebaseService(StorageService):
+    """
+    Firestore-backed storage. See `StorageService` for the async twins and the chat cache.
+    """
+    backend = "firestore"
+
+    def __init__(self, db: Client, chat_cache: TTLCache | None = None):
+        super().__init__(chat_cache)
         self.db = db
+        # Saved messages waiting for the search indexer, by user (see "Search" below).
+        self._unindexed: dict[str, list[Message]] = {}
+        self._unindexed_count = 0
+        self._index_lock = threading.Lock()
+        self._index_wake = threading.Event()
+        self._index_stop = threading.Event()
+        self._index_thread: threading.Thread | None = None
+
+    def close(self) -> None:
+        """Indexes the messages still queued for search, then stops the indexer."""
+        with self._index_lock:
+            self._index_stop.set()
+            thread = self._index_thread
+        self._index_wake.set()
+        if thread is not None:
+            thread.join()
+
+    def warm_up(self) -> None:
+        # The client connects on first use; one small read opens the channel and fetches credentials.
+        self.db.collection("users").limit(1).get()
 
     def get_user(self, user_id: str) -> UserInDB | None:
         user_ref = self.db.collection("users").document(user_id)
@@ -21,57 +70,142 @@ class FirebaseService:
         user_id = user_data["uid"]
         user_ref = self.db.collection("users").document(user_id)
         user_data["createdAt"] = datetime.datetime.now(datetime.timezone.utc)
-        user_ref.set(user_data)
+        # A merge: chatsVersion and the search totals may already be on the document, and
+        # resetting chatsVersion could hand a client's old ETag back a stale 304.
+        user_ref.set(user_data, merge=True)
         return UserInDB(**user_data)
     
     def update_user_login_time(self, user_id: str):
         user_ref = self.db.collection("users").document(user_id)
         user_ref.update({"lastLoginAt": datetime.datetime.now(datetime.timezone.utc)})
 
-    def create_chat(self, user_id: str, title: str) -> Chat:
+    def get_chats_version(self, user_id: str) -> int | None:
+        user_doc = self.db.collection("users").document(user_id).get(field_paths=["chatsVersion"])
+        if not user_doc.exists:
+            return None
+        return user_doc.to_dict().get("chatsVersion", 0)
+
+    def _bump_chats_version(self, batch, user_id: str, **fields):
+        # A merge, so the bump never fails on a profile that hasn't been written yet.
+        batch.set(self.db.collection("users").document(user_id), {"chatsVersion": Increment(1), **fields}, merge=True)
+
+    def create_chat(self, user_id: str, title: str, cache_responses: bool = True) -> Chat:
         chat_ref = self.db.collection("chats").document()
+        now = datetime.datetime.now(datetime.timezone.utc)
         chat_data = {
             "id": chat_ref.id,
             "userId": user_id,
             "title": title,
-            "createdAt": datetime.datetime.now(datetime.timezone.utc),
+            "createdAt": now,
             "messageCount": 0,
-            "isActive": True
+            "isActive": True,
+            "cacheResponses": cache_responses,
+            "lastMessageAt": now
         }
-        chat_ref.set(chat_data)
-        return Chat(**chat_data)
+        batch = self.db.batch()
+        batch.set(chat_ref, chat_data)
+        self._bump_chats_version(batch, user_id)
+        batch.commit()
+        chat = Chat(**chat_data)
+        self.chat_cache.set(chat.id, chat)
+        return chat
 
     def get_chats_for_user(self, user_id: str) -> list[Chat]:
         chats_ref = self.db.collection("chats").where(filter=FieldFilter("userId", "==", user_id)).order_by("createdAt", direction="DESCENDING")
-        chats = [Chat(**doc.to_dict()) for doc in chats_ref.stream()]
+        chats = chat_list_adapter.validate_python([doc.to_dict() for doc in chats_ref.stream()])
         return chats
 
-    def get_chat(self, chat_id: str, user_id: str) -> Chat | None:
-        chat_ref = self.db.collection("chats").document(chat_id)
-        chat_doc = chat_ref.get()
-        if chat_doc.exists:
-            chat_data = chat_doc.to_dict()
-            if chat_data.get("userId") == user_id:
-                return Chat(**chat_data)
-        return None
+    def list_chats(
+        self,
+        user_id: str,
+        limit: int,
+        after: datetime.datetime | None = None,
+        sort: str = "createdAt",
+        active_since: datetime.datetime | None = None,
+        after_id: str | None = None
+    ) -> tuple[list[Chat], bool]:
+        # Needs the composite indexes (userId ASC, createdAt DESC) and (userId ASC, lastMessageAt DESC);
+        # the document id tiebreaker is part of every index implicitly.
+        query = self.db.collection("chats").where(filter=FieldFilter("userId", "==", user_id))
+        if active_since is not None:
+            query = query.where(filter=FieldFilter("lastMessageAt", ">=", active_since))
+        query = query.order_by(sort, direction="DESCENDING").order_by("__name__", direction="DESCENDING")
+        if after is not None:
+            query = query.start_after(_cursor(sort, after, after_id))
+        chats = chat_list_adapter.validate_python([doc.to_dict() for doc in query.limit(limit + 1).stream()])
+        for chat in chats:
+            self.chat_cache.set(chat.id, chat)
+        return chats[:limit], len(chats) > limit
+
+    def _fetch_chat(self, chat_id: str) -> Chat | None:
+        chat_doc = self.db.collection("chats").document(chat_id).get()
+        if not chat_doc.exists:
+            return None
+        return Chat(**chat_doc.to_dict())
         
-    def add_message_to_chat(self, chat_id: str, user_id: str, message_data: dict) -> Message:
-        message_ref = self.db.collection("messages").document()
-        full_message_data = {
-            "id": message_ref.id,
-            "chatId": chat_id,
-            "userId": user_id,
-            "timestamp": datetime.datetime.now(datetime.timezone.utc),
-            **message_data
-        }
-        message_ref.set(full_message_data)
+    def _fetch_chats(self, chat_ids: list[str]) -> list[Chat]:
+        refs = [self.db.collection("chats").document(chat_id) for chat_id in chat_ids]
+        return chat_list_adapter.validate_python([doc.to_dict() for doc in self.db.get_all(refs) if doc.exists])
 
-        # Increment message count in the chat document
+    def update_chat_summary(self, chat_id: str, summary: str, summarized_through: datetime.datetime):
         chat_ref = self.db.collection("chats").document(chat_id)
-        chat_ref.update({"messageCount": Increment(1)})
+        chat_ref.update({"summary": summary, "summarizedThrough": summarized_through})
+        self._update_cached_chat(chat_id, summary=summary, summarizedThrough=summarized_through)
+
+    def backfill_chat_activity(self) -> int:
+        updated = 0
+        batch, pending = self.db.batch(), 0
+        for chat_doc in self.db.collection("chats").stream():
+            chat_data = chat_doc.to_dict()
+            if chat_data.get("lastMessageAt") is not None:
+                continue
+            latest = (
+                self.db.collection("messages")
+                .where(filter=FieldFilter("chatId", "==", chat_doc.id))
+                .order_by("timestamp")
+                .limit_to_last(1)
+                .get()
+            )
+            if latest:
+                fields = last_message_fields(message_list_adapter.validate_python([latest[0].to_dict()]))
+            else:
+                fields = {"lastMessageAt": chat_data["createdAt"]}
+            batch.update(chat_doc.reference, fields)
+            # The owner's cached chat lists don't have these fields yet.
+            self._bump_chats_version(batch, chat_data["userId"])
+            updated += 1
+            pending += 2
+            if pending >= BATCH_WRITE_LIMIT:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+        if pending:
+            batch.commit()
+        self.chat_cache.clear()
+        return updated
+
+    def new_message_id(self) -> str:
+        return self.db.collection("messages").document().id
 
+    def add_messages(self, chat_id: str, user_id: str, messages: list[dict]) -> list[Message]:
+        """One atomic batch, i.e. a single round trip; the search postings are written later (see below)."""
+        if not messages:
+            return []
+        batch = self.db.batch()
+        full_messages = []
+        for message_data in messages:
+            full_message_data = self.build_message(chat_id, user_id, {}, message_data.get("id")) | message_data
+            batch.set(self.db.collection("messages").document(full_message_data["id"]), full_message_data)
+            full_messages.append(full_message_data)
 
-        return Message(**full_message_data)
+        saved = message_list_adapter.validate_python(full_messages)
+        last_message = last_message_fields(saved)
+        chat_ref = self.db.collection("chats").document(chat_id)
+        batch.update(chat_ref, {"messageCount": Increment(len(full_messages)), **last_message})
+        self._bump_chats_version(batch, user_id)
+        batch.commit()
+        self._update_cached_chat(chat_id, added_messages=len(full_messages), **last_message)
+        self._queue_for_index(user_id, saved)
+        return saved
 
     def get_messages_for_chat(self, chat_id: str, user_id: str) -> list[Message]:
         # First, validate user has access to this chat
@@ -79,5 +213,235 @@ class FirebaseService:
             return []
             
         messages_ref = self.db.collection("messages").where(filter=FieldFilter("chatId", "==", chat_id)).order_by("timestamp")
-        messages = [Message(**doc.to_dict()) for doc in messages_ref.stream()]
-        return messages
\ No newline at end of file
+        messages = message_list_adapter.validate_python([doc.to_dict() for doc in messages_ref.stream()])
+        return messages
+
+    def list_messages(
+        self,
+        chat_id: str,
+        limit: int,
+        before: datetime.datetime | None = None,
+        after: datetime.datetime | None = None,
+        before_id: str | None = None,
+        after_id: str | None = None
+    ) -> tuple[list[Message], bool]:
+        query = (
+            self.db.collection("messages")
+            .where(filter=FieldFilter("chatId", "==", chat_id))
+            .order_by("timestamp")
+            .order_by("__name__")
+        )
+        if after is not None:
+            docs = query.start_after(_cursor("timestamp", after, after_id)).limit(limit + 1).stream()
+            messages = message_list_adapter.validate_python([doc.to_dict() for doc in docs])
+            return messages[:limit], len(messages) > limit
+        if before is not None:
+            query = query.end_before(_cursor("timestamp", before, before_id))
+        messages = message_list_adapter.validate_python([doc.to_dict() for doc in query.limit_to_last(limit + 1).get()])
+        return messages[-limit:], len(messages) > limit
+
+    def get_messages_after(self, chat_id: str, after: datetime.datetime) -> list[Message]:
+        messages_ref = (
+            self.db.collection("messages")
+            .where(filter=FieldFilter("chatId", "==", chat_id))
+            .where(filter=FieldFilter("timestamp", ">", after))
+            .order_by("timestamp")
+        )
+        return message_list_adapter.validate_python([doc.to_dict() for doc in messages_ref.stream()])
+
+    def get_messages_by_ids(self, message_ids: list[str]) -> list[Message]:
+        refs = [self.db.collection("messages").document(message_id) for message_id in message_ids]
+        found = {doc.id: doc.to_dict() for doc in self.db.get_all(refs) if doc.exists}
+        return message_list_adapter.validate_python([found[message_id] for message_id in message_ids if message_id in found])
+
+    # --- Search ---
+    # A user's index lives under `searchIndex/<userId>/terms`, one head document per
+    # term holding `df` (how many messages have the term), `n` (how many chunks it
+    # has sealed) and `p`, the newest postings as a map of message id -> posting.
+    # Once `p` reaches SEARCH_INDEX_CHUNK_POSTINGS it is sealed, unchanged, into
+    # `terms/<term>/chunks/<i>`, numbered from 0, oldest first. Writing a batch of
+    # messages therefore costs one write per distinct term (two when a chunk is
+    # sealed), and reading a term costs its head plus at most
+    # SEARCH_MAX_CHUNKS_PER_TERM of its newest chunks. `p` is never queried, so its
+    # single-field indexes should be exempted (see the README).
+    #
+    # Messages are indexed off the request path: `add_messages` queues them, and a
+    # background thread writes each user's queue at most every
+    # SEARCH_INDEX_DELAY_SECONDS, in transactions that also bump the user's totals
+    # and, with the last one, `searchVersion`. A flush that fails, or messages that
+    # find the queue full, leave those messages unsearchable until the next rebuild,
+    # but never lose the turn.
+
+    def _search_terms(self, user_id: str):
+        return self.db.collection("searchIndex").document(user_id).collection("terms")
+
+    def _queue_for_index(self, user_id: str, messages: list[Message]) -> None:
+        with self._index_lock:
+            if self._index_stop.is_set():
+                queued = False
+            elif self._unindexed_count + len(messages) > settings.SEARCH_INDEX_MAX_PENDING:
+                SEARCH_MESSAGES_UNINDEXED.inc(len(messages), reason="queue_full")
+                logger.warning("Search index queue is full; %d messages of user %s left unindexed", len(messages), user_id)
+                return
+            else:
+                self._unindexed.setdefault(user_id, []).extend(messages)
+                self._unindexed_count += len(messages)
+                queued = True
+                if self._index_thread is None:
+                    self._index_thread = threading.Thread(target=self._run_indexer, name="search-indexer", daemon=True)
+                    self._index_thread.start()
+        if queued:
+            self._index_wake.set()
+        else:
+            # Closing: nothing will flush the queue any more.
+            self._index_now(user_id, messages)
+
+    def _run_indexer(self) -> None:
+        while not self._index_stop.is_set():
+            self._index_wake.wait()
+            # Let more turns arrive first, so a user's common terms are written once for all of them.
+            self._index_stop.wait(settings.SEARCH_INDEX_DELAY_SECONDS)
+            self._index_wake.clear()
+            self.flush_search_index()
+        self.flush_search_index()
+
+    def flush_search_index(self) -> None:
+        """Indexes every message queued so far, now."""
+        with self._index_lock:
+            pending, self._unindexed, self._unindexed_count = self._unindexed, {}, 0
+        for user_id, messages in pending.items():
+            self._index_now(user_id, messages)
+
+    def _index_now(self, user_id: str, messages: list[Message]) -> None:
+        try:
+            self._index_messages(user_id, messages)
+        except Exception:
+            SEARCH_MESSAGES_UNINDEXED.inc(len(messages), reason="error")
+            logger.exception("Failed to index %d messages of user %s for search", len(messages), user_id)
+
+    def _index_messages(self, user_id: str, messages: list[Message]) -> None:
+        postings, total_length = search.index_messages(messages)
+        terms = list(postings)
+        # A term takes at most two writes; the user document goes with the last group.
+        per_transaction = (BATCH_WRITE_LIMIT - 1) // 2
+        groups = [terms[i:i + per_transaction] for i in range(0, len(terms), per_transaction)] or [[]]
+        for i, group in enumerate(groups):
+            totals = (len(messages), total_length) if i == len(groups) - 1 else None
+            transactional(self._append_postings)(
+                self.db.transaction(), user_id, {term: postings[term] for term in group}, totals
+            )
+
+    def _append_postings(
+        self, transaction, user_id: str, postings: dict[str, dict[str, int]], totals: tuple[int, int] | None
+    ) -> None:
+        terms_ref = self._search_terms(user_id)
+        refs = [terms_ref.document(term) for term in postings]
+        heads = {doc.id: doc.to_dict() or {} for doc in self.db.get_all(refs, transaction=transaction)} if refs else {}
+        for term, term_postings in postings.items():
+            head = heads.get(term, {})
+            tail = head.get("p", {}) | term_postings
+            chunks = head.get("n", 0)
+            if len(tail) >= settings.SEARCH_INDEX_CHUNK_POSTINGS:
+                transaction.set(terms_ref.document(term).collection("chunks").document(str(chunks)), {"p": tail})
+                tail, chunks = {}, chunks + 1
+            transaction.set(terms_ref.document(term), {"df": head.get("df", 0) + len(term_postings), "n": chunks, "p": tail})
+        if totals is not None:
+            documents, length = totals
+            transaction.set(
+                self.db.collection("users").document(user_id),
+                {"searchDocuments": Increment(documents), "searchLength": Increment(length), "searchVersion": Increment(1)},
+                merge=True,
+            )
+
+    def _write_all(self, writes: list[tuple]) -> None:
+        """Commits `(ref, data, merge)` sets, or deletes where `data` is None, in as few batches as allowed."""
+        for start in range(0, len(writes), BATCH_WRITE_LIMIT):
+            batch = self.db.batch()
+            for ref, data, merge in writes[start:start + BATCH_WRITE_LIMIT]:
+                if data is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, data, merge=merge)
+            batch.commit()
+
+    def get_search_version(self, user_id: str) -> int | None:
+        user_doc = self.db.collection("users").document(user_id).get(field_paths=["searchVersion"])
+        if not user_doc.exists:
+            return None
+        return user_doc.to_dict().get("searchVersion", 0)
+
+    def get_search_postings(
+        self, user_id: str, terms: list[str]
+    ) -> tuple[dict[str, dict[str, int]], dict[str, int], int, int]:
+        # Two round trips: the user's totals with the terms' heads, then the newest chunks.
+        user_ref = self.db.collection("users").document(user_id)
+        terms_ref = self._search_terms(user_id)
+        docs = {doc.reference.path: doc for doc in self.db.get_all([user_ref, *(terms_ref.document(term) for term in terms)])}
+        user_doc = docs.get(user_ref.path)
+        totals = user_doc.to_dict() if user_doc is not None and user_doc.exists else {}
+        postings: dict[str, dict[str, int]] = {}
+        frequencies: dict[str, int] = {}
+        chunk_refs = []
+        for term in terms:
+            head_doc = docs.get(terms_ref.document(term).path)
+            if head_doc is None or not head_doc.exists:
+                continue
+            head = head_doc.to_dict()
+            frequencies[term] = head.get("df", 0)
+            postings[term] = dict(head.get("p", {}))
+            chunks = head.get("n", 0)
+            chunk_refs += [
+                terms_ref.document(term).collection("chunks").document(str(i))
+                for i in range(chunks - 1, max(chunks - settings.SEARCH_MAX_CHUNKS_PER_TERM, 0) - 1, -1)
+            ]
+        if chunk_refs:
+            for doc in self.db.get_all(chunk_refs):
+                if doc.exists:
+                    postings[doc.reference.parent.parent.id].update(doc.get("p"))
+        postings = {term: term_postings for term, term_postings in postings.items() if term_postings}
+        return postings, frequencies, totals.get("searchDocuments", 0), totals.get("searchLength", 0)
+
+    def rebuild_search_index(self) -> int:
+        self.flush_search_index()
+        user_ids = {doc.get("userId") for doc in self.db.collection("chats").select(["userId"]).stream()}
+        size = settings.SEARCH_INDEX_CHUNK_POSTINGS
+        indexed = 0
+        for user_id in user_ids:
+            messages_ref = self.db.collection("messages").where(filter=FieldFilter("userId", "==", user_id))
+            messages = message_list_adapter.validate_python([doc.to_dict() for doc in messages_ref.stream()])
+            # Oldest first, so every chunk covers a stretch of time as it would have been sealed.
+            messages.sort(key=lambda m: (m.timestamp, m.id))
+            postings, total_length = search.index_messages(messages)
+            terms_ref = self._search_terms(user_id)
+            writes = []
+            sealed: dict[str, int] = {}
+            for term, term_postings in postings.items():
+                items = list(term_postings.items())
+                sealed[term] = len(items) // size
+                for i in range(sealed[term]):
+                    chunk = dict(items[i * size:(i + 1) * size])
+                    writes.append((terms_ref.document(term).collection("chunks").document(str(i)), {"p": chunk}, False))
+                tail = dict(items[sealed[term] * size:])
+                writes.append((terms_ref.document(term), {"df": len(items), "n": sealed[term], "p": tail}, False))
+            # Terms and chunks left over from messages that no longer exist go too, and
+            # so do the postings of the old one-document-per-posting layout.
+            heads = list(terms_ref.list_documents())
+            for doc in self.db.get_all(heads) if heads else []:
+                chunks = (doc.to_dict() or {}).get("n", 0)
+                if doc.id not in sealed:
+                    writes.append((doc.reference, None, False))
+                writes += [
+                    (doc.reference.collection("chunks").document(str(i)), None, False)
+                    for i in range(sealed.get(doc.id, 0), chunks)
+                ]
+            legacy_ref = self.db.collection("searchIndex").document(user_id).collection("postings")
+            writes += [(ref, None, False) for ref in legacy_ref.list_documents()]
+            # Last, so searchVersion moves once the new index is in place.
+            writes.append((
+                self.db.collection("users").document(user_id),
+                {"searchDocuments": len(messages), "searchLength": total_length, "searchVersion": Increment(1)},
+                True,
+            ))
+            self._write_all(writes)
+            indexed += len(messages)
+        return indexed
@@ -0,0 +1,105 @@
+import datetime
+
+from ..core.cache import TTLCache
+from ..core.metrics import registry
+from ..models.message import Message
+
+HISTORY_MESSAGES_DROPPED = registry.counter(
+    "history_messages_dropped_total", "Cached messages dropped unsummarized by the per-chat cap."
+)
+
+class ChatHistory:
+    """
+    The cached tail of one chat, oldest first.
+    `synced_at` is the newest timestamp read back from the database; anything this
+    process saved itself is appended locally without moving it, so a catch-up read
+    from `synced_at` still sees messages other workers wrote in between.
+    """
+    def __init__(
+        self,
+        messages: list[Message],
+        summary: str | None = None,
+        summarized_through: datetime.datetime | None = None
+    ):
+        self.messages = messages
+        self.synced_at: datetime.datetime | None = messages[-1].timestamp if messages else summarized_through
+        # Rolling summary of everything up to `summarized_through`; `messages` holds what follows it.
+        self.summary = summary
+        self.summarized_through = summarized_through
+        self.summarizing = False
+
+    def add(self, messages: list[Message]) -> None:
+        known = {m.id for m in self.messages}
+        new = [m for m in messages if m.id not in known]
+        if not new:
+            return
+        tail = self.messages[-1].timestamp if self.messages else None
+        self.messages.extend(new)
+        if tail is not None and min(m.timestamp for m in new) < tail:
+            self.messages.sort(key=lambda m: m.timestamp)
+
+class HistoryCache:
+    """
+    In-memory message history for active chats.
+    Chats are LRU-evicted (and dropped after sitting idle for the TTL). Each chat
+    holds the messages after its rolling summary, at most `max_messages` of them.
+    `ChatService` folds the oldest into the summary in the background well before
+    that, so the cap only drops messages (lost to the model) when summarization
+    falls behind or fails.
+    """
+    def __init__(self, max_chats: int, max_messages: int, ttl: float):
+        self.max_messages = max_messages
+        self._chats = TTLCache(maxsize=max_chats, ttl=ttl)
+
+    def get(self, chat_id: str) -> ChatHistory | None:
+        return self._chats.get(chat_id)
+
+    def put(
+        self,
+        chat_id: str,
+        messages: list[Message],
+        summary: str | None = None,
+        summarized_through: datetime.datetime | None = None
+    ) -> ChatHistory:
+        """Replaces a chat's entry with a full load from the database."""
+        history = ChatHistory(list(messages), summary, summarized_through)
+        self._trim(history)
+        self._chats.set(chat_id, history)
+        return history
+
+    def append(self, chat_id: str, messages: list[Message]) -> None:
+        """Adds messages this process just saved; a chat that isn't cached is left alone."""
+        history = self._chats.get(chat_id)
+        if history is not None:
+            history.add(messages)
+            self._trim(history)
+
+    def merge(self, chat_id: str, messages: list[Message]) -> None:
+        """Adds messages read back from the database and advances the sync point."""
+        history = self._chats.get(chat_id)
+        if history is not None and messages:
+            history.add(messages)
+            history.synced_at = max(m.timestamp for m in messages)
+            self._trim(history)
+
+    def fold(self, chat_id: str, folded: list[Message], summary: str) -> None:
+        """Replaces `folded` (the oldest messages, some perhaps already capped away) with the updated rolling summary."""
+        history = self._chats.get(chat_id)
+        if history is None or not folded:
+            return
+        folded_ids = {m.id for m in folded}
+        history.messages = [m for m in history.messages if m.id not in folded_ids]
+        history.summary = summary
+        history.summarized_through = folded[-1].timestamp
+
+    def _trim(self, history: ChatHistory) -> None:
+        excess = len(history.messages) - self.max_messages
+        if excess > 0:
+            del history.messages[:excess]
+            HISTORY_MESSAGES_DROPPED.inc(excess)
+
+    def invalidate(self, chat_id: str) -> None:
+        self._chats.invalidate(chat_id)
+
+    def stats(self) -> dict:
+        return self._chats.stats()
@@ -1,58 +1,225 @@
+import logging
 import time
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-from langchain_core.messages import HumanMessage, AIMessage
+from typing import AsyncIterator
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 
 from ..config import settings
+from ..core import tracing
+from ..core.metrics import registry
 from ..models.message import Message as MessageModel
+from ..services.llm_scheduler import LLMScheduler
+from ..services.model_router import ModelRouter
+
+logger = logging.getLogger(__name__)
+
+LLM_RESPONSE_SECONDS = registry.histogram(
+    "llm_response_seconds", "Complete model calls, by model, mode (invoke, stream, summary) and outcome.",
+    ["model", "mode", "outcome"],
+)
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "Estimated tokens sent to the model (prompt) and produced by it (completion).", ["model", "kind"]
+)
+
+ERROR_REPLY = "I'm sorry, I encountered an error and couldn't process your request."
+
+SUMMARY_PROMPT = """Progressively summarize the conversation below, extending the previous summary.
+Keep names, facts, decisions, user preferences and open questions. Reply with the new summary only.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
 
 class LangChainService:
-    def __init__(self):
+    """
+    Wraps the Gemini chat models. Async calls go through a `ModelRouter`, which
+    picks the model (LLM_MODEL, or LLM_FAST_MODEL for small prompts) and hedges
+    slow requests; replies report the model that actually served them. When a
+    `scheduler` is given, every async model call also goes through it
+    (concurrency and token-rate limits, per-user fairness, rate-limit retries),
+    so the clients' own retry loop is turned off.
+    """
+    def __init__(self, scheduler: LLMScheduler | None = None):
+        # Imported here: the Gemini SDK is the heaviest import in the app, so it is
+        # only paid for once a client is actually created.
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        self.scheduler = scheduler
+        client_options = {"max_retries": 1} if scheduler is not None else {}
+        models = [settings.LLM_MODEL, settings.LLM_FAST_MODEL, settings.LLM_HEDGE_MODEL]
         try:
-            self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", google_api_key=settings.GOOGLE_API_KEY)
+            self.backends = {
+                model: ChatGoogleGenerativeAI(model=model, google_api_key=settings.GOOGLE_API_KEY, **client_options)
+                for model in dict.fromkeys(m for m in models if m)
+            }
         except Exception as e:
             raise RuntimeError(f"Failed to initialize LangChain LLM: {e}")
+        self.llm = self.backends[settings.LLM_MODEL]
+        self.router = ModelRouter(
+            self.backends,
+            primary=settings.LLM_MODEL,
+            fast=settings.LLM_FAST_MODEL or None,
+            fast_max_tokens=settings.LLM_FAST_MODEL_MAX_TOKENS,
+            hedge=settings.LLM_HEDGE_MODEL or None,
+            hedge_enabled=settings.LLM_HEDGE_ENABLED,
+            hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+            hedge_min_samples=settings.LLM_HEDGE_MIN_SAMPLES,
+            hedge_default_delay=settings.LLM_HEDGE_DEFAULT_DELAY_SECONDS,
+            scheduler=scheduler,
+        )
+
+    def create_embeddings(self):
+        """Builds the embeddings client used by the semantic response cache."""
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=settings.RESPONSE_CACHE_EMBEDDING_MODEL, google_api_key=settings.GOOGLE_API_KEY)
+
+    def close(self):
+        """Releases the gRPC channels held by the model clients."""
+        for llm in self.backends.values():
+            transport = getattr(getattr(llm, "client", None), "transport", None)
+            if transport is not None:
+                try:
+                    transport.close()
+                except Exception as e:
+                    logger.warning("Error closing Gemini client: %s", e)
+
+    async def awarm_up(self) -> None:
+        """
+        Opens the connections the async calls use, before the first user request
+        needs them, with a token count (no generation) against every model.
+        """
+        from google.ai.generativelanguage_v1beta.types import Content, Part
 
-    def generate_response(self, chat_history: list[MessageModel], prompt: str) -> dict:
+        for llm in self.backends.values():
+            await llm.async_client.count_tokens(model=llm.model, contents=[Content(parts=[Part(text="ping")])])
+
+    def _build_messages(self, chat_history: list[MessageModel], prompt: str, summary: str | None = None) -> list[BaseMessage]:
         """
-        Generates a response from the AI using the conversation history.
+        Converts the stored chat history plus the new prompt into LangChain chat messages.
+        `summary`, when given, stands in for the turns older than `chat_history`.
         """
-        print(f"🧠 [LangChain] Generating response for prompt: '{prompt}'") # <-- ADD THIS LINE
-        memory = ConversationBufferMemory()
-        
-        # Load previous messages into memory
+        messages: list[BaseMessage] = []
+        if summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
         for msg in chat_history:
+            if not msg.content:
+                # A reply stopped before it produced anything.
+                continue
             if msg.role == 'user':
-                memory.chat_memory.add_message(HumanMessage(content=msg.content))
+                messages.append(HumanMessage(content=msg.content))
             elif msg.role == 'assistant':
-                memory.chat_memory.add_message(AIMessage(content=msg.content))
+                messages.append(AIMessage(content=msg.content))
+        messages.append(HumanMessage(content=prompt))
+        return messages
+
+    def _estimate_tokens(self, messages: list[BaseMessage]) -> int:
+        return int(sum(len(m.content) for m in messages) / settings.CONTEXT_CHARS_PER_TOKEN)
+
+    def _record(self, model: str, mode: str, outcome: str, start_time: float, prompt_tokens: int, completion: str) -> None:
+        LLM_RESPONSE_SECONDS.observe(time.time() - start_time, model=model, mode=mode, outcome=outcome)
+        LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+        if completion:
+            LLM_TOKENS.inc(int(len(completion) / settings.CONTEXT_CHARS_PER_TOKEN), model=model, kind="completion")
+
+    async def _ainvoke(self, messages: list[BaseMessage], tokens: int, user_id: str | None) -> tuple[str, BaseMessage]:
+        """Returns `(model, response)`."""
+        if self.scheduler is None:
+            return await self.router.ainvoke(messages, tokens)
+        model, response = await self.scheduler.call(user_id or "", tokens, lambda: self.router.ainvoke(messages, tokens))
+        self.scheduler.charge(int(len(response.content) / settings.CONTEXT_CHARS_PER_TOKEN))
+        return model, response
+
+    async def _astream(self, messages: list[BaseMessage], tokens: int, user_id: str | None) -> AsyncIterator[tuple[str, BaseMessage]]:
+        """Yields `(model, chunk)`."""
+        if self.scheduler is None:
+            async for item in self.router.astream(messages, tokens):
+                yield item
+            return
+        produced = 0
+        try:
+            async for model, chunk in self.scheduler.stream(user_id or "", tokens, lambda: self.router.astream(messages, tokens)):
+                produced += len(chunk.content)
+                yield model, chunk
+        finally:
+            self.scheduler.charge(int(produced / settings.CONTEXT_CHARS_PER_TOKEN))
+
+    async def astream_response(
+        self, chat_history: list[MessageModel], prompt: str, summary: str | None = None, user_id: str | None = None
+    ) -> AsyncIterator[dict]:
+        """
+        Streams a response from the AI as it is generated.
+        Yields `{"delta": str}` for every chunk of output, then a single final
+        `{"content": str, "metadata": dict}` with the model used and the response time.
+        """
+        messages = self._build_messages(chat_history, prompt, summary)
+        tokens = self._estimate_tokens(messages)
+        model = self.router.route(tokens)
 
-        conversation = ConversationChain(
-            llm=self.llm,
-            memory=memory,
-            verbose=False # Set to True for debugging
-        )
-        
         start_time = time.time()
+        parts: list[str] = []
+        # Not a current span: this generator yields to the caller while it runs.
+        span = tracing.start_span("llm.stream", prompt_tokens=tokens)
+        # Stays None if the consumer stops reading (a stop frame or a disconnect).
+        outcome = None
         try:
-            response = conversation.predict(input=prompt)
+            async for model, chunk in self._astream(messages, tokens, user_id):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield {"delta": chunk.content}
             end_time = time.time()
-            
-            return {
-                "content": response,
+            outcome = "ok"
+            self._record(model, "stream", outcome, start_time, tokens, "".join(parts))
+
+            yield {
+                "content": "".join(parts),
                 "metadata": {
-                    "model": "gemini-pro",
+                    "model": model,
                     "responseTime": round(end_time - start_time, 2)
                 }
             }
         except Exception as e:
-            # Handle potential API errors gracefully
-            print(f"Error calling Gemini API: {e}")
-            return {
-                "content": "I'm sorry, I encountered an error and couldn't process your request.",
+            outcome = "error"
+            logger.warning("Error streaming from Gemini API: %s", e)
+            self._record(model, "stream", outcome, start_time, tokens, "".join(parts))
+            # Keep whatever was already delivered to the clients; fall back to the
+            # generic error reply only if nothing was produced.
+            yield {
+                "content": "".join(parts) or ERROR_REPLY,
                 "metadata": {
-                    "model": "gemini-pro",
+                    "model": model,
                     "error": str(e)
                 }
-            }
\ No newline at end of file
+            }
+        finally:
+            if outcome is None:
+                self._record(model, "stream", "cancelled", start_time, tokens, "".join(parts))
+            span.set_attribute("model", model)
+            span.set_attribute("outcome", outcome or "cancelled")
+            span.end()
+
+    async def asummarize(
+        self, previous_summary: str | None, chat_history: list[MessageModel], user_id: str | None = None
+    ) -> str | None:
+        """
+        Folds `chat_history` into `previous_summary`. Returns None if the model call fails,
+        in which case the caller keeps the messages verbatim and retries later.
+        """
+        lines = "\n".join(
+            f"{'Human' if msg.role == 'user' else 'AI'}: {msg.content}" for msg in chat_history
+        )
+        prompt = SUMMARY_PROMPT.format(summary=previous_summary or "(none)", lines=lines)
+        messages = [HumanMessage(content=prompt)]
+        tokens = self._estimate_tokens(messages)
+        start_time = time.time()
+        try:
+            with tracing.span("llm.summarize", prompt_tokens=tokens):
+                model, response = await self._ainvoke(messages, tokens, user_id)
+            self._record(model, "summary", "ok", start_time, tokens, response.content)
+            return response.content
+        except Exception as e:
+            logger.warning("Error summarizing conversation: %s", e)
+            self._record(self.router.route(tokens), "summary", "error", start_time, tokens, "")
+            return None
@@ -0,0 +1,238 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+from ..core.metrics import registry
+
+T = TypeVar("T")
+
+LLM_QUEUE_DEPTH = registry.gauge("llm_queue_depth", "LLM calls waiting for a slot.")
+LLM_ACTIVE = registry.gauge("llm_active_calls", "LLM calls currently running.")
+LLM_WAIT_SECONDS = registry.histogram("llm_queue_wait_seconds", "Time LLM calls spent queued before running.")
+LLM_RETRIES = registry.counter("llm_retries_total", "LLM calls retried after a rate-limit error.")
+LLM_RATE_LIMITED = registry.counter("llm_rate_limited_total", "Rate-limit errors returned by the model provider.")
+
+_RATE_LIMIT_TYPES = ("ResourceExhausted", "TooManyRequests", "RateLimitError")
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    True for provider quota / rate-limit errors, wrapped or not: the google-api-core
+    and OpenAI-style exception types, or any error whose status is HTTP 429 or gRPC
+    RESOURCE_EXHAUSTED. Messages are not inspected, so "4290 tokens" is not a 429.
+    """
+    while error is not None:
+        if type(error).__name__ in _RATE_LIMIT_TYPES:
+            return True
+        for attribute in ("code", "status_code", "status", "grpc_status_code"):
+            status = getattr(error, attribute, None)
+            if attribute == "code" and callable(status):
+                # grpc.RpcError exposes its status as `code()`.
+                status = status()
+            if status == 429 or getattr(status, "name", status) == "RESOURCE_EXHAUSTED":
+                return True
+        error = error.__cause__
+    return False
+
+class _Waiter:
+    __slots__ = ("future", "tokens", "queued_at")
+
+    def __init__(self, future: asyncio.Future, tokens: int):
+        self.future = future
+        self.tokens = tokens
+        self.queued_at = time.monotonic()
+
+class LLMScheduler:
+    """
+    Admission control in front of the model provider.
+    At most `max_concurrency` calls run at once, and, when `tokens_per_minute` is
+    set, calls are admitted only while a token bucket refilled at that rate can
+    pay for their estimated prompt size (output tokens are charged afterwards
+    with `charge`). Waiting calls are queued per user and slots are handed out
+    round-robin across users, so one user with many turns in flight cannot
+    starve the rest. Rate-limit errors are retried with jittered exponential
+    backoff, outside the slot so other calls can use it meanwhile.
+    """
+    def __init__(
+        self,
+        max_concurrency: int,
+        tokens_per_minute: int = 0,
+        max_retries: int = 3,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 8.0
+    ):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._active = 0
+        # Users with queued calls, in round-robin order; each holds its own FIFO.
+        self._queues: OrderedDict[str, deque[_Waiter]] = OrderedDict()
+        self._queued = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, tokens: int = 0) -> AsyncIterator[None]:
+        """Waits for this user's turn and a free slot, and holds the slot for the block."""
+        await self._acquire(user_id, tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def try_acquire(self, tokens: int = 0) -> bool:
+        """
+        Takes a slot, and `tokens` from the bucket, only if both are free right now and
+        no call is queued for them; never waits. A successful caller must `release`.
+        """
+        if self._queued or self._active >= self.max_concurrency:
+            return False
+        if self.tokens_per_minute > 0:
+            self._refill()
+            if self._tokens < min(tokens, self.tokens_per_minute):
+                return False
+            self._tokens -= tokens
+        self._active += 1
+        LLM_ACTIVE.set(self._active)
+        return True
+
+    def charge(self, tokens: int) -> None:
+        """Takes tokens spent beyond the admission estimate (e.g. the output) from the bucket."""
+        if self.tokens_per_minute > 0 and tokens > 0:
+            self._refill()
+            self._tokens -= tokens
+
+    async def call(self, user_id: str, tokens: int, fn: Callable[[], Awaitable[T]]) -> T:
+        """Runs `fn()` in a slot, retrying it on rate-limit errors."""
+        attempt = 0
+        while True:
+            async with self.slot(user_id, tokens):
+                try:
+                    return await fn()
+                except Exception as e:
+                    if not self._should_retry(e, attempt):
+                        raise
+            await self._backoff(attempt)
+            attempt += 1
+
+    async def stream(self, user_id: str, tokens: int, fn: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """
+        Iterates `fn()` in a slot. A rate-limit error is retried only while nothing
+        has been yielded yet; after that, replaying the stream would repeat output.
+        """
+        attempt = 0
+        while True:
+            produced = False
+            async with self.slot(user_id, tokens):
+                try:
+                    async for item in fn():
+                        produced = True
+                        yield item
+                    return
+                except Exception as e:
+                    if produced or not self._should_retry(e, attempt):
+                        raise
+            await self._backoff(attempt)
+            attempt += 1
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        if not is_rate_limit_error(error):
+            return False
+        LLM_RATE_LIMITED.inc()
+        return attempt < self.max_retries
+
+    async def _backoff(self, attempt: int) -> None:
+        LLM_RETRIES.inc()
+        # "Full jitter": spreads out the retries of calls that were throttled together.
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)
+        await asyncio.sleep(random.uniform(0, delay))
+
+    async def _acquire(self, user_id: str, tokens: int) -> None:
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), tokens)
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+        queue.append(waiter)
+        self._queued += 1
+        LLM_QUEUE_DEPTH.set(self._queued)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller gave up: hand the slot on.
+                self.release()
+            else:
+                self._discard(user_id, waiter)
+            raise
+
+    def _discard(self, user_id: str, waiter: _Waiter) -> None:
+        queue = self._queues.get(user_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        LLM_QUEUE_DEPTH.set(self._queued)
+        if not queue:
+            del self._queues[user_id]
+        self._dispatch()
+
+    def release(self) -> None:
+        """Gives back a slot taken with `try_acquire` (`slot` releases its own)."""
+        self._active -= 1
+        LLM_ACTIVE.set(self._active)
+        self._dispatch()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        rate = self.tokens_per_minute / 60.0
+        self._tokens = min(float(self.tokens_per_minute), self._tokens + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrency and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if self.tokens_per_minute > 0:
+                self._refill()
+                # A single call larger than the whole bucket only waits for a full bucket.
+                needed = min(waiter.tokens, self.tokens_per_minute)
+                if self._tokens < needed:
+                    self._schedule_refill(needed - self._tokens)
+                    return
+                self._tokens -= waiter.tokens
+            queue.popleft()
+            self._queued -= 1
+            # Round-robin: this user goes to the back of the line.
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+            self._active += 1
+            LLM_QUEUE_DEPTH.set(self._queued)
+            LLM_ACTIVE.set(self._active)
+            LLM_WAIT_SECONDS.observe(time.monotonic() - waiter.queued_at)
+            waiter.future.set_result(None)
+
+    def _schedule_refill(self, deficit: float) -> None:
+        if self._timer is not None:
+            return
+        delay = deficit / (self.tokens_per_minute / 60.0)
+
+        def wake():
+            self._timer = None
+            self._dispatch()
+
+        self._timer = asyncio.get_running_loop().call_later(delay, wake)
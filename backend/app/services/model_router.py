@@ -0,0 +1,217 @@
+import asyncio
+import contextlib
+import time
+from collections import deque
+from typing import Any, AsyncIterator
+
+from langchain_core.messages import BaseMessage
+
+from ..core.metrics import registry
+from ..services.llm_scheduler import LLMScheduler
+
+LLM_REQUESTS = registry.counter("llm_requests_total", "Model requests sent, by model.", ["model"])
+LLM_FIRST_OUTPUT_SECONDS = registry.histogram(
+    "llm_first_output_seconds", "Time until a model produced its first output, by model.", ["model"]
+)
+LLM_HEDGES = registry.counter(
+    "llm_hedged_requests_total", "Hedged second requests sent, by which request won.", ["winner"]
+)
+LLM_HEDGES_SKIPPED = registry.counter(
+    "llm_hedges_skipped_total", "Hedges not sent because the scheduler had no free slot or tokens."
+)
+
+class LatencyTracker:
+    """Sliding window of recent latencies, for percentile deadlines."""
+    def __init__(self, window: int = 200):
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+class ModelRouter:
+    """
+    Picks which model backend serves a request and hedges slow ones.
+    Prompts estimated at `fast_max_tokens` or less (history and summary included)
+    go to the `fast` model when one is configured, everything else to `primary`.
+    With hedging on, if the routed model has not produced any output by its
+    `hedge_percentile` time-to-first-output (learned from recent requests), a second
+    request is sent to `hedge` (by default the same model); whichever answers first
+    is used and the other is cancelled. Every call reports the model that served it.
+    The caller holds a `scheduler` slot for the original request; the hedge needs one
+    of its own (and its prompt's tokens) free at that moment, or it is not sent, so
+    hedging never pushes past the scheduler's limits. That slot is given back once
+    the race is decided.
+    """
+    def __init__(
+        self,
+        backends: dict[str, Any],
+        primary: str,
+        fast: str | None = None,
+        fast_max_tokens: int = 0,
+        hedge: str | None = None,
+        hedge_enabled: bool = True,
+        hedge_percentile: float = 95.0,
+        hedge_min_samples: int = 20,
+        hedge_default_delay: float = 3.0,
+        hedge_min_delay: float = 0.2,
+        scheduler: LLMScheduler | None = None
+    ):
+        self.backends = backends
+        self.primary = primary
+        self.fast = fast
+        self.fast_max_tokens = fast_max_tokens
+        self.hedge = hedge
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.scheduler = scheduler
+        # Keyed by (model, streaming): time to first chunk and time to a full reply differ.
+        self._latency = {(name, streaming): LatencyTracker() for name in backends for streaming in (True, False)}
+
+    def route(self, tokens: int) -> str:
+        if self.fast and tokens <= self.fast_max_tokens:
+            return self.fast
+        return self.primary
+
+    def hedge_delay(self, model: str, streaming: bool = True) -> float:
+        tracker = self._latency[(model, streaming)]
+        if len(tracker) < self.hedge_min_samples:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, tracker.percentile(self.hedge_percentile))
+
+    async def ainvoke(self, messages: list[BaseMessage], tokens: int) -> tuple[str, BaseMessage]:
+        """Returns `(model, response)`."""
+        model = self.route(tokens)
+        first = asyncio.create_task(self._ainvoke(model, messages))
+        # Each request's model and start time; a hedge is timed from when it was sent.
+        calls = {first: (model, time.monotonic())}
+        try:
+            if self.hedge_enabled:
+                done, _ = await asyncio.wait({first}, timeout=self.hedge_delay(model, streaming=False))
+                if not done and self._admit_hedge(tokens):
+                    hedge_model = self.hedge or model
+                    second = asyncio.create_task(self._ainvoke(hedge_model, messages))
+                    calls[second] = (hedge_model, time.monotonic())
+                    try:
+                        winner = await self._first_success([first, second])
+                    finally:
+                        self._release_hedge()
+                    LLM_HEDGES.inc(winner="hedge" if winner is second else "original")
+                    first = winner
+            response = await first
+        except BaseException:
+            for task in calls:
+                task.cancel()
+            raise
+        model, start = calls[first]
+        self._record(model, start, streaming=False)
+        return model, response
+
+    async def astream(self, messages: list[BaseMessage], tokens: int) -> AsyncIterator[tuple[str, BaseMessage]]:
+        """
+        Yields `(model, chunk)`. Hedging races only the first chunk: once a stream has
+        produced output it is committed to, and the other one is closed.
+        """
+        model = self.route(tokens)
+        stream = self._astream(model, messages)
+        first = asyncio.create_task(anext(stream, None))
+        # Each stream's model, generator and start time; a hedge is timed from when it was sent.
+        streams = {first: (model, stream, time.monotonic())}
+        hedged = False
+        try:
+            if self.hedge_enabled:
+                done, _ = await asyncio.wait({first}, timeout=self.hedge_delay(model))
+                if not done and self._admit_hedge(tokens):
+                    hedged = True
+                    hedge_model = self.hedge or model
+                    hedge_stream = self._astream(hedge_model, messages)
+                    second = asyncio.create_task(anext(hedge_stream, None))
+                    streams[second] = (hedge_model, hedge_stream, time.monotonic())
+                    winner = await self._first_success([first, second])
+                    LLM_HEDGES.inc(winner="hedge" if winner is second else "original")
+                    first = winner
+            chunk = await first
+        except BaseException:
+            for task, (_, s, _) in streams.items():
+                await self._close_stream(task, s)
+            if hedged:
+                self._release_hedge()
+            raise
+
+        model, stream, start = streams.pop(first)
+        for task, (_, loser, _) in streams.items():
+            await self._close_stream(task, loser)
+        if hedged:
+            self._release_hedge()
+        self._record(model, start)
+        try:
+            if chunk is None:
+                return
+            yield model, chunk
+            async for chunk in stream:
+                yield model, chunk
+        finally:
+            await stream.aclose()
+
+    def _admit_hedge(self, tokens: int) -> bool:
+        if self.scheduler is None or self.scheduler.try_acquire(tokens):
+            return True
+        LLM_HEDGES_SKIPPED.inc()
+        return False
+
+    def _release_hedge(self) -> None:
+        if self.scheduler is not None:
+            self.scheduler.release()
+
+    async def _ainvoke(self, model: str, messages: list[BaseMessage]) -> BaseMessage:
+        LLM_REQUESTS.inc(model=model)
+        return await self.backends[model].ainvoke(messages)
+
+    async def _astream(self, model: str, messages: list[BaseMessage]) -> AsyncIterator[BaseMessage]:
+        LLM_REQUESTS.inc(model=model)
+        async for chunk in self.backends[model].astream(messages):
+            if chunk.content:
+                yield chunk
+
+    async def _first_success(self, tasks: list[asyncio.Task]) -> asyncio.Task:
+        """
+        Waits for the first task to finish without an error and cancels the rest.
+        If every task fails, the error of the first one that failed (rather than being
+        cancelled) is raised.
+        """
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task
+        failed = [task for task in tasks if not task.cancelled()]
+        if not failed:
+            raise asyncio.CancelledError()
+        raise failed[0].exception()
+
+    async def _close_stream(self, task: asyncio.Task, stream: AsyncIterator) -> None:
+        """Cancels a pending read and closes the stream, which aborts the underlying request."""
+        task.cancel()
+        with contextlib.suppress(BaseException):
+            await task
+        with contextlib.suppress(BaseException):
+            await stream.aclose()
+
+    def _record(self, model: str, start: float, streaming: bool = True) -> None:
+        elapsed = time.monotonic() - start
+        self._latency[(model, streaming)].record(elapsed)
+        LLM_FIRST_OUTPUT_SECONDS.observe(elapsed, model=model)
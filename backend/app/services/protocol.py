@@ -0,0 +1,144 @@
+import datetime
+import json
+import zlib
+
+from pydantic import TypeAdapter, ValidationError
+
+from ..config import settings
+from ..models.message import ControlFrame, SendFrame
+
+try:
+    import msgpack
+except ImportError:  # The binary protocol is optional; clients then get JSON.
+    msgpack = None
+
+# WebSocket wire protocols, negotiated through the WebSocket subprotocol header
+# (`new WebSocket(url, ["chat.msgpack.v1", "chat.json.v1"])`). A client that asks
+# for none gets the JSON protocol without a subprotocol, as before.
+#
+# chat.json.v1: text frames holding the models in `models/message.py` as JSON.
+#   Clients send typed frames only; a chat message goes in a `send` frame.
+#
+# No subprotocol (legacy clients): server frames as in chat.json.v1, and every text
+#   frame a client sends is the content of a chat message, even one that looks like JSON.
+#
+# chat.msgpack.v1: binary frames. The first byte is a flag (0 = plain, 1 = the rest
+#   is zlib-compressed, used for frames of WS_COMPRESS_MIN_BYTES or more), followed
+#   by a MessagePack map with the short keys below. `chatId` is left out (a socket
+#   belongs to one chat), timestamps are integer milliseconds since the epoch, and
+#   plain messages carry `t: "message"`.
+#
+# Per-message deflate at the transport level is negotiated separately by the server
+# (uvicorn's --ws-per-message-deflate); the flag byte lets binary clients that can't
+# rely on it still get large replies compressed.
+
+JSON_SUBPROTOCOL = "chat.json.v1"
+MSGPACK_SUBPROTOCOL = "chat.msgpack.v1"
+
+SHORT_KEYS = {
+    "type": "t",
+    "id": "i",
+    "messageId": "i",
+    "userId": "u",
+    "role": "r",
+    "content": "c",
+    "timestamp": "ts",
+    "metadata": "md",
+    "seq": "s",
+    "delta": "d",
+    "message": "m",
+    "ref": "rf",
+    "after": "a",
+    "afterId": "ai",
+    "model": "mo",
+    "responseTime": "rt",
+    "cacheHit": "ch",
+    "truncated": "tr",
+}
+# Keys clients send; "i" is ambiguous on the way out but never sent in.
+LONG_KEYS = {SHORT_KEYS[key]: key for key in ("type", "content", "ref", "after", "afterId")}
+_TIMESTAMP_KEYS = ("timestamp", "after")
+_DROPPED_KEYS = ("chatId",)
+
+_FLAG_PLAIN, _FLAG_ZLIB = b"\x00", b"\x01"
+
+_control_frame = TypeAdapter(ControlFrame)
+
+def _to_millis(value: str) -> int:
+    return int(datetime.datetime.fromisoformat(value).timestamp() * 1000)
+
+def _shorten(value):
+    if isinstance(value, dict):
+        return {
+            SHORT_KEYS.get(key, key): _to_millis(item) if key in _TIMESTAMP_KEYS else _shorten(item)
+            for key, item in value.items()
+            if item is not None and key not in _DROPPED_KEYS
+        }
+    if isinstance(value, list):
+        return [_shorten(item) for item in value]
+    return value
+
+class JsonCodec:
+    """
+    With `typed_frames`, client text frames must be typed frames (chat.json.v1);
+    without, each one is sent as a chat message as is.
+    """
+    subprotocol = JSON_SUBPROTOCOL
+
+    def __init__(self, typed_frames: bool):
+        self.typed_frames = typed_frames
+
+    def encode(self, message: str) -> str:
+        # Frames are published as JSON already.
+        return message
+
+    def decode(self, data: str | bytes) -> ControlFrame | None:
+        if not isinstance(data, str):
+            return None
+        if not self.typed_frames:
+            return SendFrame(content=data)
+        try:
+            return _control_frame.validate_json(data)
+        except (ValueError, ValidationError):
+            return None
+
+class MsgpackCodec:
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def __init__(self, compress_min_bytes: int):
+        self.compress_min_bytes = compress_min_bytes
+
+    def encode(self, message: str) -> bytes:
+        frame = json.loads(message)
+        frame.setdefault("type", "message")
+        packed = msgpack.packb(_shorten(frame))
+        if self.compress_min_bytes and len(packed) >= self.compress_min_bytes:
+            return _FLAG_ZLIB + zlib.compress(packed)
+        return _FLAG_PLAIN + packed
+
+    def decode(self, data: str | bytes) -> ControlFrame | None:
+        if not isinstance(data, bytes) or not data:
+            return None
+        try:
+            body = zlib.decompress(data[1:]) if data[:1] == _FLAG_ZLIB else data[1:]
+            frame = msgpack.unpackb(body)
+            frame = {LONG_KEYS.get(key, key): value for key, value in frame.items()}
+            if isinstance(frame.get("after"), int):
+                frame["after"] = datetime.datetime.fromtimestamp(frame["after"] / 1000, datetime.timezone.utc)
+            return _control_frame.validate_python(frame)
+        except (ValueError, TypeError, AttributeError, zlib.error, ValidationError):
+            return None
+
+JSON_CODEC = JsonCodec(typed_frames=True)
+LEGACY_CODEC = JsonCodec(typed_frames=False)
+
+def negotiate(requested: list[str]) -> tuple[JsonCodec | MsgpackCodec, str | None]:
+    """
+    Picks the protocol for a socket from the subprotocols its client offered.
+    Returns the codec and the subprotocol to accept with (None if none was offered).
+    """
+    if MSGPACK_SUBPROTOCOL in requested and msgpack is not None:
+        return MsgpackCodec(settings.WS_COMPRESS_MIN_BYTES), MSGPACK_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in requested:
+        return JSON_CODEC, JSON_SUBPROTOCOL
+    return LEGACY_CODEC, None
@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import string
+
+from ..core.cache import TTLCache
+from ..models.message import Message
+
+logger = logging.getLogger(__name__)
+
+class CacheLookup:
+    """
+    Result of `ResponseCache.alookup`. `hit` is the cached response (or None);
+    the lookup is handed back to `astore` so the prompt embedding is computed once.
+    """
+    def __init__(self, context_key: str, prompt: str, key: str):
+        self.context_key = context_key
+        self.prompt = prompt
+        self.key = key
+        self.embedding = None
+        self.hit: dict | None = None
+        self.kind: str | None = None
+
+class _SemanticIndex:
+    """
+    Fixed-capacity ring buffer of unit-length prompt embeddings. Search is one
+    vectorized cosine similarity over the rows that share the lookup's context.
+    """
+    def __init__(self, np, capacity: int):
+        self.np = np
+        self.capacity = capacity
+        self.vectors = None
+        self.contexts = np.empty(capacity, dtype=object)
+        self.keys: list[str | None] = [None] * capacity
+        self.next = 0
+        self.size = 0
+
+    def _unit(self, vector):
+        v = self.np.asarray(vector, dtype=self.np.float32)
+        norm = self.np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def add(self, context_key: str, key: str, vector) -> None:
+        v = self._unit(vector)
+        if self.vectors is None:
+            self.vectors = self.np.zeros((self.capacity, v.shape[0]), dtype=self.np.float32)
+        self.vectors[self.next] = v
+        self.contexts[self.next] = context_key
+        self.keys[self.next] = key
+        self.next = (self.next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def search(self, context_key: str, vector) -> tuple[str, float] | None:
+        if self.size == 0:
+            return None
+        rows = self.np.flatnonzero(self.contexts[:self.size] == context_key)
+        if rows.size == 0:
+            return None
+        scores = self.vectors[rows] @ self._unit(vector)
+        best = int(scores.argmax())
+        return self.keys[rows[best]], float(scores[best])
+
+class ResponseCache:
+    """
+    Cache of assistant replies for repeated prompts.
+    The exact layer is keyed on a hash of the normalized context and prompt. The
+    optional semantic layer embeds the prompt and, within the same context, reuses
+    the reply of the most similar earlier prompt above `similarity_threshold`.
+    Entries are LRU-evicted and expire after `ttl`; the semantic index only points
+    at exact-layer keys, so it never serves an entry the exact layer has dropped.
+    """
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        similarity_threshold: float = 0.95,
+        max_context_tokens: int = 256,
+        embeddings=None
+    ):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        # Only prompts whose context (summary + history) is at most this large are cached.
+        self.max_context_tokens = max_context_tokens
+        self.similarity_threshold = similarity_threshold
+        self.embeddings = embeddings
+        self.semantic_hits = 0
+        self._index = None
+        if embeddings is not None:
+            try:
+                import numpy as np
+                self._index = _SemanticIndex(np, maxsize)
+            except ImportError:
+                logger.warning("numpy is not installed; the semantic response cache is disabled.")
+                self.embeddings = None
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.lower().split()).strip(string.punctuation + " ")
+
+    @staticmethod
+    def _digest(*parts: str) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(part.encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def context_key(self, summary: str | None, chat_history: list[Message]) -> str:
+        parts = [self.normalize(summary or "")]
+        parts.extend(f"{m.role}:{self.normalize(m.content)}" for m in chat_history)
+        return self._digest(*parts)
+
+    async def alookup(self, context_key: str, prompt: str) -> CacheLookup:
+        lookup = CacheLookup(context_key, prompt, self._digest(context_key, self.normalize(prompt)))
+        lookup.hit = self.entries.get(lookup.key)
+        if lookup.hit is not None:
+            lookup.kind = "exact"
+            return lookup
+        if self.embeddings is None:
+            return lookup
+        try:
+            lookup.embedding = await self.embeddings.aembed_query(prompt)
+        except Exception as e:
+            logger.warning("Error embedding prompt for the response cache: %s", e)
+            return lookup
+        match = self._index.search(context_key, lookup.embedding)
+        if match is not None and match[1] >= self.similarity_threshold:
+            lookup.hit = self.entries.get(match[0])
+            if lookup.hit is not None:
+                lookup.kind = "semantic"
+                self.semantic_hits += 1
+        return lookup
+
+    async def astore(self, lookup: CacheLookup, content: str, metadata: dict | None) -> None:
+        self.entries.set(lookup.key, {"content": content, "metadata": metadata or {}})
+        if self._index is not None and lookup.embedding is not None:
+            self._index.add(lookup.context_key, lookup.key, lookup.embedding)
+
+    def stats(self) -> dict:
+        return {**self.entries.stats(), "semanticHits": self.semantic_hits}
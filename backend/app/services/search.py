@@ -0,0 +1,106 @@
+import math
+import re
+from collections import Counter
+
+from ..config import settings
+from ..models.message import Message
+
+# The per-user inverted index behind message search. Every message is one document;
+# its terms are the casefolded word tokens of its content, minus common English stop
+# words. Each (user, term) pair has a posting list: message id -> posting, where a
+# posting packs the term's frequency in the message and the message's length (in
+# terms) into one integer, which is all BM25 needs. The storage backends keep the
+# postings, each term's document frequency and the user's totals (indexed messages,
+# summed lengths) up to date as messages are added, and bump the user's
+# searchVersion once a batch of postings has been written. A backend may read only
+# part of a long posting list; the document frequency still counts every message.
+
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have i if in into is it its me my no not
+of on or our so that the their then there these they this to was we were what when
+which who will with you your
+""".split())
+
+# Longer tokens (hashes, base64, minified code) are never searched for; skipping
+# them keeps the index small.
+MAX_TERM_CHARS = 40
+
+_TOKEN = re.compile(r"\w+")
+_LENGTH_BITS = 32
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token for token in _TOKEN.findall(text.casefold())
+        if token not in STOP_WORDS and len(token) <= MAX_TERM_CHARS
+    ]
+
+def query_terms(query: str) -> list[str]:
+    """The distinct terms of a search query, in order, at most SEARCH_MAX_QUERY_TERMS."""
+    return list(dict.fromkeys(tokenize(query)))[:settings.SEARCH_MAX_QUERY_TERMS]
+
+def pack_posting(frequency: int, length: int) -> int:
+    return frequency << _LENGTH_BITS | length
+
+def unpack_posting(posting: int) -> tuple[int, int]:
+    """Returns `(frequency, length)`."""
+    return posting >> _LENGTH_BITS, posting & ((1 << _LENGTH_BITS) - 1)
+
+def index_messages(messages: list[Message]) -> tuple[dict[str, dict[str, int]], int]:
+    """
+    The postings contributed by `messages` (term -> message id -> posting) and
+    their summed length, which is added to the user's total.
+    """
+    postings: dict[str, dict[str, int]] = {}
+    total_length = 0
+    for message in messages:
+        tokens = tokenize(message.content)
+        total_length += len(tokens)
+        for term, frequency in Counter(tokens).items():
+            postings.setdefault(term, {})[message.id] = pack_posting(frequency, len(tokens))
+    return postings, total_length
+
+def bm25(
+    postings: dict[str, dict[str, int]],
+    frequencies: dict[str, int],
+    documents: int,
+    total_length: int,
+) -> dict[str, float]:
+    """
+    Scores every message in `postings` that has at least one of its terms.
+    `frequencies` is the number of messages with each term, which may be more than
+    the postings read; terms missing from it count their postings.
+    """
+    scores: dict[str, float] = {}
+    k1, b = settings.SEARCH_BM25_K1, settings.SEARCH_BM25_B
+    average_length = total_length / documents if documents else 1.0
+    for term, term_postings in postings.items():
+        frequency_in_docs = max(frequencies.get(term, 0), len(term_postings))
+        # Totals can trail the postings briefly while a rebuild runs; keep idf positive.
+        count = max(documents, frequency_in_docs)
+        idf = math.log(1 + (count - frequency_in_docs + 0.5) / (frequency_in_docs + 0.5))
+        for message_id, posting in term_postings.items():
+            frequency, length = unpack_posting(posting)
+            norm = k1 * (1 - b + b * length / (average_length or 1.0))
+            scores[message_id] = scores.get(message_id, 0.0) + idf * frequency * (k1 + 1) / (frequency + norm)
+    return scores
+
+def snippet(content: str, terms: list[str]) -> str:
+    """
+    About SEARCH_SNIPPET_CHARS characters of `content` around the first match of
+    any of `terms`, cut at word boundaries and marked with "…" where it was cut.
+    """
+    text = " ".join(content.split())
+    width = settings.SEARCH_SNIPPET_CHARS
+    if len(text) <= width:
+        return text
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(term) for term in terms) + r")\b", re.IGNORECASE)
+    match = pattern.search(text) if terms else None
+    start = max(0, match.start() - width // 3) if match else 0
+    start = min(start, len(text) - width)
+    end = start + width
+    if start > 0:
+        start = text.find(" ", start, match.start() if match else end) + 1 or start
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        end = space if space > start else end
+    return ("…" if start > 0 else "") + text[start:end].strip() + ("…" if end < len(text) else "")
@@ -0,0 +1,515 @@
+import datetime
+import json
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from ..core.cache import TTLCache
+from ..models.user import UserInDB
+from ..models.chat import Chat, chat_list_adapter
+from ..models.message import Message, MessageMetadata, message_list_adapter
+from ..services import search
+from ..services.storage import CHAT_SORT_FIELDS, StorageService, last_message_fields, message_preview
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    displayName TEXT,
+    createdAt INTEGER NOT NULL,
+    lastLoginAt INTEGER,
+    chatsVersion INTEGER NOT NULL DEFAULT 0,
+    searchDocuments INTEGER NOT NULL DEFAULT 0,
+    searchLength INTEGER NOT NULL DEFAULT 0,
+    searchVersion INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS chats (
+    id TEXT PRIMARY KEY,
+    userId TEXT NOT NULL,
+    title TEXT NOT NULL,
+    createdAt INTEGER NOT NULL,
+    messageCount INTEGER NOT NULL DEFAULT 0,
+    isActive INTEGER NOT NULL DEFAULT 1,
+    cacheResponses INTEGER NOT NULL DEFAULT 1,
+    summary TEXT,
+    summarizedThrough INTEGER,
+    lastMessageAt INTEGER,
+    lastMessagePreview TEXT,
+    lastMessageRole TEXT
+);
+CREATE INDEX IF NOT EXISTS chats_user_created ON chats (userId, createdAt);
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    chatId TEXT NOT NULL,
+    userId TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_chat_timestamp ON messages (chatId, timestamp);
+CREATE TABLE IF NOT EXISTS search_postings (
+    userId TEXT NOT NULL,
+    term TEXT NOT NULL,
+    messageId TEXT NOT NULL,
+    posting INTEGER NOT NULL,
+    PRIMARY KEY (userId, term, messageId)
+) WITHOUT ROWID;
+"""
+
+# Columns added after a table was first released; databases created before then
+# get them with ALTER TABLE on open.
+ADDED_COLUMNS = {
+    "users": {
+        "chatsVersion": "INTEGER NOT NULL DEFAULT 0",
+        "searchDocuments": "INTEGER NOT NULL DEFAULT 0",
+        "searchLength": "INTEGER NOT NULL DEFAULT 0",
+        "searchVersion": "INTEGER NOT NULL DEFAULT 0",
+    },
+    "chats": {"lastMessageAt": "INTEGER", "lastMessagePreview": "TEXT", "lastMessageRole": "TEXT"},
+}
+# Indexes over added columns, created once the columns exist.
+ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS chats_user_last_message ON chats (userId, lastMessageAt);
+"""
+
+# Timestamps are stored as integer microseconds since the epoch (UTC), which sort
+# and compare exactly and keep the precision Firestore gives us.
+
+def _to_micros(value: datetime.datetime | None) -> int | None:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    delta = value - datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+def _from_micros(value: int | None) -> datetime.datetime | None:
+    if value is None:
+        return None
+    return datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(microseconds=value)
+
+def _metadata_json(metadata: MessageMetadata) -> str:
+    # tokenCount is left out of the model's own dumps, which are what clients see.
+    data = metadata.model_dump(mode="json", exclude_none=True)
+    if metadata.tokenCount is not None:
+        data["tokenCount"] = metadata.tokenCount
+    return json.dumps(data)
+
+def _keyset(column: str, op: str, item_id: str | None) -> str:
+    """
+    Condition for paging past (`column`, id) in the direction of `op`; rows are ordered
+    by `column` then id, so rows sharing a `column` value are split by id. `column`
+    and `op` are never user input.
+    """
+    if item_id is None:
+        return f" AND {column} {op} ?"
+    return f" AND ({column} {op} ? OR ({column} = ? AND id {op} ?))"
+
+def _keyset_params(value: datetime.datetime, item_id: str | None) -> list:
+    micros = _to_micros(value)
+    return [micros] if item_id is None else [micros, micros, item_id]
+
+def _user(row: sqlite3.Row) -> UserInDB:
+    return UserInDB(
+        uid=row["uid"],
+        email=row["email"],
+        displayName=row["displayName"],
+        createdAt=_from_micros(row["createdAt"]),
+        lastLoginAt=_from_micros(row["lastLoginAt"]),
+    )
+
+def _chat_data(row: sqlite3.Row) -> dict:
+    return {
+        "id": row["id"],
+        "userId": row["userId"],
+        "title": row["title"],
+        "createdAt": _from_micros(row["createdAt"]),
+        "messageCount": row["messageCount"],
+        "isActive": bool(row["isActive"]),
+        "cacheResponses": bool(row["cacheResponses"]),
+        "summary": row["summary"],
+        "summarizedThrough": _from_micros(row["summarizedThrough"]),
+        "lastMessageAt": _from_micros(row["lastMessageAt"]),
+        "lastMessagePreview": row["lastMessagePreview"],
+        "lastMessageRole": row["lastMessageRole"],
+    }
+
+def _chat(row: sqlite3.Row) -> Chat:
+    return Chat(**_chat_data(row))
+
+def _chats(rows: Iterable[sqlite3.Row]) -> list[Chat]:
+    return chat_list_adapter.validate_python([_chat_data(row) for row in rows])
+
+def _message_data(row: sqlite3.Row) -> dict:
+    return {
+        "id": row["id"],
+        "chatId": row["chatId"],
+        "userId": row["userId"],
+        "role": row["role"],
+        "content": row["content"],
+        "timestamp": _from_micros(row["timestamp"]),
+        "metadata": json.loads(row["metadata"]) if row["metadata"] else None,
+    }
+
+def _messages(rows: Iterable[sqlite3.Row]) -> list[Message]:
+    return message_list_adapter.validate_python([_message_data(row) for row in rows])
+
+class SQLiteService(StorageService):
+    """
+    Local SQLite storage, for self-hosted and edge deployments and as a fast,
+    realistic backend for tests. The database runs in WAL mode, so readers never
+    wait for the writer, and connections come from a fixed-size pool shared by the
+    worker threads that run the async twins. Multi-row writes are one transaction.
+    """
+    backend = "sqlite"
+
+    def __init__(self, path: str, pool_size: int = 8, chat_cache: TTLCache | None = None):
+        super().__init__(chat_cache)
+        self.path = path
+        if path == ":memory:":
+            # Every pooled connection must see the same in-memory database.
+            self._target, self._uri = f"file:chatbot-{uuid.uuid4().hex}?mode=memory&cache=shared", True
+        else:
+            self._target, self._uri = path, False
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._pool: queue.Queue[sqlite3.Connection] = queue.Queue()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        for _ in range(pool_size):
+            connection = self._connect()
+            self._connections.append(connection)
+            self._pool.put(connection)
+        added = set()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            for table, columns in ADDED_COLUMNS.items():
+                existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                for column, definition in columns.items():
+                    if column not in existing:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                        added.add((table, column))
+            conn.executescript(ADDED_INDEXES)
+        if ("chats", "lastMessageAt") in added:
+            self.backfill_chat_activity()
+        if ("users", "searchDocuments") in added:
+            self.rebuild_search_index()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode; write methods open their own transactions.
+        conn = sqlite3.connect(self._target, uri=self._uri, check_same_thread=False, isolation_level=None, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connection() as conn:
+            # IMMEDIATE takes the write lock up front instead of failing on upgrade.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    def get_user(self, user_id: str) -> UserInDB | None:
+        with self._connection() as conn:
+            row = conn.execute("SELECT * FROM users WHERE uid = ?", (user_id,)).fetchone()
+        return _user(row) if row else None
+
+    def create_user(self, user_data: dict) -> UserInDB:
+        user_data["createdAt"] = datetime.datetime.now(datetime.timezone.utc)
+        user = UserInDB(**user_data)
+        with self._transaction() as conn:
+            conn.execute(
+                # An upsert, not a replace: that would reset the versions and the search totals.
+                "INSERT INTO users (uid, email, displayName, createdAt, lastLoginAt) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (uid) DO UPDATE SET email = excluded.email, displayName = excluded.displayName, "
+                "createdAt = excluded.createdAt, lastLoginAt = excluded.lastLoginAt",
+                (user.uid, user.email, user.displayName, _to_micros(user.createdAt), _to_micros(user.lastLoginAt)),
+            )
+        return user
+
+    def update_user_login_time(self, user_id: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE users SET lastLoginAt = ? WHERE uid = ?",
+                (_to_micros(datetime.datetime.now(datetime.timezone.utc)), user_id),
+            )
+
+    def get_chats_version(self, user_id: str) -> int | None:
+        with self._connection() as conn:
+            row = conn.execute("SELECT chatsVersion FROM users WHERE uid = ?", (user_id,)).fetchone()
+        return row["chatsVersion"] if row else None
+
+    def get_search_version(self, user_id: str) -> int | None:
+        with self._connection() as conn:
+            row = conn.execute("SELECT searchVersion FROM users WHERE uid = ?", (user_id,)).fetchone()
+        return row["searchVersion"] if row else None
+
+    def create_chat(self, user_id: str, title: str, cache_responses: bool = True) -> Chat:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        chat = Chat(
+            id=uuid.uuid4().hex,
+            userId=user_id,
+            title=title,
+            createdAt=now,
+            messageCount=0,
+            isActive=True,
+            cacheResponses=cache_responses,
+            lastMessageAt=now
+        )
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO chats (id, userId, title, createdAt, messageCount, isActive, cacheResponses, lastMessageAt) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (chat.id, chat.userId, chat.title, _to_micros(now), 0, 1, int(cache_responses), _to_micros(now)),
+            )
+            conn.execute("UPDATE users SET chatsVersion = chatsVersion + 1 WHERE uid = ?", (user_id,))
+        self.chat_cache.set(chat.id, chat)
+        return chat
+
+    def get_chats_for_user(self, user_id: str) -> list[Chat]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT * FROM chats WHERE userId = ? ORDER BY createdAt DESC", (user_id,)
+            ).fetchall()
+        return _chats(rows)
+
+    def list_chats(
+        self,
+        user_id: str,
+        limit: int,
+        after: datetime.datetime | None = None,
+        sort: str = "createdAt",
+        active_since: datetime.datetime | None = None,
+        after_id: str | None = None
+    ) -> tuple[list[Chat], bool]:
+        if sort not in CHAT_SORT_FIELDS:
+            raise ValueError(f"Unknown chat sort field: {sort}")
+        # `sort` is checked against the known fields above before it goes into the SQL.
+        sql = "SELECT * FROM chats WHERE userId = ?"
+        params: list = [user_id]
+        if active_since is not None:
+            sql += " AND lastMessageAt >= ?"
+            params.append(_to_micros(active_since))
+        if after is not None:
+            sql += _keyset(sort, "<", after_id)
+            params += _keyset_params(after, after_id)
+        sql += f" ORDER BY {sort} DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._connection() as conn:
+            chats = _chats(conn.execute(sql, params).fetchall())
+        for chat in chats:
+            self.chat_cache.set(chat.id, chat)
+        return chats[:limit], len(chats) > limit
+
+    def _fetch_chat(self, chat_id: str) -> Chat | None:
+        with self._connection() as conn:
+            row = conn.execute("SELECT * FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        return _chat(row) if row else None
+
+    def _fetch_chats(self, chat_ids: list[str]) -> list[Chat]:
+        with self._connection() as conn:
+            rows = conn.execute(f"SELECT * FROM chats WHERE id IN ({', '.join('?' * len(chat_ids))})", chat_ids).fetchall()
+        return _chats(rows)
+
+    def update_chat_summary(self, chat_id: str, summary: str, summarized_through: datetime.datetime):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE chats SET summary = ?, summarizedThrough = ? WHERE id = ?",
+                (summary, _to_micros(summarized_through), chat_id),
+            )
+        self._update_cached_chat(chat_id, summary=summary, summarizedThrough=summarized_through)
+
+    def backfill_chat_activity(self) -> int:
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT chats.id, chats.userId, chats.createdAt, latest.role, latest.content, latest.timestamp FROM chats "
+                "LEFT JOIN messages AS latest ON latest.id = ("
+                "SELECT id FROM messages WHERE chatId = chats.id ORDER BY timestamp DESC, id DESC LIMIT 1"
+                ") WHERE chats.lastMessageAt IS NULL"
+            ).fetchall()
+            conn.executemany(
+                "UPDATE chats SET lastMessageAt = ?, lastMessagePreview = ?, lastMessageRole = ? WHERE id = ?",
+                [
+                    (row["timestamp"], message_preview(row["content"]), row["role"], row["id"])
+                    if row["timestamp"] is not None else (row["createdAt"], None, None, row["id"])
+                    for row in rows
+                ],
+            )
+            # The owners' cached chat lists don't have these fields yet.
+            conn.executemany(
+                "UPDATE users SET chatsVersion = chatsVersion + 1 WHERE uid = ?",
+                [(user_id,) for user_id in {row["userId"] for row in rows}],
+            )
+        self.chat_cache.clear()
+        return len(rows)
+
+    def new_message_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def add_messages(self, chat_id: str, user_id: str, messages: list[dict]) -> list[Message]:
+        if not messages:
+            return []
+        full_messages = message_list_adapter.validate_python([
+            self.build_message(chat_id, user_id, {}, message_data.get("id")) | message_data
+            for message_data in messages
+        ])
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO messages (id, chatId, userId, role, content, timestamp, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        m.id, m.chatId, m.userId, m.role, m.content, _to_micros(m.timestamp),
+                        _metadata_json(m.metadata) if m.metadata else None,
+                    )
+                    for m in full_messages
+                ],
+            )
+            last_message = last_message_fields(full_messages)
+            conn.execute(
+                "UPDATE chats SET messageCount = messageCount + ?, lastMessageAt = ?, lastMessagePreview = ?, "
+                "lastMessageRole = ? WHERE id = ?",
+                (
+                    len(full_messages), _to_micros(last_message["lastMessageAt"]),
+                    last_message["lastMessagePreview"], last_message["lastMessageRole"], chat_id,
+                ),
+            )
+            # Indexed in the same transaction: a local write costs little, and searchVersion
+            # then moves exactly when the postings do.
+            postings, total_length = search.index_messages(full_messages)
+            self._insert_postings(conn, user_id, postings)
+            conn.execute(
+                "UPDATE users SET chatsVersion = chatsVersion + 1, searchVersion = searchVersion + 1, "
+                "searchDocuments = searchDocuments + ?, searchLength = searchLength + ? WHERE uid = ?",
+                (len(full_messages), total_length, user_id),
+            )
+        self._update_cached_chat(chat_id, added_messages=len(full_messages), **last_message)
+        return full_messages
+
+    def get_messages_for_chat(self, chat_id: str, user_id: str) -> list[Message]:
+        if not self.get_chat(chat_id, user_id):
+            return []
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT * FROM messages WHERE chatId = ? ORDER BY timestamp, id", (chat_id,)
+            ).fetchall()
+        return _messages(rows)
+
+    def list_messages(
+        self,
+        chat_id: str,
+        limit: int,
+        before: datetime.datetime | None = None,
+        after: datetime.datetime | None = None,
+        before_id: str | None = None,
+        after_id: str | None = None
+    ) -> tuple[list[Message], bool]:
+        with self._connection() as conn:
+            if after is not None:
+                rows = conn.execute(
+                    f"SELECT * FROM messages WHERE chatId = ?{_keyset('timestamp', '>', after_id)}"
+                    " ORDER BY timestamp, id LIMIT ?",
+                    [chat_id, *_keyset_params(after, after_id), limit + 1],
+                ).fetchall()
+                messages = _messages(rows)
+                return messages[:limit], len(messages) > limit
+            sql = "SELECT * FROM messages WHERE chatId = ?"
+            params: list = [chat_id]
+            if before is not None:
+                sql += _keyset("timestamp", "<", before_id)
+                params += _keyset_params(before, before_id)
+            sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+            params.append(limit + 1)
+            rows = conn.execute(sql, params).fetchall()
+        messages = _messages(reversed(rows))
+        return messages[-limit:], len(messages) > limit
+
+    def get_messages_after(self, chat_id: str, after: datetime.datetime) -> list[Message]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT * FROM messages WHERE chatId = ? AND timestamp > ? ORDER BY timestamp, id",
+                (chat_id, _to_micros(after)),
+            ).fetchall()
+        return _messages(rows)
+
+    def get_messages_by_ids(self, message_ids: list[str]) -> list[Message]:
+        if not message_ids:
+            return []
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM messages WHERE id IN ({', '.join('?' * len(message_ids))})", message_ids
+            ).fetchall()
+        found = {row["id"]: row for row in rows}
+        return _messages(found[message_id] for message_id in message_ids if message_id in found)
+
+    def _insert_postings(self, conn: sqlite3.Connection, user_id: str, postings: dict[str, dict[str, int]]):
+        conn.executemany(
+            "INSERT OR REPLACE INTO search_postings (userId, term, messageId, posting) VALUES (?, ?, ?, ?)",
+            [
+                (user_id, term, message_id, posting)
+                for term, term_postings in postings.items()
+                for message_id, posting in term_postings.items()
+            ],
+        )
+
+    def get_search_postings(
+        self, user_id: str, terms: list[str]
+    ) -> tuple[dict[str, dict[str, int]], dict[str, int], int, int]:
+        # Every posting of the terms: a local read is cheap, and the counts follow from it.
+        postings: dict[str, dict[str, int]] = {}
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT term, messageId, posting FROM search_postings WHERE userId = ? AND term IN ({', '.join('?' * len(terms))})",
+                [user_id, *terms],
+            ).fetchall()
+            user = conn.execute("SELECT searchDocuments, searchLength FROM users WHERE uid = ?", (user_id,)).fetchone()
+        for row in rows:
+            postings.setdefault(row["term"], {})[row["messageId"]] = row["posting"]
+        frequencies = {term: len(term_postings) for term, term_postings in postings.items()}
+        if user is None:
+            return postings, frequencies, 0, 0
+        return postings, frequencies, user["searchDocuments"], user["searchLength"]
+
+    def rebuild_search_index(self) -> int:
+        totals: dict[str, list[int]] = {}
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM search_postings")
+            conn.execute("UPDATE users SET searchDocuments = 0, searchLength = 0, searchVersion = searchVersion + 1")
+            cursor = conn.execute("SELECT * FROM messages ORDER BY userId")
+            while rows := cursor.fetchmany(500):
+                for message in _messages(rows):
+                    postings, length = search.index_messages([message])
+                    self._insert_postings(conn, message.userId, postings)
+                    user_totals = totals.setdefault(message.userId, [0, 0])
+                    user_totals[0] += 1
+                    user_totals[1] += length
+            conn.executemany(
+                "UPDATE users SET searchDocuments = ?, searchLength = ? WHERE uid = ?",
+                [(documents, length, user_id) for user_id, (documents, length) in totals.items()],
+            )
+        return sum(documents for documents, _ in totals.values())
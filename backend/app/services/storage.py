@@ -0,0 +1,363 @@
+from starlette.concurrency import run_in_threadpool
+import datetime
+import functools
+import time
+from ..config import settings
+from ..core import tracing
+from ..core.cache import TTLCache
+from ..core.metrics import registry
+from ..models.user import UserInDB
+from ..models.chat import Chat
+from ..models.message import Message
+
+STORAGE_SECONDS = registry.histogram(
+    "storage_operation_seconds", "Database calls, by backend, method and outcome.", ["backend", "method", "outcome"]
+)
+
+# Data methods timed per call, with the name they are reported under. Chat reads are
+# timed at `_fetch_chat`, so the cache hits of `get_chat` don't dilute them.
+_TIMED_METHODS = {
+    "get_user": "get_user",
+    "create_user": "create_user",
+    "update_user_login_time": "update_user_login_time",
+    "get_chats_version": "get_chats_version",
+    "create_chat": "create_chat",
+    "get_chats_for_user": "get_chats_for_user",
+    "list_chats": "list_chats",
+    "_fetch_chat": "get_chat",
+    "_fetch_chats": "get_chats",
+    "update_chat_summary": "update_chat_summary",
+    "add_messages": "add_messages",
+    "get_messages_for_chat": "get_messages_for_chat",
+    "list_messages": "list_messages",
+    "get_messages_after": "get_messages_after",
+    "get_messages_by_ids": "get_messages_by_ids",
+    "get_search_version": "get_search_version",
+    "get_search_postings": "get_search_postings",
+}
+
+# Fields the chat list can be ordered by, newest first.
+CHAT_SORT_FIELDS = ("createdAt", "lastMessageAt")
+
+def message_preview(content: str) -> str:
+    """The start of a message, as kept in a chat's lastMessagePreview."""
+    if len(content) <= settings.CHAT_PREVIEW_CHARS:
+        return content
+    return content[:settings.CHAT_PREVIEW_CHARS - 1].rstrip() + "…"
+
+def last_message_fields(messages: list[Message]) -> dict:
+    """The chat fields describing the latest of `messages`, written along with them."""
+    last = max(messages, key=lambda message: message.timestamp)
+    return {
+        "lastMessageAt": last.timestamp,
+        "lastMessagePreview": message_preview(last.content),
+        "lastMessageRole": last.role,
+    }
+
+class StorageService:
+    """
+    Persistence for users, chats and messages, independent of the database behind it.
+    Subclasses implement the blocking data methods; the shared parts live here:
+      - every method has an `a`-prefixed coroutine twin that runs it on the worker
+        thread pool, so async callers (the WebSocket pipeline) never stall the loop
+        while sync callers (the REST routes) keep using the plain methods;
+      - every data method is timed into `storage_operation_seconds` under the
+        subclass's `backend` name, and traced as a `storage.<method>` span;
+      - chats are cached by id in `chat_cache` (owner, title, counters, summary).
+        Writes made through this service update the cache in place; changes made by
+        other workers become visible once an entry's TTL runs out. Ownership never
+        changes, so access checks can always be answered from the cache.
+    """
+    backend = "unknown"
+
+    def __init__(self, chat_cache: TTLCache | None = None):
+        self.chat_cache = chat_cache or TTLCache(maxsize=settings.CHAT_CACHE_SIZE, ttl=settings.CHAT_CACHE_TTL_SECONDS)
+        for name, method in _TIMED_METHODS.items():
+            setattr(self, name, self._timed(method, getattr(self, name)))
+
+    def _timed(self, method: str, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            outcome = "error"
+            start = time.perf_counter()
+            try:
+                with tracing.span(f"storage.{method}", backend=self.backend):
+                    result = fn(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                STORAGE_SECONDS.observe(time.perf_counter() - start, backend=self.backend, method=method, outcome=outcome)
+        return wrapper
+
+    def close(self) -> None:
+        """Releases the connections held by the service."""
+        pass
+
+    def warm_up(self) -> None:
+        """Opens the database connection ahead of the first request, where that is lazy."""
+        pass
+
+    # --- Users ---
+
+    def get_user(self, user_id: str) -> UserInDB | None:
+        raise NotImplementedError
+
+    def create_user(self, user_data: dict) -> UserInDB:
+        raise NotImplementedError
+
+    def update_user_login_time(self, user_id: str):
+        raise NotImplementedError
+
+    def get_chats_version(self, user_id: str) -> int | None:
+        """
+        The user's `chatsVersion`: a counter bumped, in the same write, by everything
+        that changes what the chat list shows (a new chat, a message added to one).
+        None when the user has no stored profile to hold it.
+        """
+        raise NotImplementedError
+
+    # --- Chats ---
+
+    def create_chat(self, user_id: str, title: str, cache_responses: bool = True) -> Chat:
+        """Creates a chat and bumps the owner's `chatsVersion` in the same write."""
+        raise NotImplementedError
+
+    def get_chats_for_user(self, user_id: str) -> list[Chat]:
+        raise NotImplementedError
+
+    def list_chats(
+        self,
+        user_id: str,
+        limit: int,
+        after: datetime.datetime | None = None,
+        sort: str = "createdAt",
+        active_since: datetime.datetime | None = None,
+        after_id: str | None = None
+    ) -> tuple[list[Chat], bool]:
+        """
+        Returns one page of a user's chats, newest first by `sort` (one of
+        CHAT_SORT_FIELDS) then by id, plus whether more follow. `after` and `after_id`
+        are the sort field's value and the id of the last chat of the previous page;
+        without the id, the page starts below that value. `active_since` keeps only
+        chats whose lastMessageAt is at or after it, and needs `sort="lastMessageAt"`
+        so the page stays a single indexed query.
+        """
+        raise NotImplementedError
+
+    def _fetch_chat(self, chat_id: str) -> Chat | None:
+        """Reads a chat from the database, bypassing the cache."""
+        raise NotImplementedError
+
+    def get_chat(self, chat_id: str, user_id: str, fresh: bool = False) -> Chat | None:
+        """
+        Returns the chat if `user_id` owns it. `fresh` reads through to the database
+        (refreshing the cache), for callers that need counters other workers may have moved.
+        """
+        chat = None if fresh else self.chat_cache.get(chat_id)
+        if chat is None:
+            chat = self._fetch_chat(chat_id)
+            if chat is None:
+                return None
+            self.chat_cache.set(chat_id, chat)
+        if chat.userId == user_id:
+            return chat
+        return None
+
+    def _fetch_chats(self, chat_ids: list[str]) -> list[Chat]:
+        """Reads several chats from the database in one round trip, bypassing the cache; ids not found are skipped."""
+        raise NotImplementedError
+
+    def get_chats(self, chat_ids: list[str], user_id: str) -> dict[str, Chat]:
+        """The chats among `chat_ids` that `user_id` owns, by id. Only chats not cached are read."""
+        chats = {chat_id: self.chat_cache.get(chat_id) for chat_id in dict.fromkeys(chat_ids)}
+        missing = [chat_id for chat_id, chat in chats.items() if chat is None]
+        if missing:
+            for chat in self._fetch_chats(missing):
+                self.chat_cache.set(chat.id, chat)
+                chats[chat.id] = chat
+        return {chat_id: chat for chat_id, chat in chats.items() if chat is not None and chat.userId == user_id}
+
+    def _update_cached_chat(self, chat_id: str, added_messages: int = 0, **changes) -> None:
+        """Write-through for a cached chat; cached models are replaced, never mutated."""
+        chat = self.chat_cache.get(chat_id)
+        if chat is not None:
+            if added_messages:
+                changes["messageCount"] = chat.messageCount + added_messages
+            self.chat_cache.set(chat_id, chat.model_copy(update=changes))
+
+    def update_chat_summary(self, chat_id: str, summary: str, summarized_through: datetime.datetime):
+        raise NotImplementedError
+
+    def backfill_chat_activity(self) -> int:
+        """
+        Fills lastMessageAt / lastMessagePreview / lastMessageRole on chats written
+        before they were maintained, from each chat's latest message. Returns the
+        number of chats updated; chats that already have them are left alone. Bumps
+        each affected owner's chatsVersion, so cached chat lists are refetched.
+        """
+        raise NotImplementedError
+
+    # --- Messages ---
+
+    def new_message_id(self) -> str:
+        """Allocates a message id without writing anything."""
+        raise NotImplementedError
+
+    def build_message(self, chat_id: str, user_id: str, message_data: dict, message_id: str | None = None) -> dict:
+        """
+        Builds a complete message document (id, chatId, userId, timestamp) without writing it.
+        Lets callers hand a message out before it is persisted with `add_messages`.
+        """
+        return {
+            "id": message_id or self.new_message_id(),
+            "chatId": chat_id,
+            "userId": user_id,
+            "timestamp": datetime.datetime.now(datetime.timezone.utc),
+            **message_data
+        }
+
+    def add_messages(self, chat_id: str, user_id: str, messages: list[dict]) -> list[Message]:
+        """
+        Writes several messages, the chat's `messageCount` increment and latest-message
+        fields (see `last_message_fields`) and the owner's `chatsVersion` bump
+        atomically, then the messages' search postings (see `search.index_messages`).
+        A backend may index in a separate write, later and off the caller's path, so a
+        failed index write never loses the messages and new messages may take a moment
+        to become searchable. Entries may be plain message data or documents from
+        `build_message`.
+        """
+        raise NotImplementedError
+
+    def add_message_to_chat(self, chat_id: str, user_id: str, message_data: dict, message_id: str | None = None) -> Message:
+        message = self.build_message(chat_id, user_id, message_data, message_id)
+        return self.add_messages(chat_id, user_id, [message])[0]
+
+    def get_messages_for_chat(self, chat_id: str, user_id: str) -> list[Message]:
+        raise NotImplementedError
+
+    def list_messages(
+        self,
+        chat_id: str,
+        limit: int,
+        before: datetime.datetime | None = None,
+        after: datetime.datetime | None = None,
+        before_id: str | None = None,
+        after_id: str | None = None
+    ) -> tuple[list[Message], bool]:
+        """
+        Returns one page of a chat's messages in chronological order (by timestamp,
+        then id), plus whether more exist in the direction being paged. Without
+        `after` the page ends at `before` (or at the newest message), so history loads
+        newest-first; with `after` it starts right after that timestamp. `before_id` /
+        `after_id` name the message at that timestamp the page is bounded by, so
+        messages sharing a timestamp are neither skipped nor repeated across pages.
+        Callers must have already checked access to the chat.
+        """
+        raise NotImplementedError
+
+    def get_messages_after(self, chat_id: str, after: datetime.datetime) -> list[Message]:
+        """
+        Returns the messages of a chat newer than `after`, oldest first.
+        Callers must have already checked access to the chat.
+        """
+        raise NotImplementedError
+
+    def get_messages_by_ids(self, message_ids: list[str]) -> list[Message]:
+        """
+        Returns the messages with these ids, in the same order; ids not found are
+        skipped. Callers must have already checked access to them.
+        """
+        raise NotImplementedError
+
+    # --- Search ---
+
+    def get_search_version(self, user_id: str) -> int | None:
+        """
+        The user's `searchVersion`: a counter bumped once postings written for the
+        user's messages have been committed, so it versions search results the way
+        `chatsVersion` versions the chat list. None when the user has no stored profile.
+        """
+        raise NotImplementedError
+
+    def get_search_postings(
+        self, user_id: str, terms: list[str]
+    ) -> tuple[dict[str, dict[str, int]], dict[str, int], int, int]:
+        """
+        Reads one user's postings for `terms` (term -> message id -> posting, see
+        `search.pack_posting`; terms no message has are left out), each term's number
+        of indexed messages, and the user's number of indexed messages and their
+        summed length. A backend may cap how many postings it reads per term, keeping
+        the newest; the counts always cover every message.
+        """
+        raise NotImplementedError
+
+    def rebuild_search_index(self) -> int:
+        """
+        Rebuilds every user's search index from the stored messages, replacing what
+        is there. Returns the number of messages indexed. Messages written while it
+        runs may be left out; run it again, or at a quiet time.
+        """
+        raise NotImplementedError
+
+    # --- Async twins ---
+
+    async def awarm_up(self) -> None:
+        return await run_in_threadpool(self.warm_up)
+
+    async def aget_user(self, user_id: str) -> UserInDB | None:
+        return await run_in_threadpool(self.get_user, user_id)
+
+    async def acreate_user(self, user_data: dict) -> UserInDB:
+        return await run_in_threadpool(self.create_user, user_data)
+
+    async def aupdate_user_login_time(self, user_id: str):
+        return await run_in_threadpool(self.update_user_login_time, user_id)
+
+    async def aget_chats_version(self, user_id: str) -> int | None:
+        return await run_in_threadpool(self.get_chats_version, user_id)
+
+    async def acreate_chat(self, user_id: str, title: str, cache_responses: bool = True) -> Chat:
+        return await run_in_threadpool(self.create_chat, user_id, title, cache_responses)
+
+    async def aget_chats_for_user(self, user_id: str) -> list[Chat]:
+        return await run_in_threadpool(self.get_chats_for_user, user_id)
+
+    async def aupdate_chat_summary(self, chat_id: str, summary: str, summarized_through: datetime.datetime):
+        return await run_in_threadpool(self.update_chat_summary, chat_id, summary, summarized_through)
+
+    async def alist_chats(
+        self,
+        user_id: str,
+        limit: int,
+        after: datetime.datetime | None = None,
+        sort: str = "createdAt",
+        active_since: datetime.datetime | None = None,
+        after_id: str | None = None
+    ) -> tuple[list[Chat], bool]:
+        return await run_in_threadpool(self.list_chats, user_id, limit, after, sort, active_since, after_id)
+
+    async def aget_chat(self, chat_id: str, user_id: str, fresh: bool = False) -> Chat | None:
+        return await run_in_threadpool(self.get_chat, chat_id, user_id, fresh)
+
+    async def aadd_message_to_chat(self, chat_id: str, user_id: str, message_data: dict, message_id: str | None = None) -> Message:
+        return await run_in_threadpool(self.add_message_to_chat, chat_id, user_id, message_data, message_id)
+
+    async def aadd_messages(self, chat_id: str, user_id: str, messages: list[dict]) -> list[Message]:
+        return await run_in_threadpool(self.add_messages, chat_id, user_id, messages)
+
+    async def aget_messages_for_chat(self, chat_id: str, user_id: str) -> list[Message]:
+        return await run_in_threadpool(self.get_messages_for_chat, chat_id, user_id)
+
+    async def alist_messages(
+        self,
+        chat_id: str,
+        limit: int,
+        before: datetime.datetime | None = None,
+        after: datetime.datetime | None = None,
+        before_id: str | None = None,
+        after_id: str | None = None
+    ) -> tuple[list[Message], bool]:
+        return await run_in_threadpool(self.list_messages, chat_id, limit, before, after, before_id, after_id)
+
+    async def aget_messages_after(self, chat_id: str, after: datetime.datetime) -> list[Message]:
+        return await run_in_threadpool(self.get_messages_after, chat_id, after)
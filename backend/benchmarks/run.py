@@ -0,0 +1,314 @@
+"""
+Load test for the chat backend. Runs the real FastAPI app (`app.main:app`) under
+uvicorn, with Firestore and Gemini replaced by in-process stand-ins (or, with
+`--storage sqlite`, by a real SQLite database in a temporary directory), drives
+concurrent WebSocket sessions and REST clients against it, and reports throughput
+plus p50/p95/p99 latency per stage.
+
+    cd backend
+    python -m benchmarks.run --sessions 50 --turns 5 --rest-clients 10
+
+Server-side stages (auth, history_read, llm, llm_first_token, persistence, broadcast)
+are timed by wrapping the corresponding calls in the running app; client-side stages
+(ws_connect, turn, first_delta, rest_*) are timed by the load generators.
+"""
+import os
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import firebase_admin.auth
+import httpx
+import uvicorn
+import websockets
+
+from app import main as app_main
+from app.api import websocket as websocket_api
+from app.core import dependencies, security
+from app.services import firebase_service
+from app.services.sqlite_service import SQLiteService
+from app.services.storage import StorageService
+from benchmarks.stubs import FakeChatModel, FakeLangChainService, InMemoryFirebaseService
+
+class StageRecorder:
+    """Collects latency samples (seconds) per stage, from the server thread and the clients."""
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def time_sync(self, stage: str, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+    def time_async(self, stage: str, fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+    def time_stream(self, stage: str, first_stage: str, fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            first = True
+            try:
+                async for item in fn(*args, **kwargs):
+                    if first:
+                        self.record(first_stage, time.perf_counter() - start)
+                        first = False
+                    yield item
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+    def summary(self) -> dict[str, dict]:
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+        return {
+            stage: {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1],
+            }
+            for stage, values in samples.items() if values
+        }
+
+def percentile(ordered: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def token_for(uid: str) -> str:
+    return f"bench:{uid}"
+
+def fake_verify_id_token(token: str, *args, **kwargs) -> dict:
+    if not token.startswith("bench:"):
+        raise ValueError("Not a benchmark token")
+    return {"uid": token.split(":", 1)[1], "exp": time.time() + 3600}
+
+def seed(storage: StorageService, sessions: int, history: int) -> list[tuple[str, str]]:
+    """Creates one user with one chat (holding `history` messages) per session."""
+    latency = getattr(storage, "latency", 0.0)
+    if latency:
+        storage.latency = 0.0
+    seeded = []
+    for i in range(sessions):
+        uid = f"bench-user-{i}"
+        storage.create_user({"uid": uid, "email": f"{uid}@example.com", "displayName": uid})
+        chat = storage.create_chat(uid, f"Benchmark chat {i}")
+        storage.add_messages(chat.id, uid, [
+            {"content": f"Earlier message {n}", "role": "user" if n % 2 == 0 else "assistant"}
+            for n in range(history)
+        ])
+        seeded.append((uid, chat.id))
+    if latency:
+        storage.latency = latency
+    return seeded
+
+def instrument_startup(recorder: StageRecorder, storage: StorageService, llm: FakeChatModel) -> None:
+    """Swaps the stand-ins into the app's startup and times token verification."""
+    app_main.initialize_firebase = lambda: None
+    dependencies.get_db = lambda: None
+    dependencies.settings.STORAGE_BACKEND = "firestore"
+    firebase_service.FirebaseService = lambda db: storage
+    dependencies.LangChainService = lambda scheduler=None: FakeLangChainService(llm, scheduler)
+    firebase_admin.auth.verify_id_token = fake_verify_id_token
+    timed_verify = recorder.time_sync("auth", security.verify_token)
+    security.verify_token = timed_verify
+    websocket_api.verify_token = timed_verify
+
+def instrument_services(recorder: StageRecorder, app) -> None:
+    """Times the turn stages on the service instances the running app uses."""
+    chat_service = app.state.chat_service
+    chat_service._aget_history = recorder.time_async("history_read", chat_service._aget_history)
+    chat_service._asave_messages = recorder.time_async("persistence", chat_service._asave_messages)
+    langchain_service = app.state.langchain_service
+    langchain_service.astream_response = recorder.time_stream(
+        "llm", "llm_first_token", langchain_service.astream_response
+    )
+    manager = app.state.connection_manager
+    manager.broadcast = recorder.time_async("broadcast", manager.broadcast)
+
+async def run_session(base_url: str, uid: str, chat_id: str, args, recorder: StageRecorder, errors: list) -> int:
+    url = f"{base_url.replace('http', 'ws', 1)}/ws/{chat_id}?token={token_for(uid)}&stream=true"
+    completed = 0
+    try:
+        start = time.perf_counter()
+        async with websockets.connect(url, max_size=None) as ws:
+            recorder.record("ws_connect", time.perf_counter() - start)
+            for turn in range(args.turns):
+                start = time.perf_counter()
+                first_delta = None
+                await ws.send(f"Benchmark message {turn} from {uid}")
+                while True:
+                    frame = json.loads(await ws.recv())
+                    kind = frame.get("type")
+                    if kind == "delta" and first_delta is None:
+                        first_delta = time.perf_counter()
+                        recorder.record("first_delta", first_delta - start)
+                    elif kind == "final":
+                        break
+                recorder.record("turn", time.perf_counter() - start)
+                completed += 1
+                if args.think_time:
+                    await asyncio.sleep(args.think_time)
+    except Exception as e:
+        errors.append(f"session {uid}: {e!r}")
+    return completed
+
+async def run_rest_client(
+    base_url: str, uid: str, chat_id: str, stop: asyncio.Event, recorder: StageRecorder, errors: list
+) -> int:
+    headers = {"Authorization": f"Bearer {token_for(uid)}"}
+    # Revalidate like a browser cache does: repeat each path's last ETag.
+    etags: dict[str, str] = {}
+    requests = 0
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=30.0) as client:
+        while not stop.is_set():
+            for stage, path in (
+                ("rest_list_chats", "/api/chats/"),
+                ("rest_list_messages", f"/api/chats/{chat_id}/messages?limit=50"),
+            ):
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path, headers={"If-None-Match": etags[path]} if path in etags else None)
+                    if response.status_code != 304:
+                        response.raise_for_status()
+                    if "ETag" in response.headers:
+                        etags[path] = response.headers["ETag"]
+                except Exception as e:
+                    errors.append(f"rest {uid} {path}: {e!r}")
+                    continue
+                recorder.record(stage, time.perf_counter() - start)
+                requests += 1
+    return requests
+
+async def drive(base_url: str, seeded: list[tuple[str, str]], args, recorder: StageRecorder) -> dict:
+    errors: list[str] = []
+    stop = asyncio.Event()
+    rest = [
+        asyncio.create_task(run_rest_client(base_url, uid, chat_id, stop, recorder, errors))
+        for uid, chat_id in seeded[:args.rest_clients]
+    ]
+    start = time.perf_counter()
+    turns = await asyncio.gather(*(
+        run_session(base_url, uid, chat_id, args, recorder, errors) for uid, chat_id in seeded
+    ))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    requests = await asyncio.gather(*rest)
+    return {
+        "elapsed": elapsed,
+        "turns": sum(turns),
+        "turns_per_second": sum(turns) / elapsed,
+        "rest_requests": sum(requests),
+        "rest_requests_per_second": sum(requests) / elapsed,
+        "errors": errors,
+    }
+
+def print_report(args, totals: dict, stages: dict) -> None:
+    print()
+    db = f"db_latency={args.db_latency}s" if args.storage == "memory" else "db=sqlite"
+    print(f"sessions={args.sessions} turns={args.turns} rest_clients={args.rest_clients} "
+          f"llm_latency={args.llm_latency}s llm_tokens={args.llm_tokens}@{args.llm_tokens_per_second}/s {db}")
+    print(f"elapsed {totals['elapsed']:.2f}s  turns {totals['turns']} ({totals['turns_per_second']:.1f}/s)  "
+          f"rest {totals['rest_requests']} ({totals['rest_requests_per_second']:.1f}/s)  errors {len(totals['errors'])}")
+    print()
+    print(f"{'stage':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    order = [
+        "auth", "ws_connect", "history_read", "llm_first_token", "llm", "persistence", "broadcast",
+        "first_delta", "turn", "rest_list_chats", "rest_list_messages",
+    ]
+    for stage in sorted(stages, key=lambda s: order.index(s) if s in order else len(order)):
+        s = stages[stage]
+        print(f"{stage:<20}{s['count']:>8}{s['p50'] * 1000:>10.1f}{s['p95'] * 1000:>10.1f}"
+              f"{s['p99'] * 1000:>10.1f}{s['max'] * 1000:>10.1f}")
+    for error in totals["errors"][:10]:
+        print(f"error: {error}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent WebSocket sessions (one user and chat each)")
+    parser.add_argument("--turns", type=int, default=5, help="messages sent per session")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pause between a session's turns, seconds")
+    parser.add_argument("--rest-clients", type=int, default=5, help="REST clients polling while the sessions run")
+    parser.add_argument("--history", type=int, default=20, help="messages pre-loaded into every chat")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="fake model time to first token, seconds")
+    parser.add_argument("--llm-tokens", type=int, default=50, help="tokens per fake reply")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200.0, help="fake model output rate")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="memory",
+                        help="in-memory Firestore stand-in, or a SQLite database in a temporary directory")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="simulated Firestore round trip, seconds (memory only)")
+    parser.add_argument("--quiet", action="store_true", help="discard the app's own stdout while it runs")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    recorder = StageRecorder()
+    tmpdir = tempfile.TemporaryDirectory()
+    if args.storage == "sqlite":
+        storage = SQLiteService(os.path.join(tmpdir.name, "benchmark.db"))
+    else:
+        storage = InMemoryFirebaseService(latency=args.db_latency)
+    llm = FakeChatModel(latency=args.llm_latency, tokens=args.llm_tokens, tokens_per_second=args.llm_tokens_per_second)
+    seeded = seed(storage, args.sessions, args.history)
+    instrument_startup(recorder, storage, llm)
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app_main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    output = open(os.devnull, "w") if args.quiet else contextlib.nullcontext(sys.stdout)
+    with output as out, contextlib.redirect_stdout(out):
+        thread.start()
+        while not (server.started and getattr(app_main.app.state, "ready", False)):
+            if not thread.is_alive():
+                raise SystemExit("The server failed to start")
+            time.sleep(0.05)
+        instrument_services(recorder, app_main.app)
+        totals = asyncio.run(drive(f"http://127.0.0.1:{port}", seeded, args, recorder))
+        server.should_exit = True
+        thread.join(timeout=10)
+    tmpdir.cleanup()
+
+    stages = recorder.summary()
+    print_report(args, totals, stages)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "totals": totals, "stages": stages}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
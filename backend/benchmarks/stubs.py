@@ -0,0 +1,254 @@
+import asyncio
+import datetime
+import itertools
+import threading
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+
+from app.config import settings
+from app.models.chat import Chat
+from app.models.message import Message
+from app.models.user import UserInDB
+from app.services.langchain_service import LangChainService
+from app.services.model_router import ModelRouter
+from app.services import search
+from app.services.storage import StorageService, last_message_fields
+
+def _past(key: tuple, value: datetime.datetime, item_id: str | None, reverse: bool = False) -> bool:
+    """Whether (value, id) `key` lies beyond the cursor; without an id, beyond `value` alone."""
+    if item_id is None:
+        return key[0] < value if reverse else key[0] > value
+    return key < (value, item_id) if reverse else key > (value, item_id)
+
+class InMemoryFirebaseService(StorageService):
+    """
+    Stand-in for `FirebaseService` that keeps users, chats and messages in process.
+    Every data method sleeps for `latency` seconds first to stand in for the Firestore
+    round trip; like the real client it blocks, so the async twins still go through
+    the thread pool. The chat cache of the real service is kept, so access checks
+    behave as in production.
+    """
+    backend = "memory"
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._users: dict[str, UserInDB] = {}
+        self._chats: dict[str, Chat] = {}
+        self._messages: dict[str, list[Message]] = {}
+        self._chats_versions: dict[str, int] = {}
+        self._postings: dict[str, dict[str, dict[str, int]]] = {}
+        self._search_totals: dict[str, tuple[int, int]] = {}
+        self._search_versions: dict[str, int] = {}
+        self._ids = itertools.count()
+
+    def _round_trip(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get_user(self, user_id: str) -> UserInDB | None:
+        self._round_trip()
+        return self._users.get(user_id)
+
+    def create_user(self, user_data: dict) -> UserInDB:
+        self._round_trip()
+        user = UserInDB(createdAt=datetime.datetime.now(datetime.timezone.utc), **user_data)
+        self._users[user.uid] = user
+        return user
+
+    def update_user_login_time(self, user_id: str):
+        self._round_trip()
+        user = self._users.get(user_id)
+        if user is not None:
+            self._users[user_id] = user.model_copy(update={"lastLoginAt": datetime.datetime.now(datetime.timezone.utc)})
+
+    def get_chats_version(self, user_id: str) -> int | None:
+        self._round_trip()
+        if user_id not in self._users:
+            return None
+        return self._chats_versions.get(user_id, 0)
+
+    def create_chat(self, user_id: str, title: str, cache_responses: bool = True) -> Chat:
+        self._round_trip()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        chat = Chat(
+            id=uuid.uuid4().hex,
+            userId=user_id,
+            title=title,
+            createdAt=now,
+            messageCount=0,
+            isActive=True,
+            cacheResponses=cache_responses,
+            lastMessageAt=now
+        )
+        with self._lock:
+            self._chats[chat.id] = chat
+            self._messages[chat.id] = []
+            self._chats_versions[user_id] = self._chats_versions.get(user_id, 0) + 1
+        self.chat_cache.set(chat.id, chat)
+        return chat
+
+    def get_chats_for_user(self, user_id: str) -> list[Chat]:
+        self._round_trip()
+        chats = [c for c in self._chats.values() if c.userId == user_id]
+        return sorted(chats, key=lambda c: c.createdAt, reverse=True)
+
+    def list_chats(
+        self,
+        user_id: str,
+        limit: int,
+        after: datetime.datetime | None = None,
+        sort: str = "createdAt",
+        active_since: datetime.datetime | None = None,
+        after_id: str | None = None
+    ) -> tuple[list[Chat], bool]:
+        chats = sorted(self.get_chats_for_user(user_id), key=lambda c: (getattr(c, sort), c.id), reverse=True)
+        if active_since is not None:
+            chats = [c for c in chats if c.lastMessageAt >= active_since]
+        if after is not None:
+            chats = [c for c in chats if _past((getattr(c, sort), c.id), after, after_id, reverse=True)]
+        return chats[:limit], len(chats) > limit
+
+    def _fetch_chat(self, chat_id: str) -> Chat | None:
+        self._round_trip()
+        return self._chats.get(chat_id)
+
+    def _fetch_chats(self, chat_ids: list[str]) -> list[Chat]:
+        self._round_trip()
+        return [self._chats[chat_id] for chat_id in chat_ids if chat_id in self._chats]
+
+    def update_chat_summary(self, chat_id: str, summary: str, summarized_through: datetime.datetime):
+        self._round_trip()
+        with self._lock:
+            self._chats[chat_id] = self._chats[chat_id].model_copy(
+                update={"summary": summary, "summarizedThrough": summarized_through}
+            )
+        self._update_cached_chat(chat_id, summary=summary, summarizedThrough=summarized_through)
+
+    def new_message_id(self) -> str:
+        return f"m{next(self._ids):012d}"
+
+    def add_messages(self, chat_id: str, user_id: str, messages: list[dict]) -> list[Message]:
+        if not messages:
+            return []
+        self._round_trip()
+        saved = [Message(**(self.build_message(chat_id, user_id, {}, m.get("id")) | m)) for m in messages]
+        with self._lock:
+            self._messages[chat_id].extend(saved)
+            chat = self._chats[chat_id]
+            last_message = last_message_fields(saved)
+            self._chats[chat_id] = chat.model_copy(
+                update={"messageCount": chat.messageCount + len(saved), **last_message}
+            )
+            self._chats_versions[user_id] = self._chats_versions.get(user_id, 0) + 1
+            postings, total_length = search.index_messages(saved)
+            user_postings = self._postings.setdefault(user_id, {})
+            for term, term_postings in postings.items():
+                user_postings.setdefault(term, {}).update(term_postings)
+            documents, length = self._search_totals.get(user_id, (0, 0))
+            self._search_totals[user_id] = (documents + len(saved), length + total_length)
+            self._search_versions[user_id] = self._search_versions.get(user_id, 0) + 1
+        self._update_cached_chat(chat_id, added_messages=len(saved), **last_message)
+        return saved
+
+    def get_messages_for_chat(self, chat_id: str, user_id: str) -> list[Message]:
+        if not self.get_chat(chat_id, user_id):
+            return []
+        self._round_trip()
+        return list(self._messages.get(chat_id, []))
+
+    def list_messages(
+        self,
+        chat_id: str,
+        limit: int,
+        before: datetime.datetime | None = None,
+        after: datetime.datetime | None = None,
+        before_id: str | None = None,
+        after_id: str | None = None
+    ) -> tuple[list[Message], bool]:
+        self._round_trip()
+        messages = sorted(self._messages.get(chat_id, []), key=lambda m: (m.timestamp, m.id))
+        if after is not None:
+            messages = [m for m in messages if _past((m.timestamp, m.id), after, after_id)]
+            return messages[:limit], len(messages) > limit
+        if before is not None:
+            messages = [m for m in messages if _past((m.timestamp, m.id), before, before_id, reverse=True)]
+        return messages[-limit:], len(messages) > limit
+
+    def get_messages_after(self, chat_id: str, after: datetime.datetime) -> list[Message]:
+        self._round_trip()
+        return [m for m in self._messages.get(chat_id, []) if m.timestamp > after]
+
+    def get_messages_by_ids(self, message_ids: list[str]) -> list[Message]:
+        self._round_trip()
+        wanted = set(message_ids)
+        found = {m.id: m for messages in self._messages.values() for m in messages if m.id in wanted}
+        return [found[message_id] for message_id in message_ids if message_id in found]
+
+    def get_search_version(self, user_id: str) -> int | None:
+        self._round_trip()
+        if user_id not in self._users:
+            return None
+        return self._search_versions.get(user_id, 0)
+
+    def get_search_postings(
+        self, user_id: str, terms: list[str]
+    ) -> tuple[dict[str, dict[str, int]], dict[str, int], int, int]:
+        self._round_trip()
+        user_postings = self._postings.get(user_id, {})
+        postings = {term: dict(user_postings[term]) for term in terms if term in user_postings}
+        frequencies = {term: len(term_postings) for term, term_postings in postings.items()}
+        return (postings, frequencies, *self._search_totals.get(user_id, (0, 0)))
+
+class FakeChatModel:
+    """
+    Chat model stand-in: waits `latency` seconds (time to first token), then produces
+    `tokens` tokens at `tokens_per_second`. Streams one chunk per token.
+    """
+    def __init__(self, latency: float = 0.5, tokens: int = 100, tokens_per_second: float = 50.0):
+        self.latency = latency
+        self.tokens = tokens
+        self.tokens_per_second = tokens_per_second
+
+    def _reply(self, messages: list[BaseMessage]) -> list[str]:
+        return [f"tok{i} " for i in range(self.tokens)]
+
+    def invoke(self, messages: list[BaseMessage]) -> AIMessage:
+        time.sleep(self.latency + self.tokens / self.tokens_per_second)
+        return AIMessage(content="".join(self._reply(messages)))
+
+    async def ainvoke(self, messages: list[BaseMessage]) -> AIMessage:
+        await asyncio.sleep(self.latency + self.tokens / self.tokens_per_second)
+        return AIMessage(content="".join(self._reply(messages)))
+
+    async def astream(self, messages: list[BaseMessage]):
+        await asyncio.sleep(self.latency)
+        interval = 1.0 / self.tokens_per_second
+        for token in self._reply(messages):
+            await asyncio.sleep(interval)
+            yield AIMessageChunk(content=token)
+
+class FakeLangChainService(LangChainService):
+    """`LangChainService` over a `FakeChatModel`; routing, hedging and scheduling are the real ones."""
+    def __init__(self, llm: FakeChatModel, scheduler=None):
+        self.scheduler = scheduler
+        self.backends = {"fake": llm}
+        self.llm = llm
+        self.router = ModelRouter(
+            self.backends,
+            primary="fake",
+            hedge_enabled=settings.LLM_HEDGE_ENABLED,
+            hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+            hedge_min_samples=settings.LLM_HEDGE_MIN_SAMPLES,
+            hedge_default_delay=settings.LLM_HEDGE_DEFAULT_DELAY_SECONDS,
+            scheduler=scheduler,
+        )
+
+    async def awarm_up(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,26 @@
+import os
+
+# Settings require a Gemini key at import time; no test calls the model.
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+import datetime
+
+import pytest
+
+from app.services.sqlite_service import SQLiteService
+
+T0 = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+@pytest.fixture
+def storage():
+    service = SQLiteService(":memory:", pool_size=2)
+    yield service
+    service.close()
+
+@pytest.fixture
+def user(storage):
+    return storage.create_user({"uid": "u1", "email": "u1@example.com", "displayName": "User One"})
+
+@pytest.fixture
+def chat(storage, user):
+    return storage.create_chat(user.uid, "Test chat")
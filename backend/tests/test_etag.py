@@ -0,0 +1,76 @@
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import dependencies
+from app.core.security import get_current_user
+from app.main import app
+from app.services.chat_service import ChatService
+
+@pytest.fixture
+def client(storage, user):
+    app.dependency_overrides[dependencies.get_firebase_service] = lambda: storage
+    app.dependency_overrides[dependencies.get_chat_service] = lambda: ChatService(storage, None)
+    app.dependency_overrides[get_current_user] = lambda: user
+    with mock.patch("app.main.initialize_firebase"), TestClient(app) as test_client:
+        yield test_client
+    app.dependency_overrides.clear()
+
+def _messages(storage, chat, count: int):
+    storage.add_messages(chat.id, chat.userId, [{"content": f"message {i}", "role": "user"} for i in range(count)])
+
+def test_messages_page_is_not_modified_until_a_message_is_added(client, storage, chat):
+    _messages(storage, chat, 5)
+    url = f"/api/chats/{chat.id}/messages?limit=3"
+
+    first = client.get(url)
+    etag = first.headers["etag"]
+    assert first.status_code == 200
+    assert first.headers["x-next-cursor"]
+
+    repeat = client.get(url, headers={"If-None-Match": etag})
+    assert repeat.status_code == 304
+    assert repeat.content == b""
+    assert client.get(url, headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    # Another page is another ETag.
+    assert client.get(f"/api/chats/{chat.id}/messages?limit=4", headers={"If-None-Match": etag}).status_code == 200
+
+    _messages(storage, chat, 1)
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+def test_messages_etag_sees_writes_from_other_workers(client, storage, chat):
+    _messages(storage, chat, 2)
+    url = f"/api/chats/{chat.id}/messages"
+    etag = client.get(url).headers["etag"]
+    # A write that bypasses this worker's chat cache.
+    with storage._transaction() as conn:
+        conn.execute("UPDATE chats SET messageCount = messageCount + 1 WHERE id = ?", (chat.id,))
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
+
+def test_chat_list_is_not_modified_until_chats_change(client, storage, user, chat):
+    first = client.get("/api/chats/")
+    etag = first.headers["etag"]
+    assert [c["id"] for c in first.json()] == [chat.id]
+    assert client.get("/api/chats/", headers={"If-None-Match": etag}).status_code == 304
+
+    storage.create_chat(user.uid, "Another chat")
+    created = client.get("/api/chats/", headers={"If-None-Match": etag})
+    assert created.status_code == 200
+    assert len(created.json()) == 2
+
+    etag = created.headers["etag"]
+    _messages(storage, chat, 1)
+    assert client.get("/api/chats/", headers={"If-None-Match": etag}).status_code == 200
+
+def test_recreating_a_user_does_not_rewind_the_chat_list_version(client, storage, user, chat):
+    etag = client.get("/api/chats/").headers["etag"]
+    version = storage.get_chats_version(user.uid)
+
+    storage.create_user({"uid": user.uid, "email": user.email})
+
+    assert storage.get_chats_version(user.uid) == version
+    assert client.get("/api/chats/", headers={"If-None-Match": etag}).status_code == 304
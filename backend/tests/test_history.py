@@ -0,0 +1,151 @@
+import asyncio
+
+from app.services.chat_service import ChatService
+from app.services.context_manager import ContextManager
+from app.services.history_cache import HistoryCache
+
+class FakeLangChain:
+    """Summarizes by counting, and records what the model was shown."""
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.gate: asyncio.Event | None = None
+        self.summarized: list[int] = []
+        self.seen_history: list[str] | None = None
+        self.seen_summary: str | None = None
+
+    async def asummarize(self, previous_summary, chat_history, user_id=None):
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail:
+            return None
+        self.summarized.append(len(chat_history))
+        return f"summary of {sum(self.summarized)} messages"
+
+    async def astream_response(self, chat_history, prompt, summary, user_id=None):
+        self.seen_history = [m.content for m in chat_history]
+        self.seen_summary = summary
+        yield {"delta": "ok"}
+        yield {"content": "ok", "metadata": {}}
+
+def _fill(storage, chat, count: int):
+    storage.add_messages(chat.id, chat.userId, [
+        {"content": f"message {i}", "role": "user" if i % 2 == 0 else "assistant"} for i in range(count)
+    ])
+
+async def _aturn(service: ChatService, chat, content: str = "hello"):
+    return [event async for event in service.stream_user_message(chat.id, chat.userId, content)]
+
+async def _asettle(service: ChatService):
+    """Waits for the background summaries."""
+    await asyncio.gather(*service._summaries)
+
+def _service(storage, langchain, max_messages=50, token_budget=10_000, recent_tokens=5_000):
+    return ChatService(
+        storage,
+        langchain,
+        history_cache=HistoryCache(max_chats=10, max_messages=max_messages, ttl=60),
+        context_manager=ContextManager(token_budget=token_budget, recent_tokens=recent_tokens),
+    )
+
+def test_put_keeps_the_newest_messages_up_to_the_cap(storage, chat):
+    _fill(storage, chat, 30)
+    cache = HistoryCache(max_chats=10, max_messages=5, ttl=60)
+    history = cache.put(chat.id, storage.get_messages_for_chat(chat.id, chat.userId))
+    assert [m.content for m in history.messages] == [f"message {i}" for i in range(25, 30)]
+
+def test_excess_messages_are_summarized_in_the_background(storage, chat):
+    _fill(storage, chat, 120)
+    langchain = FakeLangChain()
+    service = _service(storage, langchain, max_messages=50)
+
+    async def run():
+        await _aturn(service, chat)
+        await _asettle(service)
+        await _aturn(service, chat, "again")
+        await _asettle(service)
+    asyncio.run(run())
+
+    # The 120 stored, summarized down to half the cap (the end of the first turn
+    # may fold its own two messages' worth more).
+    assert langchain.summarized[0] == 95
+    seen = int(langchain.seen_summary.split()[2])
+    assert seen in (95, 97)
+    assert langchain.seen_history[0] == f"message {seen}"
+    assert langchain.seen_history[-2:] == ["hello", "ok"]
+    assert storage._fetch_chat(chat.id).summary == f"summary of {sum(langchain.summarized)} messages"
+    assert len(service.history.get(chat.id).messages) <= 25
+
+def test_turns_do_not_wait_for_the_summary(storage, chat):
+    _fill(storage, chat, 120)
+    langchain = FakeLangChain()
+    service = _service(storage, langchain, max_messages=50)
+
+    async def run():
+        langchain.gate = asyncio.Event()
+        await service.warm_history(chat.id, chat.userId)
+        events = await _aturn(service, chat)
+        history = service.history.get(chat.id)
+        pending = (history.summarizing, history.summary, len(events))
+        langchain.gate.set()
+        await _asettle(service)
+        return pending, history
+
+    (summarizing, summary, events), history = asyncio.run(run())
+    assert (summarizing, summary, events) == (True, None, 3)
+    assert history.summary is not None and not history.summarizing
+
+def test_token_overflow_is_summarized_in_budget_sized_batches(storage, chat):
+    _fill(storage, chat, 40)
+    langchain = FakeLangChain()
+    service = _service(storage, langchain, max_messages=1000, token_budget=100, recent_tokens=30)
+    per_message = service.context.message_tokens("message 10")
+
+    async def run():
+        await service._aload_history(chat.id, chat.userId)
+        await _asettle(service)
+    asyncio.run(run())
+
+    assert len(langchain.summarized) > 1
+    assert all(count * per_message <= 100 for count in langchain.summarized)
+    history = service.history.get(chat.id)
+    assert sum(langchain.summarized) + len(history.messages) == 40
+    assert sum(service.context.count(m) for m in history.messages) <= 30
+
+def test_failed_summary_falls_back_to_the_cap(storage, chat):
+    _fill(storage, chat, 120)
+    service = _service(storage, FakeLangChain(fail=True), max_messages=50)
+
+    async def run():
+        history = await service._aload_history(chat.id, chat.userId)
+        await _asettle(service)
+        return history
+    history = asyncio.run(run())
+
+    assert [m.content for m in history.messages] == [f"message {i}" for i in range(70, 120)]
+    assert history.summary is None
+    assert not history.summarizing
+
+def test_a_turn_is_saved_in_one_batch(storage, chat):
+    langchain = FakeLangChain()
+    service = _service(storage, langchain)
+    writes = []
+    aadd_messages = storage.aadd_messages
+
+    async def counting(chat_id, user_id, messages):
+        writes.append([m["role"] for m in messages])
+        return await aadd_messages(chat_id, user_id, messages)
+
+    storage.aadd_messages = counting
+
+    async def run():
+        stream = service.stream_user_message(chat.id, chat.userId, "first question")
+        user_message = await anext(stream)
+        rest = [event async for event in stream]
+        return user_message, rest[-1].message
+
+    user_message, reply = asyncio.run(run())
+    assert writes == [["user", "assistant"]]
+    stored, _ = storage.list_messages(chat.id, 10)
+    assert [m.id for m in stored] == [user_message.id, reply.id]
+    # The prompt is passed on its own, not repeated in the history.
+    assert langchain.seen_history == []
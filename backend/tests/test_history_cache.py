@@ -0,0 +1,66 @@
+import asyncio
+import datetime
+
+from app.models.message import Message
+from app.services.chat_service import ChatService
+from app.services.history_cache import HistoryCache
+
+from conftest import T0
+
+def _message(message_id: str, seconds: int) -> Message:
+    return Message(
+        id=message_id, chatId="c1", userId="u1", role="user", content=message_id,
+        timestamp=T0 + datetime.timedelta(seconds=seconds),
+    )
+
+def _cache() -> HistoryCache:
+    return HistoryCache(max_chats=10, max_messages=100, ttl=60)
+
+def test_add_skips_known_messages_and_keeps_time_order():
+    cache = _cache()
+    history = cache.put("c1", [_message("a", 1), _message("c", 3)])
+
+    cache.append("c1", [_message("c", 3), _message("b", 2)])
+
+    assert [m.id for m in history.messages] == ["a", "b", "c"]
+
+def test_only_reads_from_the_database_move_the_sync_point():
+    cache = _cache()
+    history = cache.put("c1", [_message("a", 1)])
+
+    cache.append("c1", [_message("b", 5)])
+    assert history.synced_at == T0 + datetime.timedelta(seconds=1)
+
+    cache.merge("c1", [_message("c", 3)])
+    assert history.synced_at == T0 + datetime.timedelta(seconds=3)
+    assert [m.id for m in history.messages] == ["a", "c", "b"]
+
+def test_uncached_chats_are_left_alone():
+    cache = _cache()
+    cache.append("c1", [_message("a", 1)])
+    cache.merge("c1", [_message("a", 1)])
+    assert cache.get("c1") is None
+
+def test_fold_replaces_the_oldest_messages_with_the_summary():
+    cache = _cache()
+    history = cache.put("c1", [_message("a", 1), _message("b", 2), _message("c", 3)])
+
+    cache.fold("c1", history.messages[:2], "a and b")
+
+    assert [m.id for m in history.messages] == ["c"]
+    assert (history.summary, history.summarized_through) == ("a and b", T0 + datetime.timedelta(seconds=2))
+
+def test_a_turn_reads_only_messages_it_has_not_seen(storage, chat):
+    storage.add_messages(chat.id, chat.userId, [{"content": f"message {i}", "role": "user"} for i in range(5)])
+    service = ChatService(storage, None)
+    asyncio.run(service._aget_history(chat.id, chat.userId))
+    reads = []
+    get_messages_after = storage.get_messages_after
+    storage.get_messages_after = lambda chat_id, after: reads.append(after) or get_messages_after(chat_id, after)
+    # Written by "another worker": straight to the database.
+    storage.add_messages(chat.id, chat.userId, [{"content": "from elsewhere", "role": "user"}])
+
+    history = asyncio.run(service._aget_history(chat.id, chat.userId))
+
+    assert len(reads) == 1
+    assert [m.content for m in history.messages][-2:] == ["message 4", "from elsewhere"]
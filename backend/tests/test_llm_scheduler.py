@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+from app.services.llm_scheduler import LLMScheduler, is_rate_limit_error
+
+class ResourceExhausted(Exception):
+    """Named like the provider's quota error."""
+
+def _scheduler(**kwargs) -> LLMScheduler:
+    return LLMScheduler(**{"max_concurrency": 1, "retry_base_delay": 0.0, **kwargs})
+
+def test_slots_are_shared_round_robin_across_users():
+    async def run():
+        scheduler = _scheduler()
+        order = []
+
+        async def job(user_id):
+            order.append(user_id)
+
+        async with scheduler.slot("someone"):
+            calls = [
+                asyncio.create_task(scheduler.call(user_id, 0, lambda user_id=user_id: job(user_id)))
+                for user_id in ("a", "a", "a", "b", "c")
+            ]
+            await asyncio.sleep(0)
+            assert scheduler.queued == 5
+        await asyncio.gather(*calls)
+        return order, scheduler
+
+    order, scheduler = asyncio.run(run())
+    assert order == ["a", "b", "c", "a", "a"]
+    assert (scheduler.active, scheduler.queued) == (0, 0)
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        scheduler = _scheduler()
+        async with scheduler.slot("a"):
+            waiting = asyncio.create_task(scheduler.call("b", 0, asyncio.sleep))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            assert scheduler.queued == 0
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler.active == 0
+
+def test_token_bucket_delays_admission():
+    async def run():
+        # 6000 tokens a minute is 100 a second; the first call empties the bucket.
+        scheduler = _scheduler(max_concurrency=10, tokens_per_minute=6000)
+        await scheduler.call("a", 6000, lambda: asyncio.sleep(0))
+        start = time.monotonic()
+        await scheduler.call("a", 30, lambda: asyncio.sleep(0))
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.25
+
+def test_rate_limit_errors_are_retried():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ResourceExhausted("429 quota exceeded")
+        return "done"
+
+    assert asyncio.run(_scheduler(max_retries=3).call("a", 0, flaky)) == "done"
+    assert len(attempts) == 3
+
+def test_retries_give_up_and_other_errors_are_not_retried():
+    attempts = []
+
+    async def throttled():
+        attempts.append(1)
+        raise ResourceExhausted("quota")
+
+    async def broken():
+        attempts.append(1)
+        raise RuntimeError("bad request")
+
+    with pytest.raises(ResourceExhausted):
+        asyncio.run(_scheduler(max_retries=2).call("a", 0, throttled))
+    assert len(attempts) == 3
+    attempts.clear()
+    with pytest.raises(RuntimeError):
+        asyncio.run(_scheduler().call("a", 0, broken))
+    assert len(attempts) == 1
+
+def test_stream_is_not_retried_after_output():
+    attempts = []
+
+    async def stream():
+        attempts.append(1)
+        yield "first"
+        raise ResourceExhausted("quota")
+
+    async def run():
+        return [item async for item in _scheduler().stream("a", 0, stream)]
+
+    with pytest.raises(ResourceExhausted):
+        asyncio.run(run())
+    assert len(attempts) == 1
+
+def test_rate_limit_detection_follows_causes():
+    try:
+        try:
+            raise ResourceExhausted("quota")
+        except ResourceExhausted as e:
+            raise RuntimeError("wrapped") from e
+    except RuntimeError as wrapped:
+        assert is_rate_limit_error(wrapped)
+    assert not is_rate_limit_error(ValueError("bad input"))
+
+class StatusError(Exception):
+    """A provider error that only carries its status, like google-genai's `APIError`."""
+    def __init__(self, message: str, code: int | None = None, status: str | None = None):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+def test_rate_limit_detection_uses_status_codes_not_messages():
+    assert is_rate_limit_error(StatusError("quota", code=429))
+    assert is_rate_limit_error(StatusError("quota", status="RESOURCE_EXHAUSTED"))
+    assert not is_rate_limit_error(StatusError("prompt is 4290 tokens", code=400))
+    assert not is_rate_limit_error(ValueError("429 rate limit RESOURCE_EXHAUSTED"))
+
+def test_try_acquire_never_jumps_the_queue():
+    async def run():
+        scheduler = _scheduler(max_concurrency=2)
+        assert scheduler.try_acquire()
+        async with scheduler.slot("a"):
+            assert not scheduler.try_acquire()
+        scheduler.release()
+        return scheduler
+
+    assert asyncio.run(run()).active == 0
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+
+from app.services.llm_scheduler import LLMScheduler
+from app.services.model_router import ModelRouter
+
+def _scheduler(**kwargs) -> LLMScheduler:
+    return LLMScheduler(**{"max_concurrency": 1, "retry_base_delay": 0.0, **kwargs})
+
+class SlowFirstModel:
+    """The first request stalls, so a hedge fires; later ones answer quickly."""
+    def __init__(self, first_delay: float = 0.3):
+        self.first_delay = first_delay
+        self.requests = 0
+
+    async def ainvoke(self, messages):
+        self.requests += 1
+        await asyncio.sleep(self.first_delay if self.requests == 1 else 0.01)
+        return AIMessage(content=f"reply {self.requests}")
+
+    async def astream(self, messages):
+        self.requests += 1
+        await asyncio.sleep(self.first_delay if self.requests == 1 else 0.01)
+        yield AIMessageChunk(content=f"reply {self.requests}")
+
+@pytest.mark.parametrize("streaming", [False, True])
+@pytest.mark.parametrize("max_concurrency, requests", [(1, 1), (2, 2)])
+def test_hedges_need_a_free_slot(streaming, max_concurrency, requests):
+    async def run():
+        scheduler = _scheduler(max_concurrency=max_concurrency)
+        model = SlowFirstModel()
+        router = ModelRouter({"m": model}, primary="m", hedge_default_delay=0.05, scheduler=scheduler)
+        prompt = [HumanMessage(content="hi")]
+        if streaming:
+            chunks = [chunk async for chunk in scheduler.stream("a", 10, lambda: router.astream(prompt, 10))]
+            served = chunks[0][1].content
+        else:
+            served = (await scheduler.call("a", 10, lambda: router.ainvoke(prompt, 10)))[1].content
+        return model.requests, served, scheduler.active
+
+    sent, served, active = asyncio.run(run())
+    assert sent == requests
+    # With room for the hedge, the quick second request wins.
+    assert served == f"reply {requests}"
+    assert active == 0
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_a_winning_hedge_is_timed_from_its_own_start(streaming):
+    async def run():
+        router = ModelRouter({"m": SlowFirstModel(first_delay=1.0)}, primary="m", hedge_default_delay=0.2)
+        prompt = [HumanMessage(content="hi")]
+        if streaming:
+            [(_, chunk)] = [item async for item in router.astream(prompt, 10)]
+        else:
+            _, chunk = await router.ainvoke(prompt, 10)
+        return chunk.content, router._latency[("m", streaming)].percentile(50)
+
+    served, latency = asyncio.run(run())
+    assert served == "reply 2"
+    # Timed from the original request it would be past the 0.2s hedge delay.
+    assert latency < 0.15
+
+def test_failed_race_raises_the_error_not_a_cancellation():
+    async def run():
+        router = ModelRouter({"m": SlowFirstModel()}, primary="m")
+
+        async def fail():
+            raise ValueError("boom")
+
+        cancelled = asyncio.create_task(asyncio.sleep(10))
+        cancelled.cancel()
+        await router._first_success([cancelled, asyncio.create_task(fail())])
+
+    with pytest.raises(ValueError, match="boom"):
+        asyncio.run(run())
@@ -0,0 +1,70 @@
+import datetime
+
+import pytest
+
+from app.core.pagination import decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor
+from app.services.chat_service import ChatService
+
+from conftest import T0
+
+def _same_time_messages(storage, chat, count: int):
+    # A turn's messages can share a timestamp; ids alone order them.
+    storage.add_messages(chat.id, chat.userId, [
+        {"id": f"m{i:02d}", "content": f"message {i}", "role": "user", "timestamp": T0} for i in range(count)
+    ])
+    return [f"m{i:02d}" for i in range(count)]
+
+def _page_all(fetch):
+    ids, cursor = [], None
+    while True:
+        page, cursor = fetch(cursor)
+        ids.append([item.id for item in page])
+        if cursor is None:
+            return ids
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(T0, "m1")) == (T0, "m1")
+    assert decode_rank_cursor(encode_rank_cursor(1.25, "m1")) == (1.25, "m1")
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", encode_rank_cursor(1.0, "m1")])
+def test_bad_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_backward_paging_with_equal_timestamps(storage, chat):
+    ids = _same_time_messages(storage, chat, 7)
+    service = ChatService(storage, None)
+
+    pages = _page_all(lambda cursor: service.get_messages_page(chat.id, 3, before=cursor))
+
+    assert pages == [ids[4:], ids[1:4], ids[:1]]
+
+def test_forward_paging_with_equal_timestamps(storage, chat):
+    ids = _same_time_messages(storage, chat, 7)
+    service = ChatService(storage, None)
+    start = encode_cursor(T0 - datetime.timedelta(seconds=1), "")
+
+    pages = _page_all(lambda cursor: service.get_messages_page(chat.id, 3, after=cursor or start))
+
+    assert pages == [ids[:3], ids[3:6], ids[6:]]
+
+def test_chat_list_paging_with_equal_timestamps(storage, user):
+    created = [storage.create_chat(user.uid, f"chat {i}") for i in range(5)]
+    with storage._transaction() as conn:
+        conn.execute("UPDATE chats SET createdAt = 0, lastMessageAt = 0")
+    storage.chat_cache.clear()
+    service = ChatService(storage, None)
+
+    for sort in ("createdAt", "lastMessageAt"):
+        pages = _page_all(lambda cursor: service.get_chats_page(user, 2, after=cursor, sort=sort))
+        ids = [chat_id for page in pages for chat_id in page]
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert ids == sorted((chat.id for chat in created), reverse=True)
+
+def test_messages_after_a_cursor_id_resume_in_place(storage, chat):
+    ids = _same_time_messages(storage, chat, 4)
+
+    messages, has_more = storage.list_messages(chat.id, 10, after=T0, after_id=ids[1])
+
+    assert [m.id for m in messages] == ids[2:]
+    assert not has_more
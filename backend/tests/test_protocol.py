@@ -0,0 +1,74 @@
+import json
+import zlib
+
+import pytest
+
+from app.models.message import Message, MessageMetadata, ResumeFrame, SendFrame, StopFrame
+from app.services.protocol import (
+    JSON_CODEC, JSON_SUBPROTOCOL, LEGACY_CODEC, MSGPACK_SUBPROTOCOL, MsgpackCodec, negotiate
+)
+
+from conftest import T0
+
+msgpack = pytest.importorskip("msgpack")
+
+def _message(content: str = "hello") -> Message:
+    return Message(
+        id="m1", chatId="c1", userId="u1", role="assistant", content=content, timestamp=T0,
+        metadata=MessageMetadata(model="gemini", responseTime=0.5, tokenCount=42),
+    )
+
+def _unpack(frame: bytes) -> dict:
+    body = zlib.decompress(frame[1:]) if frame[:1] == b"\x01" else frame[1:]
+    return msgpack.unpackb(body)
+
+def _pack(frame: dict) -> bytes:
+    return b"\x00" + msgpack.packb(frame)
+
+def test_negotiation():
+    assert negotiate([MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL])[1] == MSGPACK_SUBPROTOCOL
+    assert negotiate([JSON_SUBPROTOCOL]) == (JSON_CODEC, JSON_SUBPROTOCOL)
+    assert negotiate([]) == (LEGACY_CODEC, None)
+
+def test_legacy_text_is_always_content():
+    for text in ("hello", '{"type":"stop"}', '{"type":"send","content":"x"}'):
+        assert LEGACY_CODEC.decode(text) == SendFrame(content=text)
+
+def test_json_subprotocol_parses_typed_frames_only():
+    assert JSON_CODEC.decode('{"type":"send","content":"hi","ref":"r1"}') == SendFrame(content="hi", ref="r1")
+    assert JSON_CODEC.decode('{"type":"stop"}') == StopFrame()
+    resume = JSON_CODEC.decode('{"type":"resume","after":"2026-01-01T00:00:00Z","afterId":"m1"}')
+    assert resume == ResumeFrame(after=T0, afterId="m1")
+    assert JSON_CODEC.decode("bare text") is None
+    assert JSON_CODEC.decode(b"\x00binary") is None
+
+def test_outgoing_frames_leave_out_token_counts():
+    frame = _message().model_dump_json()
+    assert "tokenCount" not in frame
+    assert json.loads(frame)["metadata"] == {"model": "gemini", "responseTime": 0.5, "cacheHit": None, "truncated": None}
+
+def test_msgpack_message_round_trip():
+    codec = MsgpackCodec(compress_min_bytes=0)
+    frame = _unpack(codec.encode(_message().model_dump_json()))
+    assert frame == {
+        "t": "message", "i": "m1", "u": "u1", "r": "assistant", "c": "hello",
+        "ts": int(T0.timestamp() * 1000), "md": {"mo": "gemini", "rt": 0.5},
+    }
+
+def test_msgpack_compresses_large_frames():
+    codec = MsgpackCodec(compress_min_bytes=200)
+    small, large = codec.encode(_message("hi").model_dump_json()), codec.encode(_message("x" * 500).model_dump_json())
+    assert small[:1] == b"\x00"
+    assert large[:1] == b"\x01"
+    assert len(large) < 500
+    assert _unpack(large)["c"] == "x" * 500
+
+def test_msgpack_client_frames():
+    codec = MsgpackCodec(compress_min_bytes=0)
+    assert codec.decode(_pack({"t": "send", "c": "hi", "rf": "r1"})) == SendFrame(content="hi", ref="r1")
+    assert codec.decode(_pack({"t": "stop"})) == StopFrame()
+    after = int(T0.timestamp() * 1000)
+    assert codec.decode(_pack({"t": "resume", "a": after, "ai": "m1"})) == ResumeFrame(after=T0, afterId="m1")
+    assert codec.decode(b"\x01" + zlib.compress(msgpack.packb({"t": "stop"}))) == StopFrame()
+    assert codec.decode(b"\x00garbage") is None
+    assert codec.decode("text") is None
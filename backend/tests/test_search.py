@@ -0,0 +1,138 @@
+import pytest
+
+from app.services import search
+from app.services.chat_service import ChatService
+
+def test_tokenize_drops_stop_words_and_long_tokens():
+    assert search.tokenize("The Quick brown fox, and THE dog!") == ["quick", "brown", "fox", "dog"]
+    assert search.tokenize("x" * (search.MAX_TERM_CHARS + 1) + " ok") == ["ok"]
+
+def test_query_terms_are_distinct_and_capped(monkeypatch):
+    monkeypatch.setattr(search.settings, "SEARCH_MAX_QUERY_TERMS", 2)
+    assert search.query_terms("apple Apple pear plum") == ["apple", "pear"]
+
+def test_posting_round_trip():
+    assert search.unpack_posting(search.pack_posting(3, 1_000_000)) == (3, 1_000_000)
+
+def test_bm25_prefers_frequent_terms_short_messages_and_rare_terms():
+    postings = {
+        "apple": {
+            "often": search.pack_posting(3, 10),
+            "once": search.pack_posting(1, 10),
+            "once_long": search.pack_posting(1, 100),
+        },
+        "kiwi": {"rare": search.pack_posting(1, 10)},
+    }
+    scores = search.bm25(postings, {}, documents=10, total_length=300)
+    assert scores["often"] > scores["once"] > scores["once_long"]
+    # "kiwi" is in one message of ten, "apple" in three: the rarer term counts for more.
+    assert scores["rare"] > scores["once"]
+
+def test_bm25_uses_the_frequency_of_postings_left_unread():
+    postings = {"apple": {"m1": search.pack_posting(1, 10)}}
+    read = search.bm25(postings, {}, documents=10, total_length=100)
+    capped = search.bm25(postings, {"apple": 5}, documents=10, total_length=100)
+    assert capped["m1"] < read["m1"]
+
+def test_snippet_centres_on_the_match(monkeypatch):
+    monkeypatch.setattr(search.settings, "SEARCH_SNIPPET_CHARS", 30)
+    text = "lorem ipsum dolor sit amet " * 4 + "the needle is here " + "consectetur adipiscing elit " * 4
+    snippet = search.snippet(text, ["needle"])
+    assert "needle" in snippet
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert len(snippet) <= 32
+
+def test_index_tracks_postings_and_totals(storage, chat):
+    storage.add_messages(chat.id, chat.userId, [
+        {"id": "m1", "content": "apple apple pear", "role": "user"},
+        {"id": "m2", "content": "pear plum", "role": "assistant"},
+    ])
+
+    postings, frequencies, documents, total_length = storage.get_search_postings(chat.userId, ["apple", "pear", "kiwi"])
+
+    assert postings == {
+        "apple": {"m1": search.pack_posting(2, 3)},
+        "pear": {"m1": search.pack_posting(1, 3), "m2": search.pack_posting(1, 2)},
+    }
+    assert frequencies == {"apple": 1, "pear": 2}
+    assert (documents, total_length) == (2, 5)
+
+def test_search_version_moves_with_the_index_only(storage, user):
+    assert storage.get_search_version(user.uid) == 0
+    chat = storage.create_chat(user.uid, "Fruit")
+    assert storage.get_search_version(user.uid) == 0
+
+    storage.add_messages(chat.id, user.uid, [{"content": "apple", "role": "user"}])
+    assert storage.get_search_version(user.uid) == 1
+    storage.rebuild_search_index()
+    assert storage.get_search_version(user.uid) == 2
+    assert storage.get_search_version("nobody") is None
+
+def test_rebuild_matches_incremental_index(storage, chat):
+    storage.add_messages(chat.id, chat.userId, [{"content": f"apple {i} pear", "role": "user"} for i in range(5)])
+    before = storage.get_search_postings(chat.userId, ["apple", "pear"])
+
+    assert storage.rebuild_search_index() == 5
+    assert storage.get_search_postings(chat.userId, ["apple", "pear"]) == before
+
+@pytest.fixture
+def searchable(storage, user):
+    chats = [storage.create_chat(user.uid, f"chat {i}") for i in range(4)]
+    for chat in chats:
+        storage.add_messages(chat.id, user.uid, [
+            {"content": "apple " * (n + 1) + "pear", "role": "user"} for n in range(3)
+        ])
+    return chats
+
+def test_search_pages_through_every_hit_in_rank_order(storage, user, searchable):
+    service = ChatService(storage, None)
+    hits, cursor = [], None
+    while True:
+        page, cursor = service.search_messages(user, "apple", 5, cursor)
+        hits += page
+        if cursor is None:
+            break
+
+    assert len(hits) == 12
+    assert len({hit.messageId for hit in hits}) == 12
+    assert [hit.score for hit in hits] == sorted((hit.score for hit in hits), reverse=True)
+    assert hits[0].snippet == "apple apple apple pear"
+    assert {hit.chatTitle for hit in hits} == {f"chat {i}" for i in range(4)}
+
+def test_later_pages_reuse_the_ranking(storage, user, searchable):
+    reads = []
+    get_search_postings = storage.get_search_postings
+    storage.get_search_postings = lambda *args: reads.append(args) or get_search_postings(*args)
+    service = ChatService(storage, None)
+
+    first, cursor = service.search_messages(user, "apple", 5)
+    second, _ = service.search_messages(user, "apple", 5, cursor)
+    assert len(reads) == 1
+    assert not {hit.messageId for hit in first} & {hit.messageId for hit in second}
+
+    # A new message moves searchVersion, so the next search ranks again and finds it.
+    storage.add_messages(searchable[0].id, user.uid, [{"content": "apple " * 9, "role": "user"}])
+    hits, _ = service.search_messages(user, "apple", 5)
+    assert len(reads) == 2
+    assert hits[0].snippet == ("apple " * 9).strip()
+
+def test_search_fills_the_page_past_hits_it_cannot_show(storage, user, searchable):
+    with storage._transaction() as conn:
+        conn.execute("UPDATE chats SET userId = 'someone-else' WHERE id = ?", (searchable[0].id,))
+    storage.chat_cache.clear()
+    fetched = []
+    fetch_chats = storage._fetch_chats
+    storage._fetch_chats = lambda chat_ids: fetched.append(len(chat_ids)) or fetch_chats(chat_ids)
+    service = ChatService(storage, None)
+
+    hits, cursor = service.search_messages(user, "apple", 10, None)
+
+    assert len(hits) == 9
+    assert cursor is None
+    assert searchable[0].id not in {hit.chatId for hit in hits}
+    # Chats are read a batch of hits at a time, each at most once.
+    assert len(fetched) <= 2
+    assert sum(fetched) == 4
+
+def test_search_without_terms_is_empty(storage, user, searchable):
+    assert ChatService(storage, None).search_messages(user, "the and of", 10) == ([], None)
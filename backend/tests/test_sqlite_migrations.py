@@ -0,0 +1,89 @@
+import sqlite3
+
+import pytest
+
+from app.services.sqlite_service import SQLiteService, _to_micros
+
+from conftest import T0
+
+# The first released schema: no chat list versions, latest-message fields or search index.
+OLD_SCHEMA = """
+CREATE TABLE users (
+    uid TEXT PRIMARY KEY, email TEXT NOT NULL, displayName TEXT, createdAt INTEGER NOT NULL, lastLoginAt INTEGER
+);
+CREATE TABLE chats (
+    id TEXT PRIMARY KEY, userId TEXT NOT NULL, title TEXT NOT NULL, createdAt INTEGER NOT NULL,
+    messageCount INTEGER NOT NULL DEFAULT 0, isActive INTEGER NOT NULL DEFAULT 1,
+    cacheResponses INTEGER NOT NULL DEFAULT 1, summary TEXT, summarizedThrough INTEGER
+);
+CREATE TABLE messages (
+    id TEXT PRIMARY KEY, chatId TEXT NOT NULL, userId TEXT NOT NULL, role TEXT NOT NULL,
+    content TEXT NOT NULL, timestamp INTEGER NOT NULL, metadata TEXT
+);
+"""
+
+@pytest.fixture
+def old_database(tmp_path):
+    path = str(tmp_path / "chatbot.db")
+    created = _to_micros(T0)
+    conn = sqlite3.connect(path)
+    conn.executescript(OLD_SCHEMA)
+    conn.execute("INSERT INTO users VALUES ('u1', 'u1@example.com', NULL, ?, NULL)", (created,))
+    conn.executemany("INSERT INTO chats (id, userId, title, createdAt, messageCount) VALUES (?, 'u1', ?, ?, ?)", [
+        ("c1", "with messages", created, 2),
+        ("c2", "empty", created, 0),
+    ])
+    conn.executemany("INSERT INTO messages VALUES (?, 'c1', 'u1', ?, ?, ?, NULL)", [
+        ("m1", "user", "how do apples grow", created + 1),
+        ("m2", "assistant", "apples grow on trees", created + 2),
+    ])
+    conn.commit()
+    conn.close()
+    return path
+
+def _columns(storage, table):
+    with storage._connection() as conn:
+        return {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def test_upgrade_adds_columns_and_backfills(old_database):
+    storage = SQLiteService(old_database, pool_size=2)
+    try:
+        assert {"chatsVersion", "searchDocuments", "searchLength", "searchVersion"} <= _columns(storage, "users")
+        assert {"lastMessageAt", "lastMessagePreview", "lastMessageRole"} <= _columns(storage, "chats")
+        with storage._connection() as conn:
+            indexes = {row["name"] for row in conn.execute("PRAGMA index_list(chats)")}
+        assert "chats_user_last_message" in indexes
+
+        chat = storage.get_chat("c1", "u1")
+        assert chat.lastMessagePreview == "apples grow on trees"
+        assert chat.lastMessageRole == "assistant"
+        assert chat.lastMessageAt == storage.list_messages("c1", 10)[0][-1].timestamp
+        assert storage.get_chat("c2", "u1").lastMessageAt == T0
+        # Cached chat lists predate the backfill.
+        assert storage.get_chats_version("u1") > 0
+
+        postings, frequencies, documents, total_length = storage.get_search_postings("u1", ["apples"])
+        assert set(postings["apples"]) == {"m1", "m2"}
+        assert frequencies == {"apples": 2}
+        assert storage.get_search_version("u1") > 0
+        assert (documents, total_length) == (2, 7)
+    finally:
+        storage.close()
+
+def test_upgrade_runs_once(old_database, monkeypatch):
+    SQLiteService(old_database, pool_size=1).close()
+    calls = []
+    monkeypatch.setattr(SQLiteService, "backfill_chat_activity", lambda self: calls.append("backfill"))
+    monkeypatch.setattr(SQLiteService, "rebuild_search_index", lambda self: calls.append("rebuild"))
+
+    storage = SQLiteService(old_database, pool_size=1)
+    try:
+        assert calls == []
+        assert storage.get_chats_version("u1") == 1
+    finally:
+        storage.close()
+
+def test_new_database_has_current_schema(storage):
+    assert "chatsVersion" in _columns(storage, "users")
+    assert "lastMessageAt" in _columns(storage, "chats")
+    assert _columns(storage, "search_postings") == {"userId", "term", "messageId", "posting"}
@@ -0,0 +1,248 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from starlette.requests import HTTPConnection
+
+from app.core import dependencies
+from app.services.protocol import JSON_SUBPROTOCOL
+from conftest import T0
+from app.main import app
+from app.services.broadcast import MemoryBroadcast
+from app.services.chat_service import ChatService
+from app.services.connection_manager import ConnectionManager
+
+class FakeLangChain:
+    """Streams a canned reply in `chunks`; `gate`, when set, holds the reply after the first chunk."""
+    def __init__(self, chunks=("Hel", "lo"), gate: asyncio.Event | None = None):
+        self.chunks = chunks
+        self.gate = gate
+        self.aborted = False
+
+    async def asummarize(self, previous_summary, chat_history, user_id=None):
+        return None
+
+    async def astream_response(self, chat_history, prompt, summary, user_id=None):
+        try:
+            for index, chunk in enumerate(self.chunks):
+                if index == 1 and self.gate is not None:
+                    await self.gate.wait()
+                yield {"delta": chunk}
+            yield {"content": "".join(self.chunks), "metadata": {}}
+        except (asyncio.CancelledError, GeneratorExit):
+            self.aborted = True
+            raise
+
+@pytest.fixture
+def langchain():
+    return FakeLangChain()
+
+@pytest.fixture
+def workers():
+    """Two "workers": connection managers sharing one broadcast backend. Sockets pick one with ?worker=."""
+    backend = MemoryBroadcast()
+    return {"a": ConnectionManager(backend), "b": ConnectionManager(backend)}
+
+@pytest.fixture
+def client(storage, user, langchain, workers):
+    service = ChatService(storage, langchain)
+    app.dependency_overrides[dependencies.get_firebase_service] = lambda: storage
+    app.dependency_overrides[dependencies.get_chat_service] = lambda: service
+
+    def manager_for(connection: HTTPConnection) -> ConnectionManager:
+        return workers[connection.query_params.get("worker", "a")]
+
+    app.dependency_overrides[dependencies.get_connection_manager] = manager_for
+    with (
+        mock.patch("app.main.initialize_firebase"),
+        mock.patch("app.api.websocket.verify_token", return_value={"uid": user.uid}),
+        TestClient(app) as test_client,
+    ):
+        yield test_client
+    app.dependency_overrides.clear()
+
+def _url(chat, **params) -> str:
+    query = "&".join(f"{key}={value}" for key, value in {"token": "t", **params}.items())
+    return f"/ws/{chat.id}?{query}"
+
+def _turn(websocket) -> list[dict]:
+    """Reads one turn as a plain socket sees it: the user message, then the reply."""
+    return [websocket.receive_json(), websocket.receive_json()]
+
+def test_every_socket_in_the_chat_gets_the_turn(client, chat):
+    with client.websocket_connect(_url(chat)) as sender, client.websocket_connect(_url(chat)) as other:
+        sender.send_text("hi")
+        sent, received = _turn(sender), _turn(other)
+
+    assert [(m["role"], m["content"]) for m in sent] == [("user", "hi"), ("assistant", "Hello")]
+    assert received == sent
+
+def test_turns_reach_sockets_on_other_workers(client, chat, workers):
+    with (
+        client.websocket_connect(_url(chat, worker="a")) as sender,
+        client.websocket_connect(_url(chat, worker="b")) as remote,
+    ):
+        sender.send_text("hi")
+        sent, received = _turn(sender), _turn(remote)
+
+    assert received == sent
+    assert not workers["a"].active_connections and not workers["b"].active_connections
+
+def test_streaming_sockets_get_deltas_and_plain_ones_the_whole_reply(client, chat):
+    with (
+        client.websocket_connect(_url(chat, stream="true")) as streaming,
+        client.websocket_connect(_url(chat, worker="b")) as plain,
+    ):
+        streaming.send_text("hi")
+        frames = [streaming.receive_json() for _ in range(4)]
+        messages = _turn(plain)
+
+    user, first, second, final = frames
+    assert user == messages[0]
+    assert [(f["type"], f["seq"], f["delta"]) for f in (first, second)] == [("delta", 0, "Hel"), ("delta", 1, "lo")]
+    assert final["type"] == "final" and final["message"] == messages[1]
+    assert first["messageId"] == final["messageId"] == messages[1]["id"]
+
+def _connection(client, manager, chat, count: int):
+    """Waits until `manager` has `count` sockets in the chat; returns the newest one's `ClientConnection`."""
+    for _ in range(200):
+        connections = client.portal.call(lambda: list(manager.active_connections.get(chat.id, {}).values()))
+        if len(connections) == count:
+            return connections[-1]
+        time.sleep(0.01)
+    raise AssertionError("socket never registered")
+
+def _stall(client, connection):
+    """Holds the socket's writer on its next frame; returns a function that lets it go."""
+    gate = asyncio.Event()
+    send_text = connection.websocket.send_text
+
+    async def stalled(message):
+        await gate.wait()
+        await send_text(message)
+
+    connection.websocket.send_text = stalled
+    return lambda: client.portal.call(gate.set)
+
+@contextmanager
+def _slow_consumer(client, chat, langchain, workers, policy):
+    """
+    Runs a ten-delta turn past a stalled streaming socket with room for two queued
+    frames. Yields the socket's session, its `ClientConnection`, and the stall's release.
+    """
+    langchain.chunks = tuple(f"c{i}" for i in range(10))
+    manager = workers["b"]
+    manager.max_queue, manager.slow_consumer_policy = 2, policy
+    with client.websocket_connect(_url(chat, worker="b")) as fast:
+        _connection(client, manager, chat, 1)
+        with client.websocket_connect(_url(chat, worker="b", stream="true")) as slow:
+            connection = _connection(client, manager, chat, 2)
+            release = _stall(client, connection)
+            fast.send_text("hi")
+            # The plain reply is published after the final frame, so the stalled socket has been offered everything.
+            _turn(fast)
+            yield slow, connection, release
+
+def test_drop_policy_discards_what_does_not_fit(client, chat, langchain, workers):
+    with _slow_consumer(client, chat, langchain, workers, "drop") as (slow, connection, release):
+        release()
+        frames = [slow.receive_json() for _ in range(3)]
+
+    assert frames[0]["content"] == "hi"
+    assert [f["delta"] for f in frames[1:]] == ["c0", "c1"]
+    # The other eight deltas and the final frame.
+    assert connection.dropped == 9
+
+def test_coalesce_policy_drops_deltas_and_keeps_the_final_frame(client, chat, langchain, workers):
+    with _slow_consumer(client, chat, langchain, workers, "coalesce") as (slow, connection, release):
+        release()
+        user, final = slow.receive_json(), slow.receive_json()
+
+    assert user["content"] == "hi"
+    assert final["type"] == "final" and final["message"]["content"] == "".join(langchain.chunks)
+    # Every delta: the queue is cleared of them whenever it fills, last of all for the final frame.
+    assert connection.dropped == 10
+
+def test_disconnect_policy_closes_the_slow_socket(client, chat, langchain, workers):
+    with _slow_consumer(client, chat, langchain, workers, "disconnect") as (slow, _, _):
+        with pytest.raises(WebSocketDisconnect) as closed:
+            slow.receive_json()
+        gone = client.portal.call(lambda: len(workers["b"].active_connections[chat.id]))
+
+    assert closed.value.code == 1013
+    assert gone == 1
+
+def test_stop_frame_ends_the_reply_and_keeps_the_partial_text(client, storage, chat, langchain):
+    langchain.gate = asyncio.Event()
+    with client.websocket_connect(_url(chat, stream="true"), subprotocols=[JSON_SUBPROTOCOL]) as websocket:
+        websocket.send_json({"type": "send", "content": "hi"})
+        user, delta = websocket.receive_json(), websocket.receive_json()
+        websocket.send_json({"type": "stop"})
+        final = websocket.receive_json()
+
+    assert user["content"] == "hi" and delta["delta"] == "Hel"
+    assert final["type"] == "final" and final["seq"] == 1
+    assert final["message"]["content"] == "Hel"
+    assert final["message"]["metadata"]["truncated"] is True
+    assert langchain.aborted
+    stored, _ = storage.list_messages(chat.id, 10)
+    assert [(m.role, m.content) for m in stored] == [("user", "hi"), ("assistant", "Hel")]
+
+def test_disconnecting_mid_reply_stops_it_for_everyone(client, chat, langchain):
+    langchain.gate = asyncio.Event()
+    with client.websocket_connect(_url(chat)) as watcher:
+        with client.websocket_connect(_url(chat, stream="true"), subprotocols=[JSON_SUBPROTOCOL]) as sender:
+            sender.send_json({"type": "send", "content": "hi"})
+            sender.receive_json(), sender.receive_json()
+        user, reply = _turn(watcher)
+
+    assert user["content"] == "hi"
+    assert (reply["content"], reply["metadata"]["truncated"]) == ("Hel", True)
+    assert langchain.aborted
+
+def _after(message: dict) -> dict:
+    """Resume query parameters for a client whose last message is `message`."""
+    return {"after": message["timestamp"].replace("+00:00", "Z"), "after_id": message["id"]}
+
+def test_reconnecting_socket_is_caught_up_from_the_buffer(client, chat):
+    with client.websocket_connect(_url(chat)) as websocket:
+        websocket.send_text("one")
+        seen, _ = _turn(websocket)
+        websocket.send_text("two")
+        missed = _turn(websocket)
+        with client.websocket_connect(_url(chat, **_after(seen))) as reconnected:
+            caught_up = [reconnected.receive_json() for _ in range(3)]
+
+    assert [m["content"] for m in caught_up] == ["Hello", "two", "Hello"]
+    assert caught_up[1:] == missed
+
+def test_reconnecting_socket_pages_through_storage(client, storage, chat, workers):
+    storage.add_messages(chat.id, chat.userId, [{"content": f"message {i}", "role": "user"} for i in range(7)])
+    # Worker b has no buffer for the chat yet, and pages two messages at a time.
+    workers["b"].max_queue = 4
+    after = T0.isoformat().replace("+00:00", "Z")
+    with client.websocket_connect(_url(chat, worker="b", after=after)) as websocket:
+        caught_up = [websocket.receive_json()["content"] for _ in range(7)]
+
+    assert caught_up == [f"message {i}" for i in range(7)]
+
+def test_socket_joining_mid_turn_gets_the_unsaved_user_message(client, storage, chat, langchain, workers):
+    langchain.gate = asyncio.Event()
+    with client.websocket_connect(_url(chat, stream="true"), subprotocols=[JSON_SUBPROTOCOL]) as sender:
+        sender.send_json({"type": "send", "content": "hi"})
+        user, _ = sender.receive_json(), sender.receive_json()
+        # The turn is saved in one batch at the end, so a client loading the chat now misses "hi".
+        assert storage.list_messages(chat.id, 10)[0] == []
+        with client.websocket_connect(_url(chat, worker="b")) as joined:
+            _connection(client, workers["b"], chat, 1)
+            client.portal.call(langchain.gate.set)
+            rest = [sender.receive_json() for _ in range(2)]
+            frames = _turn(joined)
+
+    assert [f["type"] for f in rest] == ["delta", "final"]
+    assert frames[0] == user
+    assert (frames[1]["role"], frames[1]["content"]) == ("assistant", "Hello")
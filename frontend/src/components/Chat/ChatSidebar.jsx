@@ -1,12 +1,12 @@
 import React from 'react';
 import { useDispatch, useSelector } from 'react-redux';
 import { logoutUser } from '../../store/authSlice';
-import { createNewChat, setActiveChat, clearChatState } from '../../store/chatSlice';
+import { createNewChat, fetchMoreChats, setActiveChat, clearChatState } from '../../store/chatSlice';
 import { FaPlus, FaSignOutAlt } from 'react-icons/fa';
 
 const ChatSidebar = () => {
     const dispatch = useDispatch();
-    const { chats, activeChatId } = useSelector((state) => state.chat);
+    const { chats, activeChatId, chatsCursor, loadingMore } = useSelector((state) => state.chat);
 
     const handleNewChat = () => {
         const title = `New Chat ${new Date().toLocaleString()}`;
@@ -45,6 +45,16 @@ const ChatSidebar = () => {
                             </li>
                         ))}
                     </ul>
+                    {chatsCursor && (
+                        <button
+                            type="button"
+                            onClick={() => dispatch(fetchMoreChats())}
+                            disabled={loadingMore}
+                            className="block w-full p-2 text-sm text-text-secondary hover:bg-primary rounded-md"
+                        >
+                            {loadingMore ? 'Loading...' : 'Load more chats'}
+                        </button>
+                    )}
                 </nav>
             </div>
             <div className="mt-auto">
@@ -34,17 +34,21 @@
 // export default MessageList;
 
 import React, { useEffect, useRef } from 'react';
-import { useSelector } from 'react-redux';
+import { useDispatch, useSelector } from 'react-redux';
+import { fetchOlderMessages } from '../../store/chatSlice';
 import Message from './Message'; // Ensure this component is named Message.jsx
 import Loading from '../Common/Loading'; // Ensure this component is named Loading.jsx
 
 const MessageList = () => {
+    const dispatch = useDispatch();
     // Select the entire chat state
     const chatState = useSelector((state) => state.chat);
-    const { activeChatId, messages, status } = chatState;
+    const { activeChatId, messages, messageCursors, loadingMore, status } = chatState;
     
     // Get the messages for the currently active chat, or an empty array if none
     const activeMessages = messages[activeChatId] || [];
+    const hasOlder = Boolean(messageCursors[activeChatId]);
+    const newestId = activeMessages.length ? activeMessages[activeMessages.length - 1].id : null;
     
     const messagesEndRef = useRef(null);
 
@@ -52,10 +56,17 @@ const MessageList = () => {
         messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
     };
 
-    // Scroll to bottom whenever the messages array for the active chat changes
+    // Scroll to bottom when a new message arrives, but not when older pages are put in front
     useEffect(() => {
         scrollToBottom();
-    }, [activeMessages]);
+    }, [newestId]);
+
+    // Reaching the top of the list loads the page before it
+    const handleScroll = (event) => {
+        if (event.currentTarget.scrollTop === 0 && hasOlder) {
+            dispatch(fetchOlderMessages(activeChatId));
+        }
+    };
 
     // Show a loading spinner if we are fetching messages for the first time
     if (status === 'loading' && activeMessages.length === 0) {
@@ -63,7 +74,17 @@ const MessageList = () => {
     }
 
     return (
-        <div className="flex-grow p-4 overflow-y-auto">
+        <div className="flex-grow p-4 overflow-y-auto" onScroll={handleScroll}>
+            {hasOlder && (
+                <button
+                    type="button"
+                    onClick={() => dispatch(fetchOlderMessages(activeChatId))}
+                    disabled={loadingMore}
+                    className="block mx-auto mb-4 px-3 py-1 text-sm text-text-secondary hover:text-white rounded-md"
+                >
+                    {loadingMore ? 'Loading...' : 'Load older messages'}
+                </button>
+            )}
             {/* Map over the activeMessages array to render each Message component */}
             {activeMessages.map((msg) => (
                 <Message key={msg.id} message={msg} />
@@ -41,8 +41,13 @@ export const loginUser = createAsyncThunk(
     }
 );
 
-// Async Thunk for User Logout (remains the same)
+// Async Thunk for User Logout: revokes the session on the backend, then signs out locally
 export const logoutUser = createAsyncThunk('auth/logoutUser', async () => {
+    try {
+        await api.post('/auth/logout');
+    } catch (error) {
+        // Signing out locally still works when the backend can't be reached.
+    }
     await signOut(auth);
 });
 
@@ -1,19 +1,45 @@
 import { createSlice, createAsyncThunk } from '@reduxjs/toolkit';
 import api from '../services/api';
 
+// The list endpoints return one page at a time and put the cursor for the next one in
+// X-Next-Cursor (absent on the last page). Only the newest page is loaded up front; the
+// cursor is kept in state and older pages are fetched when the user asks for them.
+const PAGE_SIZE = 50;
+
+const fetchPage = async (url, param, cursor) => {
+    const params = { limit: PAGE_SIZE };
+    if (cursor) {
+        params[param] = cursor;
+    }
+    const response = await api.get(url, { params });
+    return { items: response.data, cursor: response.headers['x-next-cursor'] || null };
+};
+
 // Async Thunks
 export const fetchChats = createAsyncThunk(
     'chat/fetchChats',
     async (_, { rejectWithValue }) => {
         try {
-            const response = await api.get('/chats/');
-            return response.data;
+            return await fetchPage('/chats/', 'after', null);
         } catch (error) {
             return rejectWithValue(error.response.data.detail);
         }
     }
 );
 
+export const fetchMoreChats = createAsyncThunk(
+    'chat/fetchMoreChats',
+    async (_, { getState, rejectWithValue }) => {
+        try {
+            // Newest first, so each page continues the list.
+            return await fetchPage('/chats/', 'after', getState().chat.chatsCursor);
+        } catch (error) {
+            return rejectWithValue(error.response.data.detail);
+        }
+    },
+    { condition: (_, { getState }) => Boolean(getState().chat.chatsCursor) && !getState().chat.loadingMore }
+);
+
 export const createNewChat = createAsyncThunk(
     'chat/createNewChat',
     async (title, { dispatch, rejectWithValue }) => {
@@ -31,14 +57,29 @@ export const fetchMessagesForChat = createAsyncThunk(
     'chat/fetchMessagesForChat',
     async (chatId, { rejectWithValue }) => {
         try {
-            const response = await api.get(`/chats/${chatId}/messages`);
-            return { chatId, messages: response.data };
+            const { items, cursor } = await fetchPage(`/chats/${chatId}/messages`, 'before', null);
+            return { chatId, messages: items, cursor };
         } catch (error) {
             return rejectWithValue(error.response.data.detail);
         }
     }
 );
 
+export const fetchOlderMessages = createAsyncThunk(
+    'chat/fetchOlderMessages',
+    async (chatId, { getState, rejectWithValue }) => {
+        try {
+            const { items, cursor } = await fetchPage(
+                `/chats/${chatId}/messages`, 'before', getState().chat.messageCursors[chatId]
+            );
+            return { chatId, messages: items, cursor };
+        } catch (error) {
+            return rejectWithValue(error.response.data.detail);
+        }
+    },
+    { condition: (chatId, { getState }) => Boolean(getState().chat.messageCursors[chatId]) && !getState().chat.loadingMore }
+);
+
 // Slice
 const chatSlice = createSlice({
     name: 'chat',
@@ -46,6 +87,9 @@ const chatSlice = createSlice({
         chats: [],
         activeChatId: null,
         messages: {}, // { chatId: [messages] }
+        chatsCursor: null, // cursor for the next (older) page of chats, null once all are loaded
+        messageCursors: {}, // { chatId: cursor for the page before the oldest loaded message }
+        loadingMore: false,
         status: 'idle',
         error: null,
     },
@@ -68,6 +112,9 @@ const chatSlice = createSlice({
             state.chats = [];
             state.activeChatId = null;
             state.messages = {};
+            state.chatsCursor = null;
+            state.messageCursors = {};
+            state.loadingMore = false;
             state.status = 'idle';
             state.error = null;
         }
@@ -80,7 +127,8 @@ const chatSlice = createSlice({
             })
             .addCase(fetchChats.fulfilled, (state, action) => {
                 state.status = 'succeeded';
-                state.chats = action.payload;
+                state.chats = action.payload.items;
+                state.chatsCursor = action.payload.cursor;
             })
             .addCase(fetchChats.rejected, (state, action) => {
                 state.status = 'failed';
@@ -93,11 +141,42 @@ const chatSlice = createSlice({
             .addCase(fetchMessagesForChat.fulfilled, (state, action) => {
                 state.status = 'succeeded';
                 state.messages[action.payload.chatId] = action.payload.messages;
+                state.messageCursors[action.payload.chatId] = action.payload.cursor;
             })
             .addCase(fetchMessagesForChat.rejected, (state, action) => {
                 state.status = 'failed';
                 state.error = action.payload;
             })
+            // Older pages, fetched on demand
+            .addCase(fetchMoreChats.pending, (state) => {
+                state.loadingMore = true;
+            })
+            .addCase(fetchMoreChats.fulfilled, (state, action) => {
+                state.loadingMore = false;
+                const known = new Set(state.chats.map(c => c.id));
+                state.chats = state.chats.concat(action.payload.items.filter(c => !known.has(c.id)));
+                state.chatsCursor = action.payload.cursor;
+            })
+            .addCase(fetchMoreChats.rejected, (state, action) => {
+                state.loadingMore = false;
+                state.error = action.payload;
+            })
+            .addCase(fetchOlderMessages.pending, (state) => {
+                state.loadingMore = true;
+            })
+            .addCase(fetchOlderMessages.fulfilled, (state, action) => {
+                state.loadingMore = false;
+                const { chatId, messages, cursor } = action.payload;
+                // Each page is in chronological order and older than everything loaded, so it goes in front.
+                const loaded = state.messages[chatId] || [];
+                const known = new Set(loaded.map(m => m.id));
+                state.messages[chatId] = messages.filter(m => !known.has(m.id)).concat(loaded);
+                state.messageCursors[chatId] = cursor;
+            })
+            .addCase(fetchOlderMessages.rejected, (state, action) => {
+                state.loadingMore = false;
+                state.error = action.payload;
+            })
             // Create New Chat
             .addCase(createNewChat.fulfilled, (state, action) => {
                 state.activeChatId = action.payload.id;